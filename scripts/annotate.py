@@ -2,23 +2,32 @@
 
 import argparse
 
-from ucca.ioutil import write_passage, get_passages_with_progress_bar
-from ucca.textutil import annotate_all, is_annotated
+from ucca.ioutil import PassageWriter, get_passages_with_progress_bar
+from ucca.textutil import annotate_all, is_annotated, BATCH_SIZE
 
 desc = """Read UCCA standard format in XML or binary pickle, and write back with POS tags and dependency parse."""
 
 
 def main(args):
-    for passage in annotate_all(get_passages_with_progress_bar(args.filenames, desc="Annotating"),
-                                replace=True, as_array=args.as_array, verbose=args.verbose):
-        assert is_annotated(passage, args.as_array), "Passage %s is not annotated" % passage.ID
-        write_passage(passage, outdir=args.out_dir, verbose=args.verbose)
+    with PassageWriter(outdir=args.out_dir, shards=args.shards, verbose=args.verbose) as writer:
+        for passage in annotate_all(get_passages_with_progress_bar(args.filenames, desc="Annotating"),
+                                    replace=True, as_array=args.as_array, verbose=args.verbose,
+                                    n_process=args.n_process, batch_size=args.batch_size,
+                                    lang_window=args.lang_window):
+            assert is_annotated(passage, args.as_array), "Passage %s is not annotated" % passage.ID
+            writer.write(passage)
 
 
 if __name__ == '__main__':
     argparser = argparse.ArgumentParser(description=desc)
     argparser.add_argument("filenames", nargs="+", help="passage file names to annotate")
     argparser.add_argument("-o", "--out-dir", default=".", help="directory to write annotated files to")
+    argparser.add_argument("-s", "--shards", type=int, default=0,
+                           help="number of shard files to write passages to, rather than a file per passage")
     argparser.add_argument("-a", "--as-array", action="store_true", help="save annotations as array in passage level")
+    argparser.add_argument("-j", "--n-process", type=int, default=1, help="number of processes to annotate in")
+    argparser.add_argument("-b", "--batch-size", type=int, default=BATCH_SIZE, help="paragraphs to annotate together")
+    argparser.add_argument("-w", "--lang-window", type=int,
+                           help="number of passages to read ahead and annotate grouped by language")
     argparser.add_argument("-v", "--verbose", action="store_true", help="print tagged text for each passage")
     main(argparser.parse_args())
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+
+from ucca import textutil
+from ucca.ioutil import get_passages
+from ucca.layer0 import LAYER_ID
+
+desc = """Measure spaCy model loading time and annotation speed for different sets of required attributes."""
+
+ATTR_SETS = (
+    ("tokens", (textutil.Attr.ORTH,)),
+    ("sentences", textutil.SENTENCE_ATTRS),
+    ("pos", (textutil.Attr.POS,)),
+    ("all", None),
+)
+
+
+def main(args):
+    passages = list(get_passages(args.filenames))
+    n_tokens = sum(len(p.layer(LAYER_ID).all) for p in passages)
+    print("%-10s %10s %12s" % ("attrs", "load (s)", "tokens/s"))
+    for name, attrs in ATTR_SETS:
+        textutil.nlp.pop(args.lang, None)  # Measure loading from scratch
+        textutil.loaded_components.pop(args.lang, None)
+        started = time.time()
+        textutil.get_nlp(args.lang, attrs)
+        loaded = time.time()
+        for _ in textutil.annotate_all(passages, replace=True, lang=args.lang, attrs=attrs,
+                                       batch_size=args.batch_size):
+            pass
+        print("%-10s %10.3f %12.1f" % (name, loaded - started, n_tokens / (time.time() - loaded)))
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description=desc)
+    argparser.add_argument("filenames", nargs="+", help="passage file names to annotate")
+    argparser.add_argument("-l", "--lang", default="en", help="two-letter language code")
+    argparser.add_argument("-b", "--batch-size", type=int, default=textutil.BATCH_SIZE, help="annotation batch size")
+    main(argparser.parse_args())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import argparse
+import random
+import time
+
+from ucca import core, layer0, layer1, evaluation
+
+desc = """Measure evaluation speed on random passages with the given number of tokens."""
+
+TAGS = (layer1.EdgeTags.Participant, layer1.EdgeTags.Process, layer1.EdgeTags.State, layer1.EdgeTags.Adverbial,
+        layer1.EdgeTags.Center, layer1.EdgeTags.Elaborator, layer1.EdgeTags.Function, layer1.EdgeTags.Relator)
+
+
+def random_passage(passage_id, n_tokens, rng):
+    """Create a passage whose layer 1 is a random tree over n_tokens terminals, with some remote edges"""
+    p = core.Passage(passage_id)
+    l0 = layer0.Layer0(p)
+    l1 = layer1.Layer1(p)
+    terminals = [l0.add_terminal(text=str(i), punct=(i % 10 == 0)) for i in range(1, n_tokens + 1)]
+    units = []
+
+    def _add(parent, span):
+        if len(span) == 1 or rng.random() < .2:
+            for terminal in span:
+                if terminal.punct:
+                    l1.add_punct(parent, terminal)
+                else:
+                    parent.add(layer1.EdgeTags.Terminal, terminal)
+            return
+        split = sorted(rng.sample(range(1, len(span)), min(len(span) - 1, rng.randint(1, 3))))
+        for start, end in zip([0] + split, split + [len(span)]):
+            node = l1.add_fnode(parent, rng.choice(TAGS))
+            units.append(node)
+            _add(node, span[start:end])
+
+    for start in range(0, n_tokens, 20):
+        scene = l1.add_fnode(None, layer1.EdgeTags.ParallelScene)
+        units.append(scene)
+        _add(scene, terminals[start:start + 20])
+    for _ in range(n_tokens // 20 if len(units) > 1 else 0):  # A remote edge needs two different units
+        parent, child = rng.sample(units, 2)
+        if parent not in child.iter():
+            l1.add_remote(parent, layer1.EdgeTags.Participant, child)
+    return p
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    pairs = [[random_passage(str(i), args.tokens, rng) for _ in range(2)] for i in range(args.pairs)]
+    started = time.time()
+    for guessed, ref in pairs:
+        evaluation.evaluate(guessed, ref, normalize=args.normalize, errors=args.errors,
+                            inplace=not args.revert)
+    elapsed = time.time() - started
+    print("%d pairs of %d tokens: %.3fs per pair" % (args.pairs, args.tokens, elapsed / args.pairs))
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description=desc)
+    argparser.add_argument("-t", "--tokens", type=int, default=1000, help="number of tokens per passage")
+    argparser.add_argument("-p", "--pairs", type=int, default=10, help="number of passage pairs to evaluate")
+    argparser.add_argument("-s", "--seed", type=int, default=1, help="random seed")
+    argparser.add_argument("-N", "--no-normalize", dest="normalize", action="store_false",
+                           help="do not normalize passages before evaluation")
+    argparser.add_argument("-r", "--revert", action="store_true", help="revert the passages after normalizing them")
+    argparser.add_argument("-e", "--errors", action="store_true", help="calculate the confusion matrix too")
+    main(argparser.parse_args())
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 """The evaluation script for UCCA layer 1."""
+import os
 import sys
 from itertools import repeat
 
@@ -7,28 +8,99 @@ from argparse import ArgumentParser
 
 from ucca import evaluation, constructions, ioutil
 
+DEFAULT_NUM_SAMPLES = 1000  # For --compare without --bootstrap
+
 
 def main(args):
-    guessed, ref, ref_yield_tags = [None if x is None else ioutil.read_files_and_dirs((x,))
-                                    for x in (args.guessed, args.ref, args.ref_yield_tags)]
+    index = None
+    sources = (args.ref, args.ref_yield_tags)
+    if args.reference_index and os.path.exists(args.reference_index):  # ref and ref_yield_tags are in the index
+        index = evaluation.ReferenceIndex.load(args.reference_index)
+        mismatch = index.mismatch(constructions=args.constructions, normalize=args.normalize,
+                                  ref_yield_tags=args.ref_yield_tags is not None, sources=sources)
+        if mismatch:
+            print("Rebuilding '%s', since %s" % (args.reference_index, mismatch))
+            index = None
+    if index is None:
+        ref, ref_yield_tags = [None if x is None else ioutil.read_files_and_dirs((x,)) for x in sources]
+        if args.match_by_id:
+            ref_yield_tags = match_by_id(ref_yield_tags, ref)
+        if args.reference_index:
+            index = evaluation.ReferenceIndex(ref, ref_yield_tags, constructions=args.constructions,
+                                              normalize=args.normalize, sources=sources)
+            index.save(args.reference_index)
+            print("Wrote '%s'" % args.reference_index)
+    if index is not None:
+        ref, ref_yield_tags = list(index), None
+    guessed = ioutil.read_files_and_dirs((args.guessed,))
     if args.match_by_id:
         guessed = match_by_id(guessed, ref)
-        ref_yield_tags = match_by_id(ref_yield_tags, ref)
-    results = []
+    accumulator = evaluation.ScoreAccumulator()
+    arrays = evaluation.ScoreArrays() if args.bootstrap or args.compare else None
+    fields = []  # Only the CSV fields of each result are kept, not the results themselves
+    for result in evaluation.evaluate_corpus(
+            read_pairs(args, guessed, ref, ref_yield_tags), workers=0 if args.verbose else args.workers,
+            constructions=args.constructions, units=args.units, fscore=args.fscore, errors=args.errors,
+            verbose=args.verbose or len(guessed) == 1, normalize=args.normalize,
+            eval_type=evaluation.UNLABELED if args.unlabeled else None,
+            inplace=not args.compare):  # The references are evaluated again against args.compare
+        if args.verbose:
+            print_f1(result, args.unlabeled)
+        accumulator.add(result)
+        if arrays is not None:
+            arrays.add(result)
+        if args.out_file:
+            fields.append(result.fields())
+    summary = accumulator.scores()
+    summarize(args, summary, accumulator.num_scores, fields,
+              intervals=bootstrap(args, summary, arrays) if args.bootstrap else None)
+    if args.compare:
+        compare(args, arrays, ref, ref_yield_tags)
+
+
+def bootstrap(args, summary, arrays):
+    """
+    :return: list of (construction, lower bound, upper bound) of the F1 confidence interval, for each construction in
+             the summary, followed by (None, lower bound, upper bound) for the average F1 over primary and remote
+    """
+    eval_type = evaluation.UNLABELED if args.unlabeled else evaluation.LABELED
+    intervals = [(c, *evaluation.bootstrap(arrays.array(eval_type, c), args.bootstrap)[1:])
+                 for c in summary[eval_type].results]
+    intervals.append((None, *evaluation.bootstrap(arrays.array(eval_type), args.bootstrap)[1:]))
+    return intervals
+
+
+def compare(args, arrays, ref, ref_yield_tags):
+    """Evaluate args.compare too, and test whether the difference in average F1 from args.guessed is significant"""
+    other = ioutil.read_files_and_dirs((args.compare,))
+    if args.match_by_id:
+        other = match_by_id(other, ref)
+    other_arrays = evaluation.ScoreArrays()
+    for result in evaluation.evaluate_corpus(
+            zip(other, ref, ref_yield_tags or repeat(None)), workers=args.workers, constructions=args.constructions,
+            normalize=args.normalize, eval_type=evaluation.UNLABELED if args.unlabeled else None):
+        other_arrays.add(result)
+    eval_type = evaluation.UNLABELED if args.unlabeled else evaluation.LABELED
+    counts, other_counts = arrays.array(eval_type), other_arrays.array(eval_type)
+    num_samples = args.bootstrap or DEFAULT_NUM_SAMPLES
+    diff, low, high, p_value = evaluation.paired_bootstrap(counts, other_counts, num_samples)
+    if not args.quiet:
+        print(end="\r")
+        print("Average %s F1 difference from '%s': %.3f (95%% CI: [%.3f, %.3f])" % (
+            eval_type, args.compare, diff, low, high))
+        print("Paired bootstrap p-value (%d samples): %.4f" % (num_samples, p_value))
+        print("Approximate randomization p-value (%d samples): %.4f" % (
+            num_samples, evaluation.approximate_randomization(counts, other_counts, num_samples)))
+
+
+def read_pairs(args, guessed, ref, ref_yield_tags):
     for g, r, ryt in zip(guessed, ref, ref_yield_tags or repeat(None)):
         if len(guessed) > 1:
             sys.stdout.write("\rEvaluating %s%s" % (g.ID, ":" if args.verbose else "..."))
             sys.stdout.flush()
         if args.verbose:
             print()
-        result = evaluation.evaluate(g, r, constructions=args.constructions, units=args.units, fscore=args.fscore,
-                                     errors=args.errors, verbose=args.verbose or len(guessed) == 1,
-                                     normalize=args.normalize, ref_yield_tags=ryt,
-                                     eval_type=evaluation.UNLABELED if args.unlabeled else None)
-        if args.verbose:
-            print_f1(result, args.unlabeled)
-        results.append(result)
-    summarize(args, results)
+        yield g, r, ryt
 
 
 def match_by_id(guessed, ref):
@@ -55,9 +127,8 @@ def print_f1(result, unlabeled=False):
         evaluation.UNLABELED if unlabeled else evaluation.LABELED)))
 
 
-def summarize(args, results):
-    summary = evaluation.Scores.aggregate(results)
-    if len(results) > 1:
+def summarize(args, summary, num_results, fields, intervals=None):
+    if num_results > 1:
         if args.verbose:
             print("Aggregated scores:")
         else:
@@ -69,16 +140,24 @@ def summarize(args, results):
                     summary.print_confusion_matrix()
         if not args.quiet:
             print_f1(summary, args.unlabeled)
+            if intervals:
+                print("95%% CI (%d bootstrap samples): [%.3f, %.3f]" % ((args.bootstrap,) + intervals[-1][1:]))
     if args.out_file:
         with open(args.out_file, "w", encoding="utf-8") as f:
             print(",".join(summary.titles()), file=f)
-            for result in results:
-                print(",".join(result.fields()), file=f)
+            for result_fields in fields:
+                print(",".join(result_fields), file=f)
         print("Wrote '%s'" % args.out_file)
     if args.summary_file:
         with open(args.summary_file, "w", encoding="utf-8") as f:
-            print(",".join(summary.titles()), file=f)
-            print(",".join(summary.fields()), file=f)
+            titles, summary_fields = summary.titles(), summary.fields()
+            if intervals:  # Add columns for the confidence interval of each F1 field
+                f1_titles = [t for t in summary.titles(evaluation.UNLABELED if args.unlabeled else evaluation.LABELED)
+                             if t.endswith("_f1")]  # In the same order as intervals
+                titles += [t + suffix for t in f1_titles for suffix in ("_low", "_high")]
+                summary_fields += ["%.3f" % x for _, low, high in intervals[:-1] for x in (low, high)]
+            print(",".join(titles), file=f)
+            print(",".join(summary_fields), file=f)
         print("Wrote '%s'" % args.summary_file)
     if args.errors_file:
         with open(args.errors_file, "w", encoding="utf-8") as f:
@@ -103,6 +182,9 @@ if __name__ == "__main__":
     argparser.add_argument("-r", "--ref-yield-tags", help="xml/pickle file name for reference used for extracting edge "
                                                           "categories for fine-grained annotation "
                                                           "(--constructions categories), or directory of files")
+    argparser.add_argument("--reference-index", help="file to load the normalized reference annotation from instead "
+                                                      "of `ref', if it exists and was built from the same reference "
+                                                      "files and options, or else to save it to for later runs")
     argparser.add_argument("-u", "--units", action="store_true",
                            help="the units the annotations have in common, and those each has separately")
     argparser.add_argument("-f", "--fscore", action="store_true",
@@ -117,6 +199,13 @@ if __name__ == "__main__":
     argparser.add_argument("--out-file", help="file to write results for each evaluated passage to, in CSV format")
     argparser.add_argument("--summary-file", help="file to write aggregated results to, in CSV format")
     argparser.add_argument("--errors-file", help="file to write aggregated confusion matrix to, in CSV format")
+    argparser.add_argument("-j", "--workers", type=int, default=0,
+                           help="number of processes to evaluate passages in (ignored with -v, to keep output ordered)")
+    argparser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                           help="number of bootstrap samples for 95%% confidence intervals of the F1 scores, which are "
+                                "added to --summary-file")
+    argparser.add_argument("--compare", help="xml/pickle file name for another guessed annotation (or directory of "
+                                             "files), to test the significance of the difference from `guessed'")
     group = argparser.add_mutually_exclusive_group()
     group.add_argument("-v", "--verbose", action="store_true",
                        help="prints the results for every single pair (always true if there is only one pair)")
@@ -1,11 +1,11 @@
 #!/usr/bin/env python3
 
 import sys
-from collections import defaultdict
+from collections import OrderedDict
 
 import argparse
 
-import ucca.convert
+from ucca.convert import PassageJoiner
 from ucca.ioutil import passage2file, get_passages
 
 desc = """Parses XML/pickle files in UCCA standard format, and writes a single passage.
@@ -13,16 +13,16 @@ desc = """Parses XML/pickle files in UCCA standard format, and writes a single p
 
 
 def main(args):
-    passages = list(get_passages(args.filenames))
-    if args.join_by_prefix:
-        subsets = defaultdict(list)
-        for passage in passages:
-            subsets[passage.ID[:-3]].append(passage)
-    else:
-        subsets = {passages[0].ID: passages}
-    for passage_id, subset in sorted(subsets.items()):
-        print("Joining passages " + ", ".join(passage.ID for passage in subset), file=sys.stderr)
-        joined = ucca.convert.join_passages(passages, passage_id=passage_id, remarks=args.remarks)
+    joiners = OrderedDict()
+    for passage in get_passages(args.filenames):
+        passage_id = passage.ID[:-3] if args.join_by_prefix else next(iter(joiners), passage.ID)
+        joiner = joiners.get(passage_id)
+        if joiner is None:
+            joiner = joiners[passage_id] = PassageJoiner(passage_id=passage_id, remarks=args.remarks)
+        print("Joining passage %s into %s" % (passage.ID, passage_id), file=sys.stderr)
+        joiner.add(passage)
+    for passage_id, joiner in sorted(joiners.items()):
+        joined = joiner.passage
         outfile = "%s/%s.%s" % (args.outdir, args.prefix + joined.ID, "pickle" if args.binary else "xml")
         print("Writing joined passage file '%s'..." % outfile, file=sys.stderr)
         passage2file(joined, outfile, binary=args.binary)
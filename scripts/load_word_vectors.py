@@ -1,16 +1,22 @@
 #!/usr/bin/env python3
 
 import argparse
+import time
 
-from ucca.textutil import get_word_vectors
+from ucca.textutil import get_word_vectors, WordVectors
 
 desc = """Load word vectors file to make sure it works."""
 
 
 def main(args):
     for filename in args.filenames:
-        vectors, dim = get_word_vectors(size=args.rows, dim=args.dim, filename=filename)
-        print("Loaded %d rows, dim=%d" % (len(vectors), dim))
+        started = time.time()
+        if args.binary:
+            vectors = WordVectors.load(filename, size=args.rows, dim=args.dim)
+            dim = vectors.dim
+        else:
+            vectors, dim = get_word_vectors(size=args.rows, dim=args.dim, filename=filename)
+        print("Loaded %d rows, dim=%d (%.3fs)" % (len(vectors), dim, time.time() - started))
 
 
 if __name__ == '__main__':
@@ -18,4 +24,6 @@ if __name__ == '__main__':
     argparser.add_argument("filenames", nargs="+", help="word vector files to load")
     argparser.add_argument("-r", "--rows", type=int, help="maximum number of word vectors")
     argparser.add_argument("-d", "--dim", type=int, help="maximum dimension of word vectors")
+    argparser.add_argument("-b", "--binary", action="store_true",
+                           help="convert to memory-mapped binary files on first use, and load from them afterwards")
     main(argparser.parse_args())
@@ -1,13 +1,11 @@
 #!/usr/bin/env python3
 
-import sys
 from itertools import count
 
 import argparse
-import os
 
 from ucca.convert import split2sentences, split_passage
-from ucca.ioutil import passage2file, get_passages_with_progress_bar, external_write_mode
+from ucca.ioutil import PassageWriter, get_passages_with_progress_bar
 from ucca.normalization import normalize
 from ucca.textutil import extract_terminals
 
@@ -53,18 +51,16 @@ class Splitter:
 
 def main(args):
     splitter = Splitter.read_file(args.sentences, enum=args.enumerate)
-    os.makedirs(args.outdir, exist_ok=True)
     i = 0
-    for passage in get_passages_with_progress_bar(args.filenames, "Splitting"):
-        for sentence in splitter.split(passage) if splitter else split2sentences(
-                passage, remarks=args.remarks, lang=args.lang, ids=map(str, count(i)) if args.enumerate else None):
-            i += 1
-            outfile = os.path.join(args.outdir, args.prefix + sentence.ID + (".pickle" if args.binary else ".xml"))
-            with external_write_mode():
-                print("Writing passage file for sentence '%s'..." % outfile, file=sys.stderr)
-            if args.normalize:
-                normalize(sentence)
-            passage2file(sentence, outfile, binary=args.binary)
+    with PassageWriter(outdir=args.outdir, shards=args.shards, binary=args.binary, prefix=args.prefix,
+                       verbose=args.verbose) as writer:
+        for passage in get_passages_with_progress_bar(args.filenames, "Splitting"):
+            for sentence in splitter.split(passage) if splitter else split2sentences(
+                    passage, remarks=args.remarks, lang=args.lang, ids=map(str, count(i)) if args.enumerate else None):
+                i += 1
+                if args.normalize:
+                    normalize(sentence)
+                writer.write(sentence)
 
 
 if __name__ == "__main__":
@@ -77,6 +73,9 @@ if __name__ == "__main__":
     argparser.add_argument("-b", "--binary", action="store_true", help="write in pickle binary format (.pickle)")
     argparser.add_argument("-s", "--sentences", help="optional input file with sentence at each line to split by")
     argparser.add_argument("-e", "--enumerate", action="store_true", help="set each output sentence ID by global order")
+    argparser.add_argument("-S", "--shards", type=int, default=0,
+                           help="number of shard files to write sentences to, rather than a file per sentence")
+    argparser.add_argument("-v", "--verbose", action="store_true", help="print a message for each file written")
     argparser.add_argument("-N", "--no-normalize", dest="normalize", action="store_false",
                            help="do not normalize passages after splitting")
     main(argparser.parse_args())
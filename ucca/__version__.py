@@ -1,7 +1,28 @@
+import sys
+import types
+
 VERSION = "1.0.123"
-# noinspection PyBroadException
-try:
-    from subprocess import check_output, DEVNULL
-    GIT_VERSION = check_output(["git", "describe", "--tags", "--always"], stderr=DEVNULL).decode().strip().lstrip("v")
-except:
-    GIT_VERSION = VERSION
+
+
+def get_git_version():
+    """:return the version according to git describe, or VERSION if not in a git repository"""
+    # noinspection PyBroadException
+    try:
+        from subprocess import check_output, DEVNULL
+        return check_output(["git", "describe", "--tags", "--always"], stderr=DEVNULL).decode().strip().lstrip("v")
+    except:
+        return VERSION
+
+
+class _VersionModule(types.ModuleType):
+    """Computes GIT_VERSION only when it is accessed, since running git takes a while (a module __getattr__ would
+    require Python 3.7)"""
+    @property
+    def GIT_VERSION(self):
+        git_version = self.__dict__.get("_git_version")
+        if git_version is None:
+            git_version = self._git_version = get_git_version()
+        return git_version
+
+
+sys.modules[__name__].__class__ = _VersionModule
@@ -1,8 +1,10 @@
 from collections import OrderedDict
 
-from ucca import textutil, layer0, layer1
+from ucca import textutil, core, layer0, layer1
 from ucca.layer1 import EdgeTags, NodeTags
 
+ANNOTATION_ATTRS = (textutil.Attr.POS, textutil.Attr.DEP, textutil.Attr.HEAD)  # Used by Candidate properties
+
 
 class Construction:
     def __init__(self, name, description, criterion, default=False):
@@ -48,23 +50,38 @@ class Categories(Construction):
 
 
 class Candidate:
-    def __init__(self, edge, reference=None, reference_yield_tags=None, verbose=False):
+    def __init__(self, edge, reference=None, reference_yield_tags=None, verbose=False, yield_masks=None):
+        """
+        :param edge: Edge to check for constructions
+        :param reference: Passage object to get terminals from for annotation (default: that of the edge)
+        :param reference_yield_tags: yield tags from reference passage for fine-grained evaluation
+        :param verbose: whether to print annotation progress
+        :param yield_masks: dict returned by get_yield_masks for the edge's passage, to avoid calculating yields again
+        """
         self.edge = edge
         self.out_tags = {e.tag for e in edge.child}
         self.reference = reference
         self.reference_yield_tags = reference_yield_tags
         self.verbose = verbose
-        self.terminals = self.edge.child.get_terminals()
-        self.terminal_yield, self.terminal_yield_no_punct = [frozenset(t.position for t in ts) for ts in (
-            self.terminals, self.edge.child.get_terminals(punct=False))]
-        if self.reference is not None:
-            self.terminals = [self.reference.by_id(t.ID) for t in self.terminals]
+        if yield_masks is None:
+            yield_masks = get_yield_masks(edge.child)
+        # Terminal positions as bitmasks (bit i for position i), with and without punctuation
+        self.terminal_yield, self.terminal_yield_no_punct = yield_masks[edge.child.ID]
+        self._terminals = None
         self.extra = {}
 
+    @property
+    def terminals(self):
+        if self._terminals is None:
+            self._terminals = self.edge.child.get_terminals()
+            if self.reference is not None:
+                self._terminals = [self.reference.by_id(t.ID) for t in self._terminals]
+        return self._terminals
+
     def _annotate(self, attr=None):
         passage = self.edge.parent.root
         if not passage.extra.get("annotated"):
-            textutil.annotate(passage, as_array=True, verbose=self.verbose)
+            textutil.annotate(passage, as_array=True, verbose=self.verbose, attrs=ANNOTATION_ATTRS)
             passage.extra["annotated"] = True
         if attr:
             ret = self.extra.get(attr)
@@ -195,11 +212,55 @@ def verify_terminals_match(passage, reference):
         "\n".join(map(str, diff_terminals(passage, reference))))
 
 
+def get_yield_masks(node):
+    """
+    Find the terminal yields of all nodes reachable from the given one (or in the given passage) in one pass, as
+    integer bitmasks where bit i is set for position i, rather than calling get_terminals for each node separately.
+    :param node: Node or Passage object to start from
+    :return dict of node ID -> (yield including punctuation, yield excluding punctuation), not following remote edges,
+            equal to the positions of get_terminals(punct=True) and get_terminals(punct=False), respectively
+    """
+    masks = {}
+    visiting = set()
+    for start in node.layer(layer1.LAYER_ID).all if isinstance(node, core.Passage) else [node]:
+        stack = [start]
+        while stack:
+            node = stack[-1]
+            if node.ID in masks:
+                stack.pop()
+            elif node.layer.ID == layer0.LAYER_ID:
+                bit = 1 << node.position
+                masks[node.ID] = (bit, 0 if node.punct else bit)
+                stack.pop()
+            else:
+                edges = [e for e in node if not e.attrib.get("remote")]
+                pending = [e.child for e in edges if e.child.ID not in masks and e.child.ID not in visiting]
+                if pending and node.ID not in visiting:  # Visit children first
+                    visiting.add(node.ID)
+                    stack += pending
+                else:  # Children are done (except for those in a cycle)
+                    visiting.discard(node.ID)
+                    mask = mask_no_punct = 0
+                    for edge in edges:
+                        child_mask, child_mask_no_punct = masks.get(edge.child.ID, (0, 0))
+                        mask |= child_mask
+                        mask_no_punct |= child_mask_no_punct
+                    masks[node.ID] = (mask, 0 if node.tag == NodeTags.Punctuation else mask_no_punct)
+                    stack.pop()
+    return masks
+
+
+def yield_positions(mask):
+    """:return sorted list of the terminal positions in a yield bitmask"""
+    return [i for i in range(mask.bit_length()) if mask >> i & 1]
+
+
 def get_candidates(passage, reference=None, reference_yield_tags=None, verbose=False):
+    yield_masks = get_yield_masks(passage)
     for node in passage.layer(layer1.LAYER_ID).all:
         for edge in node:
             yield Candidate(edge, reference=reference or passage, reference_yield_tags=reference_yield_tags,
-                            verbose=verbose)
+                            verbose=verbose, yield_masks=yield_masks)
 
 
 def extract_candidates(passage, constructions=None, reference=None, reference_yield_tags=None, verbose=False):
@@ -209,7 +270,7 @@ def extract_candidates(passage, constructions=None, reference=None, reference_yi
     :param constructions: list of constructions to include or None for all
     :param reference: Passage object to get POS tags from, and categories for fine-grained scores (default: `passage')
     :param reference_yield_tags: yield tags from reference passage for fine-grained evaluation:
-                   dict: set of terminal indices (excluding punctuation) ->
+                   dict: bitmask of terminal positions (including punctuation) ->
                    list of edges of the Construction whose yield (excluding remotes and punctuation) is that set
     :param verbose: whether to print tagged text
     :return: dict of Construction -> list of corresponding Candidates
@@ -231,7 +292,7 @@ def extract_edges(passage, constructions=None, reference=None, reference_yield_t
     :param constructions: list of constructions to include or None for all
     :param reference: Passage object to get POS tags from (default: `passage')
     :param reference_yield_tags: yield tags from reference passage for fine-grained evaluation:
-                   dict: set of terminal indices (excluding punctuation) ->
+                   dict: bitmask of terminal positions (including punctuation) ->
                    list of edges of the Construction whose yield (excluding remotes and punctuation) is that set
     :param verbose: whether to print tagged text
     :return: dict of Construction -> list of corresponding edges
@@ -246,7 +307,7 @@ def create_passage_yields(p, *args, punct=False, **kwargs):
     :param p: passage to find terminal yields of
     :param punct: whether to include punctuation in terminal yield
     :returns dict: Construction ->
-                   dict: set of terminal indices (excluding punctuation) ->
+                   dict: bitmask of terminal positions (bit i for position i; excluding punctuation unless punct) ->
                          list of edges of the Construction whose yield (excluding remotes and punctuation) is that set
     """
     yield_tags = OrderedDict()
@@ -12,15 +12,16 @@ The possible other formats are:
 """
 
 import sys
-from collections import defaultdict
-from itertools import repeat
+from collections import defaultdict, OrderedDict
+from itertools import repeat, tee
 
+import codecs
+import importlib
 import json
 import os
 import pickle
 import re
 import xml.etree.ElementTree as ET
-import xml.sax.saxutils
 from operator import attrgetter, itemgetter
 
 from ucca import textutil, core, layer0, layer1
@@ -155,6 +156,7 @@ class SiteUtil:
 
     @staticmethod
     def unescape(x):
+        import xml.sax.saxutils  # Imports urllib, so only when needed
         return xml.sax.saxutils.unescape(x, {'&quot;': '"', r"\u2019": "'"})
 
     @staticmethod
@@ -692,16 +694,21 @@ def from_standard(root, extra_funcs=None):
     return passage
 
 
-def from_text(text, passage_id="1", tokenized=False, one_per_line=False, extra_format=None, lang="en", *args, **kwargs):
+def from_text(text, passage_id="1", tokenized=False, one_per_line=False, extra_format=None, lang="en",
+              whitespace=False, batch_size=None, n_process=1, *args, **kwargs):
     """Converts from tokenized strings to a Passage object.
 
     :param text: a multi-line string or a sequence of strings:
                  each line will be a new paragraph, and blank lines separate passages
     :param passage_id: prefix of ID to set for returned passages
-    :param tokenized: whether the text is already given as a list of tokens
+    :param tokenized: whether the text is already given as a list of tokens (no tokenization model is loaded)
     :param one_per_line: each line will be a new passage rather than just a new paragraph
     :param extra_format: value to set in passage.extra["format"]
     :param lang: language to use for tokenization model
+    :param whitespace: whether each line is already tokenized, with tokens separated by whitespace
+                       (no tokenization model is loaded)
+    :param batch_size: if given, tokenize lines in batches of this size rather than one at a time
+    :param n_process: number of processes to tokenize in (passages are still returned in order)
 
     :return generator of Passage object with only Terminal units
     """
@@ -710,11 +717,12 @@ def from_text(text, passage_id="1", tokenized=False, one_per_line=False, extra_f
         text = text.splitlines()
     if tokenized:
         text = (text,)  # text is a list of tokens, not list of lines
+    else:
+        text = (line.strip() for line in text)
     p = l0 = paragraph = None
     i = 0
-    for line in text:
-        if not tokenized:
-            line = line.strip()
+    for line, tokens in textutil.tokenize_all(text, tokenized=tokenized, lang=lang, whitespace=whitespace,
+                                              batch_size=batch_size, n_process=n_process):
         if line or one_per_line:
             if p is None:
                 p = core.Passage("%s_%d" % (passage_id, i), attrib=dict(lang=lang))
@@ -723,7 +731,7 @@ def from_text(text, passage_id="1", tokenized=False, one_per_line=False, extra_f
                 l0 = layer0.Layer0(p)
                 layer1.Layer1(p)
                 paragraph = 1
-            for lex in textutil.get_tokenizer(tokenized, lang=lang)(line):
+            for lex in tokens:
                 l0.add_terminal(text=lex.orth_, punct=lex.is_punct, paragraph=paragraph)
             paragraph += 1
         if p and (not line or one_per_line):
@@ -759,44 +767,119 @@ def to_text(passage, sentences=True, lang="en", *args, **kwargs):
             for i in range(len(starts) - 1)]
 
 
+SEQUENCE_IMPLICIT = "IMPLICIT"
+SEQUENCE_REMOTE = "*"
+SEQUENCE_ESCAPE = "\\"  # Prefix of terminal text that could otherwise be read as a bracket, IMPLICIT or escaped
+
+
+def _escape_sequence_token(text):
+    return SEQUENCE_ESCAPE + text if text == SEQUENCE_IMPLICIT or text.startswith(("[", "]_", SEQUENCE_ESCAPE)) \
+        else text
+
+
 def to_sequence(passage):
-    """Converts from a Passage object to linearized text sequence.
+    """Converts from a Passage object to a linearized bracketed text sequence, e.g. "[H [A John ]_A [P left ]_P ]_H".
+    Each unit is given as its incoming edge tag between "[TAG" and "]_TAG", and each Terminal by its text.
+    Implicit units contain just "IMPLICIT", and remote edges are marked by "*" after the tag and contain just the ID
+    of the child unit, as it would be assigned by :func:from_sequence (units are numbered in order of appearance).
+    Terminal text that starts with "[", "]_" or "\\", or is "IMPLICIT", is escaped by prefixing it with "\\".
+    Only the unit tree under the first layer 1 head is rendered: the other heads, i.e. the Linkage nodes, are dropped,
+    so linkage is not restored by :func:from_sequence.
+    Runs in time linear in the size of the passage.
 
     :param passage: the Passage object to convert
 
-    :return a list of strings - 1 if sentences=False, # of sentences otherwise
+    :return a string representing the foundational layer of the passage
     """
-    def _position(edge):
-        while edge.child.layer.ID != layer0.LAYER_ID:
-            edge = edge.child.outgoing[0]
-        return tuple(map(edge.child.attrib.get, ('paragraph', 'paragraph_position')))
-
-    seq = ''
-    stacks = []
-    edges = [e for u in passage.layer(layer1.LAYER_ID).all
-             if not u.incoming for e in u.outgoing]
-    # should avoid printing the same node more than once, refer to it by ID
-    # convert back to passage
-    # use Node.__str__ as it already does this...
-    while True:
-        if edges:
-            stacks.append(sorted(edges, key=_position, reverse=True))
+    head = passage.layer(layer1.LAYER_ID).heads[0]
+    spans = layer1.get_spans(head)
+    tokens = []
+    ids = {head.ID: head.ID}
+    stack = [(e, False) for e in reversed(sorted(head, key=lambda e: spans[e.child.ID][0]))]
+    while stack:
+        edge, closing = stack.pop()
+        node = edge.child
+        if closing:
+            tokens.append("]_" + edge.tag)
+        elif node.layer.ID == layer0.LAYER_ID:
+            tokens.append(_escape_sequence_token(node.text))
+        elif edge.attrib.get("remote"):
+            tokens += ["[" + edge.tag + SEQUENCE_REMOTE, node, "]_" + edge.tag + SEQUENCE_REMOTE]
         else:
-            stacks[-1].pop()
-            while not stacks[-1]:
-                stacks.pop()
-                if not stacks:
-                    return seq.rstrip()
-                seq += ']_'
-                seq += stacks[-1][-1].tag
-                seq += ' '
-                stacks[-1].pop()
-        e = stacks[-1][-1]
-        edges = e.child.outgoing
-        if edges:
-            seq += '['
-        seq += e.child.attrib.get('text') or e.tag
-        seq += ' '
+            ids[node.ID] = "%s%s%d" % (layer1.LAYER_ID, core.Node.ID_SEPARATOR, len(ids) + 1)
+            tokens.append("[" + edge.tag)
+            if node.attrib.get("implicit"):
+                tokens.append(SEQUENCE_IMPLICIT)
+            stack.append((edge, True))
+            stack += [(e, False) for e in reversed(sorted(node, key=lambda e: spans[e.child.ID][0]))]
+    return " ".join(t if isinstance(t, str) else ids.get(t.ID, t.ID) for t in tokens)
+
+
+def from_sequence(sequence, passage_id="1"):
+    """Converts from a linearized bracketed text sequence, as returned by :func:to_sequence, to a Passage object.
+    Terminals are created in order of appearance, all in the same paragraph, so discontiguous units are not restored.
+    A token starting with "\\" is always a Terminal, whose text is the rest of the token.
+
+    :param sequence: a string or a list of tokens
+    :param passage_id: ID to set for the returned passage
+
+    :return Passage object
+
+    :raise ValueError if the sequence is malformed
+    """
+    tokens = sequence.split() if isinstance(sequence, str) else sequence
+    p = core.Passage(passage_id)
+    l0 = layer0.Layer0(p)
+    l1 = layer1.Layer1(p)
+    stack = [[l1.heads[0], None, None]]  # node (None until created), edge tag, parent entry
+    remotes = []  # (parent, edge tag, child ID)
+
+    def _create(entry, terminal=None):
+        if entry[0] is None:
+            parent = _create(entry[2])
+            entry[0] = l1.add_fnode(parent, entry[1]) if terminal is None else l1.add_punct(parent, terminal)
+        return entry[0]
+
+    def _add_terminal(text):
+        entry = stack[-1]
+        terminal = l0.add_terminal(text=text, punct=entry[0] is None and entry[1] == layer1.EdgeTags.Punctuation
+                                   or isinstance(entry[0], layer1.PunctNode))
+        if entry[0] is None and terminal.punct:
+            _create(entry, terminal)
+        else:
+            _create(entry).add(layer1.EdgeTags.Terminal, terminal)
+
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.startswith(SEQUENCE_ESCAPE):
+            _add_terminal(token[len(SEQUENCE_ESCAPE):])
+        elif token.startswith("]_"):
+            if len(stack) < 2 or token[2:] != stack[-1][1]:
+                raise ValueError("Unmatched '%s' at token %d: %s" % (token, i, sequence))
+            _create(stack.pop())
+        elif token.startswith("[") and len(token) > 1:
+            tag = token[1:]
+            if tag.endswith(SEQUENCE_REMOTE):
+                if i + 2 >= len(tokens) or tokens[i + 2] != "]_" + tag:
+                    raise ValueError("Invalid remote edge at token %d: %s" % (i, sequence))
+                remotes.append((_create(stack[-1]), tag[:-len(SEQUENCE_REMOTE)], tokens[i + 1]))
+                i += 2
+            else:
+                stack.append([None, tag, stack[-1]])
+        elif token == SEQUENCE_IMPLICIT and stack[-1][0] is None and len(stack) > 1:
+            _create(stack[-1]).attrib["implicit"] = True
+        else:
+            _add_terminal(token)
+        i += 1
+    if len(stack) > 1:
+        raise ValueError("Unclosed '[%s': %s" % (stack[-1][1], sequence))
+    for parent, tag, child_id in remotes:
+        try:
+            l1.add_remote(parent, tag, p.by_id(child_id))
+        except KeyError as e:
+            raise ValueError("Unknown remote child ID '%s': %s" % (child_id, sequence)) from e
+    return p
 
 
 UNANALYZABLE = "Unanalyzable"
@@ -967,52 +1050,250 @@ def to_json(passage, *args, return_dict=False, tok_task=None, all_categories=Non
     return d if return_dict else json.dumps(d).splitlines()
 
 
-def file2passage(filename):
-    """Opens a file and returns its parsed Passage object
-    Tries to read both as a standard XML file and as a binary pickle
-    :param filename: file name to write to
+COMPRESSIONS = OrderedDict((  # file name extension -> (module providing open(), magic bytes or regular expression)
+    ("gz", ("gzip", b"\x1f\x8b")),
+    ("bz2", ("bz2", re.compile(br"BZh[1-9](1AY&SY|\x17rE8P\x90)"))),  # Block size, then first block or end of stream
+    ("xz", ("lzma", b"\xfd7zXZ\x00")),
+))
+COMPRESSION_MAGIC_LENGTH = 16
+
+
+def detect_compression(filename, by_magic=True):
+    """Finds the compression of a file, first by its extension and then by its first bytes.
+
+    :param filename: file name to check
+    :param by_magic: whether to read the beginning of the file if the extension is not a compression extension
+
+    :return key of COMPRESSIONS, or None if the file is not compressed
     """
-    methods = [pickle2passage, xml2passage]
     _, ext = os.path.splitext(filename)
-    if ext == ".xml":
-        del methods[0]
-    elif ext == ".pickle":
-        del methods[1]
-    exception = None
-    for method in methods:
+    ext = ext.lstrip(".")
+    if ext in COMPRESSIONS:
+        return ext
+    if by_magic:
+        try:
+            with open(filename, "rb") as h:
+                head = h.read(COMPRESSION_MAGIC_LENGTH)
+        except IOError:
+            return None
+        for compression, (_, magic) in COMPRESSIONS.items():
+            if head.startswith(magic) if isinstance(magic, bytes) else magic.match(head):
+                return compression
+    return None
+
+
+def open_file(filename, mode="r", encoding=None, compression=None):
+    """Opens a file, decompressing it while reading or compressing it while writing if necessary.
+
+    :param filename: file name to open
+    :param mode: mode as in open(), e.g. "r", "rb", "w", "wb", "a"
+    :param encoding: text encoding, for text modes
+    :param compression: key of COMPRESSIONS, or None to detect by the file name extension (and, when reading, by the
+                        beginning of the file)
+
+    :return file object, reading or writing text if "b" is not in the mode
+    """
+    if compression is None:
+        compression = detect_compression(filename, by_magic="r" in mode)
+    if compression is None:
+        return open(filename, mode, encoding=encoding)
+    module, _ = COMPRESSIONS[compression]
+    return importlib.import_module(module).open(filename, mode if "b" in mode else mode + "t", encoding=encoding)
+
+
+def strip_compression(filename):
+    """:return the file name without any compression extension (e.g. "a.xml" for "a.xml.gz")"""
+    name, ext = os.path.splitext(filename)
+    return name if ext.lstrip(".") in COMPRESSIONS else filename
+
+
+class PassageFormat:
+    """File format that Passage objects can be read from, detected by file extension or by the leading bytes."""
+    def __init__(self, name, reader, extensions=(), magic=(), multiple=False):
+        """
+        :param name: name of the format
+        :param reader: function taking a file name and returning a Passage, or a "module:function" string to import
+                       the function from when first used
+        :param extensions: file name extensions (including ".") identifying the format
+        :param magic: byte strings any of which the file contents may start with (after any whitespace), or compiled
+                      regular expressions of bytes to match the beginning of the contents with
+        :param multiple: whether files may contain multiple passages, so that the reader returns an iterable
+        """
+        self.name = name
+        self._reader = reader
+        self.extensions = tuple(extensions)
+        self.magic = tuple(magic)
+        self.multiple = multiple
+
+    @property
+    def reader(self):
+        if isinstance(self._reader, str):
+            module, _, function = self._reader.partition(":")
+            self._reader = getattr(importlib.import_module(module), function)
+        return self._reader
+
+    def read(self, filename):
+        return self.reader(filename)
+
+    def matches(self, head):
+        """:return whether the given beginning of file contents (after any whitespace) matches the magic"""
+        return any(head.startswith(m) if isinstance(m, bytes) else m.match(head) for m in self.magic)
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, self.name)
+
+
+PASSAGE_FORMATS = OrderedDict()
+MAGIC_LENGTH = 256
+
+
+def register_format(name, reader, extensions=(), magic=(), multiple=False):
+    """Adds a format to be recognized by :func:file2passage, replacing any existing format with the same name.
+    See :class:PassageFormat for the parameters, and :func:detect_format for the precedence between formats.
+
+    :return the registered PassageFormat
+    """
+    passage_format = PASSAGE_FORMATS[name] = PassageFormat(name, reader, extensions=extensions, magic=magic,
+                                                           multiple=multiple)
+    return passage_format
+
+
+def detect_format(filename, by_extension=True, by_magic=True):
+    """Finds the registered format of a passage file, first by its extension and then by its first bytes.
+    Any compression extension is ignored, and the first bytes are checked after decompression.
+    A known extension always determines the format. Otherwise, the magic of formats with multiple passages is checked
+    before that of the other formats, since their files may start just like a single passage file (e.g. consecutive
+    pickles), and reading them as single passages would silently drop the rest; then in order of registration.
+
+    :param filename: file name to check
+    :param by_extension: whether to detect the format by the file name extension
+    :param by_magic: whether to read the beginning of the file to detect the format if the extension is not known
+
+    :return PassageFormat, or None if no registered format matches
+    """
+    if by_extension:
+        _, ext = os.path.splitext(strip_compression(filename))
+        for passage_format in PASSAGE_FORMATS.values():
+            if ext in passage_format.extensions:
+                return passage_format
+    if by_magic:
         try:
-            return method(filename)
-        except Exception as e:
-            exception = e
-    if exception:
-        raise IOError("Failed reading '%s'" % filename) from exception
+            with open_file(filename, "rb") as h:
+                head = h.read(MAGIC_LENGTH)
+        except (IOError, EOFError):
+            return None
+        if head.startswith(codecs.BOM_UTF8):
+            head = head[len(codecs.BOM_UTF8):]
+        head = head.lstrip()
+        for passage_format in sorted(PASSAGE_FORMATS.values(), key=lambda f: not f.multiple):  # Stable
+            if passage_format.matches(head):
+                return passage_format
+    return None
+
+
+def file2passage(filename, passage_format=None):
+    """Opens a file and returns its parsed Passage object
+    Detects the format by the file extension, or by the beginning of the file if the extension is not recognized
+    Compressed files (see COMPRESSIONS) are decompressed while reading
+    :param filename: file name to read from
+    :param passage_format: PassageFormat to read the file as, instead of detecting it
+    """
+    if passage_format is None:
+        passage_format = detect_format(filename)
+        if passage_format is None:
+            raise IOError("Unknown passage file format: '%s'" % filename)
+    if passage_format.multiple:  # Fine if it contains just one passage, e.g. a single pickle detected by its magic
+        passages = list(file2passages(filename, passage_format))
+        if len(passages) != 1:
+            raise IOError("'%s' contains %d passages, use file2passages to read it" % (filename, len(passages)))
+        return passages[0]
+    try:
+        return passage_format.read(filename)
+    except Exception as e:
+        raise IOError("Failed reading '%s' as %s" % (filename, passage_format.name)) from e
+
+
+def file2passages(filename, passage_format=None):
+    """Opens a file and returns a generator of all Passage objects in it, supporting formats of multiple passages
+    :param filename: file name to read from
+    :param passage_format: PassageFormat to read the file as, instead of detecting it
+    """
+    if passage_format is None:
+        passage_format = detect_format(filename)
+        if passage_format is None:
+            raise IOError("Unknown passage file format: '%s'" % filename)
+    if not passage_format.multiple:
+        yield file2passage(filename, passage_format)
+        return
+    try:
+        yield from passage_format.read(filename)
+    except Exception as e:
+        raise IOError("Failed reading '%s' as %s" % (filename, passage_format.name)) from e
 
 
 def xml2passage(filename):
-    with open(filename, encoding="utf-8") as f:
+    with open_file(filename, encoding="utf-8") as f:
         return from_standard(ET.ElementTree().parse(f))
 
 
 def pickle2passage(filename):
-    with open(filename, "rb") as h:
+    with open_file(filename, "rb") as h:
         return pickle.load(h)
 
 
-def passage2file(passage, filename, indent=True, binary=False):
+def json2passage(filename):
+    with open_file(filename, encoding="utf-8") as f:
+        return from_json(json.load(f))
+
+
+def jsonl2passages(filename):
+    """Reads JSON lines of the form {"id": passage ID, "xml": standard XML}, as written by :func:passage2jsonl"""
+    with open_file(filename, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield from_standard(ET.fromstring(json.loads(line)["xml"]))
+
+
+def passage2jsonl(passage, indent=False):
+    """:return a line (without newline) of JSON with the passage ID and its standard XML representation"""
+    xml_string = ET.tostring(to_standard(passage)).decode()
+    return json.dumps(dict(id=passage.ID, xml=textutil.indent_xml(xml_string) if indent else xml_string))
+
+
+def pickles2passages(filename):
+    """Reads passages pickled one after another to the same file"""
+    with open_file(filename, "rb") as h:
+        while True:
+            try:
+                yield pickle.load(h)
+            except EOFError:
+                return
+
+
+register_format("pickle", pickle2passage, extensions=(".pickle", ".pkl"), magic=(b"\x80",))
+register_format("xml", xml2passage, extensions=(".xml",), magic=(b"<?xml", b"<root"))
+register_format("json", json2passage, extensions=(".json",), magic=(re.compile(br'{\s*"[^"]*"\s*:'),))
+register_format("jsonl", jsonl2passages, extensions=(".jsonl",),
+                magic=(re.compile(br'{"id": "(?:[^"\\\n]|\\.)*", "xml": "'),), multiple=True)
+register_format("pickles", pickles2passages, extensions=(".pickles",), magic=(b"\x80",), multiple=True)
+
+
+def passage2file(passage, filename, indent=True, binary=False, compression=None):
     """Writes a UCCA passage as a standard XML file or a binary pickle
     :param passage: passage object to write
     :param filename: file name to write to
     :param indent: whether to indent each line
     :param binary: whether to write pickle format (or XML)
+    :param compression: compression to apply (key of COMPRESSIONS), by default determined by the file name extension
     """
     if binary:
-        with open(filename, "wb") as h:
+        with open_file(filename, "wb", compression=compression) as h:
             pickle.dump(passage, h)
     else:  # xml
         root = to_standard(passage)
         xml_string = ET.tostring(root).decode()
         output = textutil.indent_xml(xml_string) if indent else xml_string
-        with open(filename, "w", encoding="utf-8") as h:
+        with open_file(filename, "w", encoding="utf-8", compression=compression) as h:
             h.write(output)
 
 
@@ -1038,6 +1319,23 @@ def split2segments(passage, is_sentences, remarks=False, lang="en", ids=None):
     return split_passage(passage, ends, remarks=remarks, ids=ids)
 
 
+def split2segments_all(passages, is_sentences, remarks=False, lang="en", batch_size=textutil.BATCH_SIZE):
+    """
+    Split many passages to sub-passages, finding sentence ends for a batch of passages at a time
+    :param passages: iterable of Passage objects
+    :param is_sentences: if True, split to sentences; otherwise, paragraphs
+    :param remarks: Whether to add remarks with original node IDs
+    :param lang: language to use for sentence splitting model
+    :param batch_size: number of passages to find sentence ends for together
+    :return: generator of passages
+    """
+    passages, to_break = tee(passages)
+    all_ends = textutil.break2sentences_all(to_break, lang=lang, batch_size=batch_size) if is_sentences else \
+        map(textutil.break2paragraphs, to_break)
+    for passage, ends in zip(passages, all_ends):
+        yield from split_passage(passage, ends, remarks=remarks)
+
+
 def split_passage(passage, ends, remarks=False, ids=None):
     """
     Split the passage on the given terminal positions
@@ -1087,38 +1385,63 @@ def split_passage(passage, ends, remarks=False, ids=None):
 def join_passages(passages, passage_id=None, remarks=False):
     """
     Join passages to one passage with all the nodes in order
-    :param passages: sequence of passages to join
+    :param passages: iterable of passages to join (may be a generator, as each is added incrementally)
     :param passage_id: ID of newly created passage (otherwise, ID of first passage)
     :param remarks: add original node ID as remarks to the new nodes
     :return: joined passage
     """
-    if not passages:
-        raise ValueError("Cannot join empty list of passages")
-    other = core.Passage(ID=passage_id or passages[0].ID, attrib=passages[0].attrib.copy())
-    other.extra = passages[0].extra.copy()
-    l0 = passages[0].layer(layer0.LAYER_ID)
-    l1 = passages[0].layer(layer1.LAYER_ID)
-    other_l0 = layer0.Layer0(root=other, attrib=l0.attrib.copy())
-    layer1.Layer1(root=other, attrib=l1.attrib.copy())
-    id_to_other = {}
-    paragraph = 0
+    joiner = PassageJoiner(passage_id=passage_id, remarks=remarks)
     for passage in passages:
+        joiner.add(passage)
+    if joiner.passage is None:
+        raise ValueError("Cannot join empty list of passages")
+    return joiner.passage
+
+
+class PassageJoiner:
+    """
+    Incrementally join passages to one passage, appending the terminals and layer 1 nodes of each passage added.
+    The cost of adding a passage is proportional to its size, so only the joined passage needs to be kept in memory.
+    """
+    def __init__(self, passage_id=None, remarks=False):
+        """
+        :param passage_id: ID of newly created passage (otherwise, ID of first passage added)
+        :param remarks: add original node ID as remarks to the new nodes
+        """
+        self.passage_id = passage_id
+        self.remarks = remarks
+        self.passage = None  # Created when the first passage is added
+        self.paragraph = 0
+
+    def add(self, passage):
+        """
+        Append a passage to the joined passage
+        :param passage: passage to append
+        :return: the joined passage
+        """
         l0 = passage.layer(layer0.LAYER_ID)
+        if self.passage is None:
+            self.passage = core.Passage(ID=self.passage_id or passage.ID, attrib=passage.attrib.copy())
+            self.passage.extra = passage.extra.copy()
+            layer0.Layer0(root=self.passage, attrib=l0.attrib.copy())
+            layer1.Layer1(root=self.passage, attrib=passage.layer(layer1.LAYER_ID).attrib.copy())
+        other_l0 = self.passage.layer(layer0.LAYER_ID)
+        id_to_other = {}
         paragraphs = set()
         for terminal in l0.all:
             if terminal.para_pos == 1:
-                paragraph += 1
+                self.paragraph += 1
             orig_paragraph = terminal.extra.get("orig_paragraph")
             if orig_paragraph is not None:
-                paragraph = orig_paragraph
-            paragraphs.add(paragraph)
-            other_terminal = other_l0.add_terminal(terminal.text, terminal.punct, paragraph)
-            _copy_extra(terminal, other_terminal, remarks)
+                self.paragraph = orig_paragraph
+            paragraphs.add(self.paragraph)
+            other_terminal = other_l0.add_terminal(terminal.text, terminal.punct, self.paragraph)
+            _copy_extra(terminal, other_terminal, self.remarks)
             id_to_other[terminal.ID] = other_terminal
         for paragraph in paragraphs:
             other_l0.doc(paragraph).extend(l0.doc(1))
-        _copy_l1_nodes(passage, other, id_to_other, remarks=remarks)
-    return other
+        _copy_l1_nodes(passage, self.passage, id_to_other, remarks=self.remarks)
+        return self.passage
 
 
 def _copy_l1_nodes(passage, other, id_to_other, include=None, remarks=False):
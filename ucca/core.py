@@ -8,6 +8,7 @@ are connected between themselves and to Nodes in other layers using
 
 """
 
+import contextlib
 import functools
 
 
@@ -51,6 +52,28 @@ def edge_id_orderkey(edge):
                                  id_orderkey(edge.child))
 
 
+# Key functions which depend only on (immutable) IDs, so the order they induce
+# never changes after an object is added
+ID_ORDERKEYS = (id_orderkey, edge_id_orderkey)
+
+
+def add_ordered(items, item, key):
+    """Appends an item to a list kept sorted by the given key function.
+
+    Sorting is skipped if the item belongs at the end of the list anyway,
+    so adding objects in order (as when building a passage) is O(1).
+
+    Args:
+        items: list sorted according to key
+        item: object to add
+        key: ordering key function of the list
+
+    """
+    items.append(item)
+    if key not in ID_ORDERKEYS or len(items) > 1 and key(items[-2]) > key(item):
+        items.sort(key=key)
+
+
 class UCCAError(Exception):
     """Base class for all UCCA package exceptions."""
     pass
@@ -422,10 +445,8 @@ class Node:
         """
         edge = Edge(root=self._root, tag=edge_tag, parent=self,
                     child=node, attrib=edge_attrib)
-        self._outgoing.append(edge)
-        self._outgoing.sort(key=self._orderkey)
-        node._incoming.append(edge)
-        node._incoming.sort(key=node._orderkey)
+        add_ordered(self._outgoing, edge, self._orderkey)
+        add_ordered(node._incoming, edge, node._orderkey)
         self.root._add_edge(edge)
         return edge
 
@@ -718,11 +739,11 @@ class Layer:
         :param edge: the Edge added to the Layer subgraph
 
         """
-        if edge.child in self._heads:
+        if edge.child.layer is self and edge.child in self._heads:
             self._heads.remove(edge.child)
-        # Order may depend on edges, so re-order
-        self._all.sort(key=self._orderkey)
-        self._heads.sort(key=self._orderkey)
+        if self._orderkey not in ID_ORDERKEYS:  # Order may depend on edges, so re-order
+            self._all.sort(key=self._orderkey)
+            self._heads.sort(key=self._orderkey)
 
     def _remove_edge(self, edge):
         """Alters self.heads if an :class:Edge has been removed.
@@ -734,11 +755,10 @@ class Layer:
 
         """
         if edge.child.layer == self and all(p.layer != self for p in edge.child.parents):
-            self._heads.append(edge.child)
+            add_ordered(self._heads, edge.child, self._orderkey)
+        if self._orderkey not in ID_ORDERKEYS:  # Order may depend on edges, so re-order
+            self._all.sort(key=self._orderkey)
             self._heads.sort(key=self._orderkey)
-        # Order may depend on edges, so re-order
-        self._all.sort(key=self._orderkey)
-        self._heads.sort(key=self._orderkey)
 
     def _add_node(self, node):
         """Adds a :class:node to the :class:Layer.
@@ -746,10 +766,8 @@ class Layer:
         Assumes node has no incoming or outgoing :class:Edge objects.
 
         """
-        self._all.append(node)
-        self._all.sort(key=self._orderkey)
-        self._heads.append(node)
-        self._heads.sort(key=self._orderkey)
+        add_ordered(self._all, node, self._orderkey)
+        add_ordered(self._heads, node, self._orderkey)
 
     def _remove_node(self, node):
         """Removes a :class:node from the :class:Layer.
@@ -760,6 +778,13 @@ class Layer:
         self._all.remove(node)
         self._heads.remove(node)
 
+    def _save_state(self):
+        """Returns the lists of :class:Node objects kept by the Layer, to be restored by _restore_state."""
+        return self._all.copy(), self._heads.copy()
+
+    def _restore_state(self, state):
+        self._all, self._heads = state
+
     def _change_edge_tag(self, edge, old_tag):
         """Updates the :class:Layer objects with the change.
 
@@ -914,6 +939,36 @@ class Passage:
         other.frozen = self.frozen
         return other
 
+    @contextlib.contextmanager
+    def revert_changes(self):
+        """Context manager undoing any modification of the annotation graph made inside it.
+
+        Saves the tags, attributes and Edges of all :class:Node objects, and
+        the Node lists of all :class:Layer objects, and restores them on exit.
+        This allows temporary changes (e.g. normalization for evaluation)
+        without copying the Passage. Nodes created inside the context are
+        discarded, and the Passage is unfrozen until exit.
+
+        """
+        nodes = self._nodes.copy()
+        node_states = [(node, node._tag, node._attrib._dict.copy(), node._outgoing.copy(), node._incoming.copy())
+                       for node in nodes.values()]
+        edge_states = [(edge, edge._tag, edge._attrib._dict.copy()) for node in nodes.values()
+                       for edge in node._outgoing]
+        layer_states = [(layer, layer._save_state()) for layer in self._layers.values()]
+        attrib, frozen = self._attrib._dict.copy(), self.frozen
+        self.frozen = False
+        try:
+            yield self
+        finally:
+            for node, tag, node_attrib, outgoing, incoming in node_states:
+                node._tag, node._attrib._dict, node._outgoing, node._incoming = tag, node_attrib, outgoing, incoming
+            for edge, tag, edge_attrib in edge_states:
+                edge._tag, edge._attrib._dict = tag, edge_attrib
+            for layer, state in layer_states:
+                layer._restore_state(state)
+            self._nodes, self._attrib._dict, self.frozen = nodes, attrib, frozen
+
     def by_id(self, ID):
         """Returns a Node whose ID is given.
 
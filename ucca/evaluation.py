@@ -6,12 +6,16 @@ v1.2
 2017-01-16: fix bug in moving common Fs
 2018-04-12: exclude punctuation nodes regardless of edge tag
 """
-from collections import Counter, OrderedDict
-
-from operator import attrgetter
-
-from ucca import layer0, layer1, normalization
-from ucca.constructions import get_by_names, create_passage_yields, PRIMARY, DEFAULT, ALL_EDGES
+import os
+import pickle
+from collections import Counter, OrderedDict, deque
+from contextlib import ExitStack
+from itertools import repeat
+
+from ucca import core, layer0, layer1, normalization
+from ucca.constructions import get_by_names, create_passage_yields, PRIMARY, DEFAULT, ALL_EDGES, Construction, \
+    CONSTRUCTION_BY_NAME, CATEGORY_DESCRIPTIONS, CATEGORIES_NAME, Candidate, get_candidates, get_yield_masks, \
+    terminal_ids, yield_positions
 from ucca.layer1 import EdgeTags, NodeTags
 
 UNLABELED = "unlabeled"
@@ -34,18 +38,30 @@ def get_yield(unit):
         return frozenset()
 
 
+def get_functions(p):
+    """
+    :return: dict of yield (as returned by get_yield) -> F unit, for the units move_functions may move
+    """
+    return {get_yield(u): u for u in p.layer(layer1.LAYER_ID).all
+            if u.tag == NodeTags.Foundational and u.ftag == EdgeTags.Function}
+
+
 def move_functions(p1, p2):
     """
     Move any common Fs to the root
+    :return: set of yields of the moved Fs
     """
-    f1, f2 = [{get_yield(u): u for u in p.layer(layer1.LAYER_ID).all
-               if u.tag == NodeTags.Foundational and u.ftag == EdgeTags.Function} for p in (p1, p2)]
-    for positions in f1.keys() & f2.keys():
-        for (p, unit) in ((p1, f1[positions]), (p2, f2[positions])):
-            for parent in unit.parents:
-                tag = unit.ftag
-                parent.remove(unit)
-                p.layer(layer1.LAYER_ID).heads[0].add(tag, unit)
+    f1, f2 = get_functions(p1), get_functions(p2) if isinstance(p2, core.Passage) else p2.functions
+    common = f1.keys() & f2.keys()
+    for (p, f) in ((p1, f1), (p2, f2)):
+        if isinstance(p, core.Passage):  # The move of a Reference's units is done in Reference.passage_yields
+            for positions in common:
+                unit = f[positions]
+                for parent in unit.parents:
+                    tag = unit.ftag
+                    parent.remove(unit)
+                    p.layer(layer1.LAYER_ID).heads[0].add(tag, unit)
+    return common
 
 
 def get_text(p, positions):
@@ -54,8 +70,12 @@ def get_text(p, positions):
 
 
 def print_tags_and_text(p, yield_tags):
-    for y, tags in sorted(yield_tags.items(), key=lambda x: min(x[0] or [0])):
-        text = " ".join(get_text(p, y))
+    """
+    :param p: passage to take the text from
+    :param yield_tags: dict of yield bitmask (as in create_passage_yields) -> tags
+    """
+    for y, tags in sorted(yield_tags.items(), key=lambda x: (x[0] & -x[0]).bit_length() - 1 if x[0] else 0):
+        text = " ".join(get_text(p, set(yield_positions(y))))
         print((",".join(sorted(filter(None, tags))) + ": " + text) if tags else text)
 
 
@@ -67,6 +87,55 @@ def expand_equivalents(tag_set):
     return tag_set.union(t1 for t in tag_set for pair in EQUIV for t1 in pair if t in pair and t != t1)
 
 
+# Tags are represented as bits of an integer during evaluation, so that sets of tags are compared by bitwise operations
+TAG_BITS = OrderedDict((tag, 1 << i) for i, tag in enumerate(sorted(CATEGORY_DESCRIPTIONS)))  # Extended on demand
+EQUIV_MASKS = []  # Bitmask of each pair in EQUIV
+EXPANDED_MASKS = {}  # Tag bitmask -> bitmask of the tags or those equivalent to them, filled on demand
+MASK_TAGS = {}  # Tag bitmask -> frozenset of tags, filled on demand
+
+
+def tag_mask(tags):
+    """
+    :param tags: iterable of tags (strings)
+    :return: integer with the bits of the tags set
+    """
+    mask = 0
+    for tag in tags:
+        bit = TAG_BITS.get(tag)
+        if bit is None:  # Not an edge tag, but still can be compared
+            bit = TAG_BITS[tag] = 1 << len(TAG_BITS)
+        mask |= bit
+    return mask
+
+
+def mask_tags(mask):
+    """
+    :param mask: tag bitmask returned by tag_mask
+    :return: frozenset of the tags whose bits are set
+    """
+    tags = MASK_TAGS.get(mask)
+    if tags is None:
+        tags = MASK_TAGS[mask] = frozenset(tag for tag, bit in TAG_BITS.items() if mask & bit)
+    return tags
+
+
+def expand_equivalents_mask(mask):
+    """
+    Like expand_equivalents, for tag bitmasks
+    :param mask: tag bitmask returned by tag_mask
+    :return: tag bitmask with the bits of equivalent tags set too
+    """
+    expanded = EXPANDED_MASKS.get(mask)
+    if expanded is None:
+        if not EQUIV_MASKS:
+            EQUIV_MASKS.extend(map(tag_mask, EQUIV))
+        expanded = EXPANDED_MASKS[mask] = mask
+        for equiv_mask in EQUIV_MASKS:
+            if mask & equiv_mask:
+                expanded = EXPANDED_MASKS[mask] = expanded | equiv_mask
+    return expanded
+
+
 class Evaluator:
     def __init__(self, verbose, constructions, units, fscore, errors):
         """
@@ -83,24 +152,30 @@ class Evaluator:
         self.fscore = fscore
         self.errors = errors
 
-        self.mutual = OrderedDict()
-        self.error_counters = OrderedDict()
+        self.mutual = OrderedDict()  # eval_type -> construction -> yield -> mutual tags
+        self.error_counters = OrderedDict()  # eval_type -> construction -> Counter of (guessed tags, ref tags)
 
-    def find_mutuals(self, m1, m2, eval_type, construction):
-        mutual_tags = self.mutual.setdefault(construction, {})
+    def find_mutuals(self, m1, m2, eval_types, construction):
+        """
+        Find the yields both passages have units with, for all evaluation types in one pass over the common yields
+        """
+        mutual = [(eval_type, self.mutual.setdefault(eval_type, OrderedDict()).setdefault(construction, {}))
+                  for eval_type in eval_types]
         for y in m1.keys() & m2.keys():
-            if eval_type == UNLABELED:
-                mutual_tags[y] = ()
-            else:
-                tags = [set(m1[y]), set(m2[y])]
-                if eval_type == WEAK_LABELED:
-                    tags[0] = expand_equivalents(tags[0])
-                intersection = set.intersection(*tags)
+            tags = None
+            for eval_type, mutual_tags in mutual:
+                if eval_type == UNLABELED:
+                    mutual_tags[y] = ()
+                    continue
+                if tags is None:
+                    tags = [tag_mask(m1[y]), tag_mask(m2[y])]
+                guessed_tags = expand_equivalents_mask(tags[0]) if eval_type == WEAK_LABELED else tags[0]
+                intersection = guessed_tags & tags[1]
                 if intersection:  # non-empty intersection
-                    mutual_tags[y] = intersection
+                    mutual_tags[y] = mask_tags(intersection)
                 elif self.errors:
                     self.error_counters.setdefault(eval_type, {}).setdefault(construction, Counter())[
-                        tuple("|".join(sorted(t)) for t in tags)] += 1
+                        tuple("|".join(sorted(mask_tags(t))) for t in (guessed_tags, tags[1]))] += 1
 
     def get_scores(self, p1, p2, eval_type, r=None):
         """
@@ -116,40 +191,63 @@ class Evaluator:
         :param r: reference passage for fine-grained evaluation
         :returns EvaluatorResults object if self.fscore is True, otherwise None
         """
+        return self.get_all_scores(p1, p2, (eval_type,), r=r)[eval_type]
+
+    def get_all_scores(self, p1, p2, eval_types=EVAL_TYPES, r=None, moved_functions=()):
+        """
+        Like get_scores, but for several evaluation types, extracting the yields of each passage only once
+        :param p1: passage to compare
+        :param p2: reference passage object, or Reference object from a ReferenceIndex
+        :param eval_types: evaluation types to use, out of EVAL_TYPES
+        :param r: reference passage for fine-grained evaluation
+        :param moved_functions: if p2 is a Reference, yields of its Fs to move to the root (returned by move_functions)
+        :returns OrderedDict of eval_type -> EvaluatorResults
+        """
         self.mutual.clear()
         self.error_counters.clear()
-        reference_yield_tags = None if r is None else create_passage_yields(r, punct=True)[ALL_EDGES.name]
-        maps = [{}, create_passage_yields(p2, self.constructions,
-                                          reference_yield_tags=reference_yield_tags)]
+        reference_yield_tags = None if r is None else create_passage_yields(r, punct=True).get(ALL_EDGES.name, {})
+        if isinstance(p2, Reference):
+            if r is None:
+                reference_yield_tags = p2.reference_yield_tags
+            maps = [{}, p2.passage_yields(self.constructions, reference_yield_tags, moved_functions)]
+        else:
+            maps = [{}, create_passage_yields(p2, self.constructions,
+                                              reference_yield_tags=reference_yield_tags)]
         if p1 is not None:
-            maps[0] = create_passage_yields(p1, self.constructions,
-                                            reference=p2, reference_yield_tags=reference_yield_tags)
+            if isinstance(p2, Reference):
+                p2.verify_terminals_match(p1)
+            maps[0] = create_passage_yields(p1, self.constructions, reference=None if isinstance(p2, Reference)
+                                            else p2, reference_yield_tags=reference_yield_tags)
             ordered_constructions = [c for c in self.constructions if c in maps[0] or c in maps[1]]
             ordered_constructions += [c for c in maps[1] if c not in ordered_constructions]
             ordered_constructions += [c for c in maps[0] if c not in ordered_constructions]
             for construction in ordered_constructions:
                 yield_tags1 = maps[0].get(construction, {})
                 yield_tags2 = maps[1].get(construction, {})
-                self.find_mutuals(yield_tags1, yield_tags2, eval_type, construction)
+                self.find_mutuals(yield_tags1, yield_tags2, eval_types, construction)
+        return OrderedDict((eval_type, self._results(p1, p2, maps, eval_type)) for eval_type in eval_types)
 
+    def _results(self, p1, p2, maps, eval_type):
         if self.verbose:
             print("Evaluation type: (" + eval_type + ")")
 
-        only = [{c: {y: tags for y, tags in d.items() if y not in self.mutual[c]} for c, d in m.items()} for m in maps]
+        mutual = self.mutual.get(eval_type, {})
+        only = [{c: {y: tags for y, tags in d.items() if y not in mutual.get(c, ())} for c, d in m.items()}
+                for m in maps]
         if self.verbose and self.units and p1 is not None:
             print("==> Mutual Units:")
-            print_tags_and_text(p1, self.mutual[PRIMARY])
+            print_tags_and_text(p1, mutual[PRIMARY])
             print("==> Only in guessed:")
             print_tags_and_text(p1, only[0][PRIMARY])
             print("==> Only in reference:")
-            print_tags_and_text(p2, only[1][PRIMARY])
+            print_tags_and_text(p1 if isinstance(p2, Reference) else p2, only[1][PRIMARY])  # Same terminals
 
         error_counters = self.error_counters.get(eval_type, {})
-        res = EvaluatorResults((c, SummaryStatistics(len(self.mutual[c]),
+        res = EvaluatorResults((c, SummaryStatistics(len(mutual[c]),
                                                      len(only[0].get(c, ())),
                                                      len(only[1].get(c, ())),
                                                      error_counters.get(c)))
-                               for c in self.mutual)
+                               for c in mutual)
         if self.verbose:
             if self.fscore:
                 res.print()
@@ -185,14 +283,10 @@ class Scores:
         :param scores: iterable of Scores
         :return: new Scores with aggregated scores
         """
-        scores = list(scores)
-        evaluators = [s.evaluators for s in scores]
-        names = list(set(s.name for s in scores))
-        formats = list(set(s.format for s in scores))
-        return Scores(((t, EvaluatorResults.aggregate(filter(None, (e.get(t) for e in evaluators))))
-                       for t in EVAL_TYPES),
-                      name=names[0] if len(names) == 1 else None,
-                      evaluation_format=formats[0] if len(formats) == 1 else None)
+        accumulator = ScoreAccumulator()
+        for s in scores:
+            accumulator.add(s)
+        return accumulator.scores()
 
     def print(self, **kwargs):
         for eval_type in EVAL_TYPES:
@@ -222,6 +316,247 @@ class Scores:
     def __getitem__(self, eval_type):
         return self.evaluators[eval_type]
 
+    def counts(self):
+        """
+        Compact representation of the scores, made of tuples of strings and numbers only, so that it can be pickled
+        (Construction objects cannot be, since their criteria are lambda functions)
+        :return: tuple of (name, format, tuple of (eval_type, counts of EvaluatorResults))
+        """
+        return self.name, self.format, tuple((t, e.counts()) for t, e in self.evaluators.items())
+
+    @classmethod
+    def from_counts(cls, counts):
+        """
+        :param counts: tuple returned by Scores.counts
+        :return: new Scores equivalent to the one the counts were taken from
+        """
+        name, evaluation_format, evaluators = counts
+        return Scores(((t, EvaluatorResults.from_counts(e)) for t, e in evaluators), name=name,
+                      evaluation_format=evaluation_format)
+
+
+class ScoreAccumulator:
+    def __init__(self):
+        """
+        Running aggregate of Scores, updated in place as each passage is scored, so that memory does not grow with the
+        number of passages. Contains only strings, numbers and Counters, so it can be pickled, and its counts() can be
+        saved as JSON. Accumulators of different shards can be merged.
+        """
+        self.num_scores = 0
+        self.names = set()
+        self.formats = set()
+        # eval_type -> construction name -> [num_matches, num_only_guessed, num_only_ref, Counter of errors]
+        self.totals = OrderedDict()
+        self.defaults = OrderedDict()  # Names of default constructions, as in EvaluatorResults.aggregate
+
+    def add(self, scores):
+        """
+        :param scores: Scores object to add to the aggregate
+        """
+        self.num_scores += 1
+        self.names.add(scores.name)
+        self.formats.add(scores.format)
+        for eval_type, evaluator_results in scores.evaluators.items():
+            if evaluator_results:  # Like Scores.aggregate, ignore empty results
+                totals = self.totals.setdefault(eval_type, OrderedDict())
+                for construction, stats in evaluator_results.results.items():
+                    self._add_counts(totals, str(construction), stats.num_matches, stats.num_only_guessed,
+                                     stats.num_only_ref, stats.errors)
+                self.defaults.update((str(c), None) for c in evaluator_results.default.values())
+
+    def merge(self, other):
+        """
+        :param other: ScoreAccumulator to add the aggregate of to this one
+        """
+        self.num_scores += other.num_scores
+        self.names.update(other.names)
+        self.formats.update(other.formats)
+        for eval_type, other_totals in other.totals.items():
+            totals = self.totals.setdefault(eval_type, OrderedDict())
+            for name, counts in other_totals.items():
+                self._add_counts(totals, name, *counts)
+        self.defaults.update(other.defaults)
+
+    @staticmethod
+    def _add_counts(totals, name, num_matches, num_only_guessed, num_only_ref, errors):
+        counts = totals.get(name)
+        if counts is None:
+            counts = totals[name] = [0, 0, 0, Counter()]
+        counts[0] += num_matches
+        counts[1] += num_only_guessed
+        counts[2] += num_only_ref
+        if errors:
+            counts[3].update(errors)
+
+    def scores(self):
+        """
+        :return: Scores object equal to Scores.aggregate of all the added Scores
+        """
+        default = OrderedDict((name, get_construction(name)) for name in self.defaults)
+        return Scores(((t, EvaluatorResults(((get_construction(name), SummaryStatistics(*counts))
+                                             for name, counts in self.totals.get(t, {}).items()), default=default))
+                       for t in EVAL_TYPES),
+                      name=next(iter(self.names)) if len(self.names) == 1 else None,
+                      evaluation_format=next(iter(self.formats)) if len(self.formats) == 1 else None)
+
+    def counts(self):
+        """
+        :return: dict with only strings, numbers, lists and dicts (so that it can be saved as JSON) representing the
+                 aggregate, with errors as lists of [guessed tags, ref tags, count]
+        """
+        return dict(num_scores=self.num_scores, names=sorted(self.names, key=str),
+                    formats=sorted(self.formats, key=str), defaults=list(self.defaults),
+                    totals=[[t, [[name] + counts[:3] + [[list(error) + [n] for error, n in counts[3].items()]]
+                                 for name, counts in totals.items()]] for t, totals in self.totals.items()])
+
+    @classmethod
+    def from_counts(cls, counts):
+        """
+        :param counts: dict returned by ScoreAccumulator.counts (possibly after saving and loading it as JSON)
+        :return: new ScoreAccumulator equal to the one the counts were taken from
+        """
+        accumulator = cls()
+        accumulator.num_scores = counts["num_scores"]
+        accumulator.names.update(counts["names"])
+        accumulator.formats.update(counts["formats"])
+        accumulator.defaults.update((name, None) for name in counts["defaults"])
+        for t, totals in counts["totals"]:
+            accumulator.totals[t] = OrderedDict(
+                (name, [num_matches, num_only_guessed, num_only_ref, Counter({tuple(e[:-1]): e[-1] for e in errors})])
+                for name, num_matches, num_only_guessed, num_only_ref, errors in totals)
+        return accumulator
+
+
+class ScoreArrays:
+    def __init__(self):
+        """
+        Per-passage counts of the added Scores, kept for significance testing (see bootstrap, paired_bootstrap and
+        approximate_randomization): for each evaluation type and construction, the number of matches, guessed units and
+        reference units in each passage.
+        """
+        self.num_scores = 0
+        self.rows = OrderedDict()  # (eval_type, construction name) -> list of (num_matches, num_guessed, num_ref)
+
+    def add(self, scores):
+        """
+        :param scores: Scores object of the next passage
+        """
+        for eval_type, evaluator_results in scores.evaluators.items():
+            for construction, stats in evaluator_results.results.items():
+                rows = self.rows.get((eval_type, str(construction)))
+                if rows is None:  # Not seen in previous passages, so it had no units there
+                    rows = self.rows[(eval_type, str(construction))] = [(0, 0, 0)] * self.num_scores
+                rows.append((stats.num_matches, stats.num_guessed, stats.num_ref))
+        self.num_scores += 1
+        for rows in self.rows.values():
+            if len(rows) < self.num_scores:
+                rows.append((0, 0, 0))
+
+    def array(self, eval_type=LABELED, constructions=DEFAULT):
+        """
+        :param eval_type: evaluation type, out of EVAL_TYPES
+        :param constructions: construction names to sum the counts of (default: primary and remote, as in average_f1)
+        :return: NumPy array of shape (number of passages, 3): number of matches, guessed and reference units
+        """
+        import numpy as np
+        counts = np.zeros((self.num_scores, 3), dtype=np.int64)
+        for construction in [constructions] if isinstance(constructions, (str, Construction)) else constructions:
+            rows = self.rows.get((eval_type, str(construction)))
+            if rows:
+                counts += np.array(rows, dtype=np.int64)
+        return counts
+
+
+def f1_scores(counts):
+    """
+    Vectorized version of SummaryStatistics.f1
+    :param counts: NumPy array whose last dimension is (num_matches, num_guessed, num_ref), as in ScoreArrays.array
+    :return: NumPy array of the F1 scores, with the shape of counts without its last dimension
+    """
+    import numpy as np
+    num_matches, num_guessed, num_ref = np.moveaxis(np.asarray(counts, dtype=np.float64), -1, 0)
+    p = np.where(num_guessed == 0, 1.0, num_matches / np.maximum(num_guessed, 1))
+    r = np.where(num_ref == 0, 1.0, num_matches / np.maximum(num_ref, 1))
+    return np.where((p == 0) | (r == 0), 0.0, 2.0 * p * r / np.maximum(p + r, 1e-12))
+
+
+def _resample_sums(counts, num_samples, rng, chunk_size=10 ** 7):
+    """
+    :param counts: list of NumPy arrays of shape (number of passages, 3), resampled together (paired)
+    :return: generator of lists of arrays of shape (chunk, 3): total counts in each bootstrap sample (passages
+             drawn with replacement), as a matrix product of how many times each passage was drawn by the counts
+    """
+    import numpy as np
+    n = len(counts[0])
+    chunk = max(1, chunk_size // max(n, 1))
+    for start in range(0, num_samples, chunk):
+        size = min(chunk, num_samples - start)
+        drawn = rng.randint(n, size=(size, n)) + n * np.arange(size)[:, None]  # Offset to count each sample apart
+        weights = np.bincount(drawn.ravel(), minlength=size * n).reshape(size, n)
+        yield [weights @ c for c in counts]
+
+
+def bootstrap(counts, num_samples=1000, alpha=0.05, seed=0):
+    """
+    Bootstrap confidence interval for the F1 score of a corpus, resampling its passages with replacement
+    :param counts: NumPy array returned by ScoreArrays.array
+    :param num_samples: number of bootstrap samples
+    :param alpha: significance level: the interval contains 1-alpha of the samples' F1 scores
+    :param seed: random seed
+    :return: tuple of (F1 score of the whole corpus, lower bound, upper bound)
+    """
+    import numpy as np
+    rng = np.random.RandomState(seed)
+    f1 = np.concatenate([f1_scores(sums) for sums, in _resample_sums([counts], num_samples, rng)])
+    low, high = np.percentile(f1, (100 * alpha / 2, 100 * (1 - alpha / 2)))
+    return float(f1_scores(counts.sum(axis=0))), float(low), float(high)
+
+
+def paired_bootstrap(counts1, counts2, num_samples=1000, alpha=0.05, seed=0):
+    """
+    Paired bootstrap test for the difference between the F1 scores of two systems on the same passages
+    :param counts1: NumPy array returned by ScoreArrays.array, for the first system
+    :param counts2: NumPy array returned by ScoreArrays.array, for the second system, with the passages in same order
+    :param num_samples: number of bootstrap samples
+    :param alpha: significance level for the confidence interval of the difference
+    :param seed: random seed
+    :return: tuple of (F1 of the first system minus F1 of the second, lower bound, upper bound, p-value), where the
+             p-value is the fraction of samples in which the difference does not have the same sign as observed
+    """
+    import numpy as np
+    rng = np.random.RandomState(seed)
+    diff = np.concatenate([f1_scores(sums1) - f1_scores(sums2)
+                           for sums1, sums2 in _resample_sums([counts1, counts2], num_samples, rng)])
+    observed = float(f1_scores(counts1.sum(axis=0)) - f1_scores(counts2.sum(axis=0)))
+    low, high = np.percentile(diff, (100 * alpha / 2, 100 * (1 - alpha / 2)))
+    return observed, float(low), float(high), float(np.mean(diff <= 0 if observed > 0 else diff >= 0))
+
+
+def approximate_randomization(counts1, counts2, num_samples=1000, seed=0, chunk_size=10 ** 7):
+    """
+    Approximate randomization test for the difference between the F1 scores of two systems on the same passages:
+    each sample swaps the two systems' counts of each passage with probability 1/2
+    :param counts1: NumPy array returned by ScoreArrays.array, for the first system
+    :param counts2: NumPy array returned by ScoreArrays.array, for the second system, with the passages in same order
+    :param num_samples: number of random samples
+    :param seed: random seed
+    :param chunk_size: maximum size of the swap matrix to draw at once
+    :return: two-sided p-value: fraction of samples (counting the observed one) whose absolute F1 difference is at
+             least the observed one
+    """
+    import numpy as np
+    rng = np.random.RandomState(seed)
+    totals1, totals2 = counts1.sum(axis=0), counts2.sum(axis=0)
+    observed = abs(f1_scores(totals1) - f1_scores(totals2))
+    delta = counts2 - counts1
+    chunk = max(1, chunk_size // max(len(counts1), 1))
+    num_extreme = 0
+    for start in range(0, num_samples, chunk):
+        swapped = (rng.random_sample((min(chunk, num_samples - start), len(counts1))) < .5) @ delta
+        diff = np.abs(f1_scores(totals1 + swapped) - f1_scores(totals2 - swapped))
+        num_extreme += int(np.sum(diff >= observed - 1e-12))
+    return (num_extreme + 1) / (num_samples + 1)
+
 
 class EvaluatorResults:
     def __init__(self, results, default=None):
@@ -282,6 +617,22 @@ class EvaluatorResults:
     def __getitem__(self, construction):
         return self.results.get(construction, SummaryStatistics(0, 0, 0, Counter()))
 
+    def counts(self):
+        """:return tuple of (construction name, num_matches, num_only_guessed, num_only_ref, errors) per construction,
+                  where errors is a tuple of (error, count) pairs, or None"""
+        return tuple((c.name, r.num_matches, r.num_only_guessed, r.num_only_ref,
+                      None if r.errors is None else tuple(r.errors.items())) for c, r in self.results.items())
+
+    @classmethod
+    def from_counts(cls, counts):
+        """
+        :param counts: tuple returned by EvaluatorResults.counts
+        :return: new EvaluatorResults
+        """
+        return EvaluatorResults((get_construction(name), SummaryStatistics(
+            num_matches, num_only_guessed, num_only_ref, None if errors is None else Counter(dict(errors))))
+            for name, num_matches, num_only_guessed, num_only_ref, errors in counts)
+
 
 class SummaryStatistics:
     def __init__(self, num_matches, num_only_guessed, num_only_ref, errors=None):
@@ -306,22 +657,275 @@ class SummaryStatistics:
         :param stats: iterable of SummaryStatistics
         :return: new SummaryStatistics with aggregated scores
         """
-        return SummaryStatistics(*map(sum, [map(attrgetter(attr), stats)
-                                            for attr in ("num_matches", "num_only_guessed", "num_only_ref")]),
-                                 Counter({k: sum((s.errors or {}).get(k, 0) for s in stats)
-                                          for k in set.union(*[set(s.errors or ()) for s in stats])}))
+        num_matches = num_only_guessed = num_only_ref = 0
+        errors = Counter()
+        for s in stats:
+            num_matches += s.num_matches
+            num_only_guessed += s.num_only_guessed
+            num_only_ref += s.num_only_ref
+            if s.errors:
+                errors.update(s.errors)
+        return SummaryStatistics(num_matches, num_only_guessed, num_only_ref, errors)
 
     def __bool__(self):
         return bool(self.num_matches or self.num_only_guessed or self.num_only_ref or self.errors)
 
 
+def get_construction(name):
+    """
+    :param name: name of a Construction, or of a category (edge tag) for fine-grained evaluation
+    :return: the Construction by this name
+    """
+    construction = CONSTRUCTION_BY_NAME.get(name)
+    return Construction(name, CATEGORY_DESCRIPTIONS.get(name, name), criterion=None) if construction is None \
+        else construction
+
+
+# Constructions whose criteria depend only on the edge and its child, and not on the terminals of the child, which
+# change when Fs are moved to the root, so that they can be precomputed by ReferenceIndex
+REFERENCE_INDEX_CONSTRUCTIONS = (PRIMARY.name, "remote", "mwe", CATEGORIES_NAME)
+
+
+class Reference:
+    def __init__(self, passage, constructions=DEFAULT, normalize=True, ref_yield_tags=None):
+        """
+        Reference-side data of one passage needed by Evaluator, computed once so that the passage need not be normalized
+        and traversed again for every evaluation against it. The passage itself is not modified.
+        :param passage: reference Passage object
+        :param constructions: names of construction types to support, out of REFERENCE_INDEX_CONSTRUCTIONS
+        :param normalize: whether to normalize the passage (as `evaluate' does by default)
+        :param ref_yield_tags: reference passage for fine-grained evaluation
+        """
+        self.ID = passage.ID
+        self.normalized = normalize
+        constructions = list(DEFAULT.values()) + [c for c in get_by_names(constructions) if c not in DEFAULT.values()]
+        unsupported = [str(c) for c in constructions if str(c) not in REFERENCE_INDEX_CONSTRUCTIONS]
+        if unsupported:
+            raise ValueError("Constructions not supported by ReferenceIndex: " + ", ".join(unsupported))
+        self.constructions = [str(c) for c in constructions]
+        self.reference_yield_tags = None if ref_yield_tags is None else \
+            create_passage_yields(ref_yield_tags, punct=True).get(ALL_EDGES.name, {})
+        edge_constructions = [c for c in constructions if str(c) != CATEGORIES_NAME]
+        with passage.revert_changes():
+            if normalize:
+                normalization.normalize(passage)
+            l1 = passage.layer(layer1.LAYER_ID)
+            self.head = l1.heads[0].ID
+            self.terminal_ids = frozenset(terminal_ids(passage))
+            masks = get_yield_masks(passage)
+            self.masks = masks  # Node ID -> (yield including punctuation, yield excluding punctuation)
+            self.children = OrderedDict((node.ID, [e.child.ID for e in node if not e.attrib.get("remote")])
+                                        for node in l1.all)
+            self.punct_nodes = frozenset(node.ID for node in l1.all if node.tag == NodeTags.Punctuation)
+            # Parent ID -> list of (child ID, edge tag, names of constructions except categories), in candidate order
+            self.edges = OrderedDict((node.ID, []) for node in l1.all)
+            for candidate in get_candidates(passage):
+                self.edges[candidate.edge.parent.ID].append((candidate.edge.child.ID, candidate.edge.tag, [
+                    str(c) for c in candidate.constructions(edge_constructions)] if edge_constructions else []))
+            # Yield -> (unit ID, number of parents, names of constructions of the unit's edge after moving it to root)
+            self.functions = {}
+            for positions, unit in get_functions(passage).items():
+                num_parents = len(unit.parents)
+                edge = l1.heads[0].add(EdgeTags.Function, unit)  # Temporary, just to find its constructions
+                self.functions[positions] = (unit.ID, num_parents, [
+                    str(c) for c in Candidate(edge, yield_masks=masks).constructions(edge_constructions)]
+                    if edge_constructions else [])
+                l1.heads[0].remove(edge)
+
+    def verify_terminals_match(self, passage):
+        ids = terminal_ids(passage)
+        assert ids == self.terminal_ids, "Reference passage terminals do not match: %s (%d != %d)" % (
+            self.ID, len(ids), len(self.terminal_ids))
+
+    def passage_yields(self, constructions, reference_yield_tags=None, moved_functions=()):
+        """
+        Like create_passage_yields for the reference passage, after moving the Fs with the given yields to the root
+        :param constructions: list of Construction objects to include, a subset of those given to the constructor
+        :param reference_yield_tags: yield tags from reference passage for fine-grained evaluation
+        :param moved_functions: yields (keys of self.functions) of the Fs to move to the root, as move_functions does
+        :returns dict: Construction -> dict: yield bitmask (excluding punctuation) -> list of edge tags
+        """
+        missing = [str(c) for c in constructions if str(c) not in self.constructions]
+        if missing:
+            raise ValueError("Reference %s was not indexed with constructions: %s" % (self.ID, ", ".join(missing)))
+        names = {str(c) for c in constructions}
+        masks, edges = self.masks, self.edges
+        moved = OrderedDict((self.functions[positions][0], self.functions[positions][1:])
+                            for positions in moved_functions)
+        if moved:
+            children = OrderedDict((node_id, [c for c in node_children if c not in moved])
+                                   for node_id, node_children in self.children.items())
+            children[self.head] += list(moved)
+            masks = self._yield_masks(children)
+            edges = OrderedDict((node_id, [e for e in node_edges if e[0] not in moved])
+                                for node_id, node_edges in edges.items())
+            edges[self.head] = sorted(edges[self.head] + [(unit_id, EdgeTags.Function, unit_names)
+                                                          for unit_id, (num_parents, unit_names) in moved.items()
+                                                          for _ in range(num_parents)],
+                                      key=lambda e: _id_orderkey(e[0]))  # Like add_ordered in core.Node.add
+        yield_tags = OrderedDict((str(c), {}) for c in constructions)
+        for node_edges in edges.values():
+            for child_id, tag, edge_names in node_edges:
+                terminal_yield, terminal_yield_no_punct = masks[child_id]
+                for name in edge_names:
+                    if name in names:
+                        yield_tags[name].setdefault(terminal_yield_no_punct, []).append(tag)
+                if CATEGORIES_NAME in names:
+                    for category in (tag,) if reference_yield_tags is None else \
+                            reference_yield_tags.get(terminal_yield, ()):
+                        yield_tags.setdefault(category, {}).setdefault(terminal_yield_no_punct, []).append(tag)
+        return OrderedDict((get_construction(name), y) for name, y in yield_tags.items() if y)
+
+    def _yield_masks(self, children):
+        """Like get_yield_masks, for the given node ID -> child IDs graph"""
+        masks = {}
+        visiting = set()
+        for start in children:
+            stack = [start]
+            while stack:
+                node_id = stack[-1]
+                if node_id in masks:
+                    stack.pop()
+                elif node_id not in children:  # Terminal
+                    masks[node_id] = self.masks[node_id]
+                    stack.pop()
+                else:
+                    pending = [c for c in children[node_id] if c not in masks and c not in visiting]
+                    if pending and node_id not in visiting:  # Visit children first
+                        visiting.add(node_id)
+                        stack += pending
+                    else:  # Children are done (except for those in a cycle)
+                        visiting.discard(node_id)
+                        mask = mask_no_punct = 0
+                        for child_id in children[node_id]:
+                            child_mask, child_mask_no_punct = masks.get(child_id, (0, 0))
+                            mask |= child_mask
+                            mask_no_punct |= child_mask_no_punct
+                        masks[node_id] = (mask, 0 if node_id in self.punct_nodes else mask_no_punct)
+                        stack.pop()
+        return masks
+
+
+def _id_orderkey(node_id):
+    """Like core.id_orderkey, given just the node ID"""
+    layer, unique = node_id.split(core.Node.ID_SEPARATOR)
+    return layer, int(unique)
+
+
+class ReferenceIndex:
+    def __init__(self, refs, ref_yield_tags=None, constructions=DEFAULT, normalize=True, sources=None):
+        """
+        Reference objects for a corpus of reference passages, to evaluate any number of guessed corpora against, and
+        to be saved to and loaded from a file so that it can be reused across runs.
+        Evaluating with a Reference (passing it to `evaluate' as `ref') gives the same scores as with its passage.
+        :param refs: iterable of reference Passage objects (not modified)
+        :param ref_yield_tags: iterable of reference passages for fine-grained evaluation, matching refs
+        :param constructions: names of construction types to support, out of REFERENCE_INDEX_CONSTRUCTIONS
+        :param normalize: whether to normalize the passages (as `evaluate' does by default)
+        :param sources: files and/or directories the passages were read from, one per argument, e.g. (ref files,
+                        ref_yield_tags files); their paths, sizes and modification times are saved with the index, so
+                        that a stale index can be detected after loading it (see `mismatch')
+        """
+        self.references = [Reference(ref, constructions, normalize, r)
+                           for ref, r in zip(refs, ref_yield_tags or repeat(None))]
+        self.by_id = {ref.ID: ref for ref in self.references}
+        self.params = self.get_params(constructions, normalize, ref_yield_tags is not None, sources)
+
+    @staticmethod
+    def get_params(constructions=DEFAULT, normalize=True, ref_yield_tags=False, sources=None):
+        """
+        :return: dict of the parameters an index is built with, as saved with it and compared by `mismatch'
+        """
+        return OrderedDict((
+            ("constructions", sorted({str(c) for c in list(DEFAULT.values()) + get_by_names(constructions)})),
+            ("normalize", normalize),
+            ("ref_yield_tags", bool(ref_yield_tags)),
+            ("sources", None if sources is None else [None if s is None else _file_stats(s) for s in sources]),
+        ))
+
+    def mismatch(self, constructions=DEFAULT, normalize=True, ref_yield_tags=False, sources=None):
+        """
+        Compare the parameters the index was built with to the given ones (see __init__)
+        :param ref_yield_tags: whether reference passages for fine-grained evaluation are given
+        :param sources: files and/or directories the passages would be read from (None to not check them)
+        :return: description of the first difference, or None if the index matches the parameters and the sources
+                 have not changed since it was built
+        """
+        for key, value in self.get_params(constructions, normalize, ref_yield_tags, sources).items():
+            saved = self.params.get(key)
+            if key == "sources" and value is None:
+                continue
+            if key == "sources" and saved is not None:
+                for stats, saved_stats in zip(value, saved):
+                    changed = sorted(set(stats or ()) ^ set(saved_stats or ()))
+                    if changed:
+                        return "'%s' was added, removed or modified since it was built" % changed[0][0]
+            if value != saved:
+                return "it was built with %s=%s rather than %s" % (key, saved, value)
+        return None
+
+    def __getitem__(self, passage_id):
+        return self.by_id[passage_id]
+
+    def __contains__(self, passage_id):
+        return passage_id in self.by_id
+
+    def __iter__(self):
+        return iter(self.references)
+
+    def __len__(self):
+        return len(self.references)
+
+    def save(self, filename):
+        with open(filename, "wb") as f:
+            pickle.dump(dict(params=self.params, references=self.references), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        :param filename: file written by ReferenceIndex.save
+        :return: the saved ReferenceIndex (check it is not stale using `mismatch')
+        """
+        index = cls(())
+        with open(filename, "rb") as f:
+            saved = pickle.load(f)
+        if not isinstance(saved, dict) or "references" not in saved:
+            raise ValueError("'%s' is not a reference index file" % filename)
+        index.params, index.references = saved["params"], saved["references"]
+        index.by_id = {ref.ID: ref for ref in index.references}
+        return index
+
+
+def _file_stats(files_and_dirs):
+    """
+    :param files_and_dirs: file or directory name, or iterable of them
+    :return: list of (absolute path, size, modification time) of each file given or directly under a directory given,
+             with None size and time for files that do not exist
+    """
+    stats = []
+    for file_or_dir in [files_and_dirs] if isinstance(files_and_dirs, str) else files_and_dirs:
+        filenames = [os.path.join(file_or_dir, f) for f in sorted(os.listdir(file_or_dir))] \
+            if os.path.isdir(file_or_dir) else [file_or_dir]
+        for filename in filenames:
+            if not os.path.isdir(filename):
+                try:
+                    stat = os.stat(filename)
+                except FileNotFoundError:
+                    stats.append((os.path.abspath(filename), None, None))
+                else:
+                    stats.append((os.path.abspath(filename), stat.st_size, stat.st_mtime_ns))
+    return stats
+
+
 def evaluate(guessed, ref, converter=None, verbose=False, constructions=DEFAULT,
-             units=False, fscore=True, errors=False, normalize=True, eval_type=None, ref_yield_tags=None, **kwargs):
+             units=False, fscore=True, errors=False, normalize=True, eval_type=None, ref_yield_tags=None, inplace=True,
+             **kwargs):
     """
     Compare two passages and return requested diagnostics and scores, possibly printing them too.
-    NOTE: since normalize=True by default, this method is destructive: it modifies the given passages before evaluation.
+    NOTE: since normalize=True and inplace=True by default, this method is destructive: it modifies the given passages
+    before evaluation. Pass inplace=False to have them restored after evaluation.
     :param guessed: Passage object to evaluate
-    :param ref: reference Passage object to compare to
+    :param ref: reference Passage object to compare to, or Reference object from a ReferenceIndex
     :param converter: optional function to apply to passages before evaluation
     :param verbose: whether to print the results
     :param constructions: names of construction types to include in the evaluation
@@ -331,17 +935,57 @@ def evaluate(guessed, ref, converter=None, verbose=False, constructions=DEFAULT,
     :param normalize: flatten centers and move common functions to root before evaluation - modifies passages
     :param eval_type: specific evaluation type to limit to
     :param ref_yield_tags: reference passage for fine-grained evaluation
+    :param inplace: whether to leave the passages normalized; if False, they are reverted to their original state
+                    after evaluation (without copying them), so they can be evaluated again, e.g. every epoch
     :return: Scores object
     """
     del kwargs
+    indexed = isinstance(ref, Reference)  # Already normalized, if requested
+    if indexed and ref.normalized != normalize:
+        raise ValueError("Reference %s was indexed with normalize=%s" % (ref.ID, ref.normalized))
     if converter is not None:
         guessed = converter(guessed)
-        ref = converter(ref)
-    if normalize:
-        for passage in (guessed, ref):
-            normalization.normalize(passage)  # flatten Cs inside Cs
-        move_functions(guessed, ref)  # move common Fs to be under the root
-
-    evaluator = Evaluator(verbose, constructions, units, fscore, errors)
-    return Scores((evaluation_type, evaluator.get_scores(guessed, ref, evaluation_type, r=ref_yield_tags))
-                  for evaluation_type in ([eval_type] if eval_type else EVAL_TYPES))
+        if not indexed:
+            ref = converter(ref)
+    passages = (guessed,) if indexed else (guessed, ref)
+    moved_functions = ()
+    with ExitStack() as stack:
+        if normalize:
+            for passage in passages:
+                if not inplace:
+                    stack.enter_context(passage.revert_changes())
+                normalization.normalize(passage)  # flatten Cs inside Cs
+            moved_functions = move_functions(guessed, ref)  # move common Fs to be under the root
+
+        evaluator = Evaluator(verbose, constructions, units, fscore, errors)
+        return Scores(evaluator.get_all_scores(guessed, ref, [eval_type] if eval_type else EVAL_TYPES,
+                                               r=ref_yield_tags, moved_functions=moved_functions).items())
+
+
+def _evaluate_counts(pair, kwargs):
+    """Evaluate one pair of passages in a worker process, returning Scores.counts() since Scores cannot be pickled"""
+    return evaluate(*pair[:2], ref_yield_tags=pair[2] if len(pair) > 2 else None, **kwargs).counts()
+
+
+def evaluate_corpus(pairs, workers=0, **kwargs):
+    """
+    Evaluate many pairs of passages, possibly in parallel, streaming back the scores in input order.
+    With workers > 0, the passages are normalized in the worker processes, so the given passages are not modified.
+    :param pairs: iterable of (guessed, ref) or (guessed, ref, ref_yield_tags) tuples of Passage objects
+    :param workers: number of processes to evaluate in (0 to evaluate in the current process)
+    :param kwargs: keyword arguments to pass to `evaluate'
+    :return: generator of Scores objects, one per pair
+    """
+    if not workers:
+        for pair in pairs:
+            yield evaluate(*pair[:2], ref_yield_tags=pair[2] if len(pair) > 2 else None, **kwargs)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    pending = deque()  # Futures of submitted pairs, in order
+    with ProcessPoolExecutor(workers) as executor:
+        for pair in pairs:
+            pending.append(executor.submit(_evaluate_counts, pair, kwargs))
+            if len(pending) > 2 * workers:  # Keep workers busy without reading all passages in advance
+                yield Scores.from_counts(pending.popleft().result())
+        while pending:
+            yield Scores.from_counts(pending.popleft().result())
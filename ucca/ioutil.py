@@ -1,21 +1,137 @@
 """Input/output utility functions for UCCA scripts."""
+import pickle
+import random
+import select
+import threading
+import struct
 import sys
 import time
-from collections import defaultdict
+from collections import defaultdict, deque
 from itertools import filterfalse, chain
+from queue import Queue
 
 import os
 from contextlib import contextmanager
 from glob import glob
-from tqdm import tqdm
-from xml.etree.ElementTree import ParseError
 
-from ucca.convert import file2passage, passage2file, from_text, to_text, split2segments
+from ucca.convert import file2passage, file2passages, detect_format, passage2file, passage2jsonl, from_text, \
+    to_text, split2segments_all, open_file, strip_compression
+from ucca.__version__ import VERSION
+from ucca import layer0
 from ucca.core import Passage
 
 DEFAULT_LANG = "en"
 DEFAULT_ATTEMPTS = 3
 DEFAULT_DELAY = 5
+CACHE_ENV_VAR = "UCCA_PASSAGE_CACHE"  # Directory to cache parsed passages in, if not given explicitly
+CACHE_SIZE_ENV_VAR = "UCCA_PASSAGE_CACHE_SIZE"  # Maximum total size of cached passages, in bytes
+DEFAULT_CACHE_SIZE = 2 ** 30
+DEFAULT_IDLE_TIMEOUT = 60
+DEFAULT_POLL_INTERVAL = 1
+TEMP_SUFFIXES = (".tmp", ".part")  # Files still being written, to be renamed when complete
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+INOTIFY_EVENT = struct.Struct("iIII")
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_SHARDS = 16
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_BUCKET_SIZE = 100
+
+
+class PassageCache:
+    """
+    Persistent cache of parsed passage files, stored as pickles in a directory.
+    Entries are keyed by the absolute path, size and modification time of the file and by the library version,
+    so an entry is not used once the file (or the library) changes.
+    When the total size exceeds the maximum, the least recently used entries are removed.
+    """
+    def __init__(self, directory, max_size=None):
+        """
+        :param directory: directory to store cached passages in, created if it does not exist
+        :param max_size: maximum total size of cached passages in bytes (default: CACHE_SIZE_ENV_VAR or
+                         DEFAULT_CACHE_SIZE)
+        """
+        self.directory = directory
+        self.max_size = max_size or int(os.environ.get(CACHE_SIZE_ENV_VAR) or DEFAULT_CACHE_SIZE)
+        os.makedirs(directory, exist_ok=True)
+        self._size = None  # Total size of entries, calculated when first needed
+
+    def key(self, filename):
+        import hashlib
+        stat = os.stat(filename)
+        return hashlib.sha1(repr((os.path.abspath(filename), stat.st_size, stat.st_mtime_ns, VERSION)).encode()
+                            ).hexdigest()
+
+    def file2passage(self, filename, passage_format=None):
+        """
+        Returns the cached Passage for a file if it is up to date, or else parses the file and caches the Passage
+        :param filename: passage file to read
+        :param passage_format: PassageFormat to read the file as, instead of detecting it
+        """
+        path = os.path.join(self.directory, self.key(filename) + ".pickle")
+        try:
+            with open(path, "rb") as h:
+                passage = pickle.load(h)
+            os.utime(path)  # Mark as recently used
+            return passage
+        except (IOError, EOFError, pickle.UnpicklingError):  # Not cached yet, or removed or corrupted meanwhile
+            pass
+        passage = file2passage(filename, passage_format)
+        self._store(path, passage)
+        return passage
+
+    def _store(self, path, passage):
+        temp = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp, "wb") as h:
+            pickle.dump(passage, h, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)  # Atomic, so that concurrent readers never see a partial entry
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += os.path.getsize(path)
+        if self._size > self.max_size:
+            self.evict()
+
+    def _entries(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".pickle"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:  # Removed by another process
+                    continue
+                yield stat.st_mtime, stat.st_size, name
+
+    def evict(self, target_size=None):
+        """
+        Removes least recently used entries until the total size is at most target_size
+        :param target_size: size in bytes to reduce to (default: 90% of the maximum, so that eviction is not needed
+                            again immediately)
+        """
+        if target_size is None:
+            target_size = int(.9 * self.max_size)
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if self._size <= target_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:  # Removed by another process
+                pass
+            self._size -= size
+
+    def clear(self):
+        self.evict(target_size=0)
+
+
+def get_cache(cache=None):
+    """
+    :param cache: PassageCache, directory name, or None to use the directory in CACHE_ENV_VAR if set
+    :return: PassageCache, or None if caching is not enabled
+    """
+    if cache is None:
+        cache = os.environ.get(CACHE_ENV_VAR)
+    return PassageCache(cache) if cache and isinstance(cache, str) else cache or None
 
 
 class LazyLoadedPassages:
@@ -23,7 +139,22 @@ class LazyLoadedPassages:
     Iterable interface to Passage objects that loads files on-the-go and can be iterated more than once
     """
     def __init__(self, files, sentences=False, paragraphs=False, converters=None, lang=DEFAULT_LANG,
-                 attempts=DEFAULT_ATTEMPTS, delay=DEFAULT_DELAY):
+                 attempts=DEFAULT_ATTEMPTS, delay=DEFAULT_DELAY, workers=0, prefetch=None, threads=False, cache=None):
+        """
+        :param files: list of files and/or Passage objects
+        :param sentences: whether to split to sentences
+        :param paragraphs: whether to split to paragraphs
+        :param converters: dict of input format converters to use based on the file extension
+        :param lang: language to use for tokenization model
+        :param attempts: number of times to try reading a file before giving up
+        :param delay: number of seconds to wait before subsequent attempts to read a file
+        :param workers: number of worker processes to load files in (0 to load in the calling thread).
+                        Passages are still returned in the order of the files, and splitting is done in the workers.
+                        Any converters given must be picklable, unless threads=True.
+        :param prefetch: maximum number of files to load ahead when using workers (default: twice the workers)
+        :param threads: use worker threads rather than processes, e.g. when reading is I/O-bound
+        :param cache: PassageCache or directory to cache parsed passage files in (default: CACHE_ENV_VAR if set)
+        """
         self.files = files
         self.sentences = sentences
         self.paragraphs = paragraphs
@@ -32,22 +163,91 @@ class LazyLoadedPassages:
         self.lang = lang
         self.attempts = attempts
         self.delay = delay
+        self.workers = workers
+        self.prefetch = prefetch or 2 * workers
+        self.threads = threads
+        self.cache = get_cache(cache)
+        self._worker_kwargs = dict(sentences=sentences, paragraphs=paragraphs, converters=converters, lang=lang,
+                                   attempts=attempts, delay=delay, cache=self.cache or False)
         self._files_iter = None
         self._split_iter = None
         self._file_handle = None
+        self._executor = None
+        self._pending = deque()  # (file, future) for files being loaded by workers, in order
+        self._loaded = deque()  # passages loaded by workers from the current file
 
     def __iter__(self):
+        self.close()
         self._files_iter = iter(self.files)
-        self._split_iter = None
-        self._file_handle = None
         return self
 
     def __next__(self):
         while True:
-            passage = self._next_passage()
+            try:
+                passage = self._next_loaded_passage() if self.workers else self._next_passage()
+            except StopIteration:
+                self.close()
+                raise
             if passage is not None:
                 return passage
 
+    def close(self):
+        """Stop any workers and close the current file, e.g. if iteration is abandoned before it is finished"""
+        self._shutdown()
+        self._split_iter = None
+        if self._file_handle is not None:
+            self._file_handle.close()
+            self._file_handle = None
+        close_files = getattr(self._files_iter, "close", None)  # e.g. a DirectoryWatcher
+        if close_files is not None:
+            close_files()
+
+    def __del__(self):
+        if hasattr(self, "_pending"):  # Fully initialized
+            self.close()
+
+    def _next_loaded_passage(self):
+        if not self._loaded:
+            self._submit()
+            if not self._pending:  # Finished iteration
+                raise StopIteration
+            file, future = self._pending.popleft()
+            self._submit(block=False)  # Keep the workers busy, but do not wait for files that do not exist yet
+            try:
+                self._loaded.extend(future.result())
+            except Exception as e:
+                raise IOError("Failed reading '%s'" % getattr(file, "ID", file)) from e
+            return None
+        return self._loaded.popleft()
+
+    def _submit(self, block=True):
+        """
+        Submit files to the workers, up to the prefetch limit.
+        If the files are being watched (see DirectoryWatcher), only wait for a new file if nothing is pending and block
+        is True, so that files that are already complete are returned as soon as they are loaded.
+        """
+        poll = getattr(self._files_iter, "poll", None)
+        while len(self._pending) < self.prefetch:
+            try:
+                file = next(self._files_iter) if poll is None or block and not self._pending else poll()
+            except StopIteration:
+                return
+            if file is None:  # No complete file yet
+                return
+            if self._executor is None:  # Only start the workers once there is something to load
+                from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+                self._executor = (ThreadPoolExecutor if self.threads else ProcessPoolExecutor)(self.workers)
+            self._pending.append((file, self._executor.submit(_load_passages, file, **self._worker_kwargs)))
+
+    def _shutdown(self):
+        if self._executor is not None:
+            for _, future in self._pending:
+                future.cancel()
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._pending.clear()
+        self._loaded.clear()
+
     def _next_passage(self):
         passage = None
         if self._split_iter is None:
@@ -67,20 +267,25 @@ class LazyLoadedPassages:
                         print("Failed reading %s, trying %d more times..." % (file, attempts), file=sys.stderr)
                     time.sleep(self.delay)
                     attempts -= 1
-                try:
-                    passage = file2passage(file)  # XML or binary format
-                except (IOError, ParseError):  # Failed to read as passage file
-                    base, ext = os.path.splitext(os.path.basename(file))
-                    converter = self.converters.get(ext.lstrip("."))
+                base, ext = os.path.splitext(os.path.basename(strip_compression(file)))
+                ext = ext.lstrip(".")
+                # Check the contents only if there is no specific converter for the extension
+                passage_format = detect_format(file, by_magic=ext not in self.converters)
+                if passage_format is None:  # Not a passage file
+                    converter = self.converters.get(ext)
                     if converter is None:
-                        raise
-                    self._file_handle = open(file, encoding="utf-8")
+                        raise IOError("Unknown passage file format: '%s'" % file)
+                    self._file_handle = open_file(file, encoding="utf-8")
                     self._split_iter = iter(converter(chain(self._file_handle, [""]), passage_id=base, lang=self.lang))
+                elif passage_format.multiple:  # Archive of passages, e.g. shards written by PassageWriter
+                    self._split_iter = file2passages(file, passage_format)
+                else:
+                    # XML, binary or other registered format
+                    passage = (self.cache.file2passage if self.cache else file2passage)(file, passage_format)
             if self.split:
                 if self._split_iter is None:
                     self._split_iter = (passage,)
-                self._split_iter = iter(s for p in self._split_iter for s in
-                                        split2segments(p, is_sentences=self.sentences, lang=self.lang))
+                self._split_iter = split2segments_all(self._split_iter, is_sentences=self.sentences, lang=self.lang)
         if self._split_iter is not None:  # Either set before or initialized now
             try:
                 passage = next(self._split_iter)
@@ -108,7 +313,130 @@ class LazyLoadedPassages:
         return bool(self.files)
 
 
+def _load_passages(file, **kwargs):
+    """Loads all passages from one file (or splits one Passage) in a worker"""
+    return list(LazyLoadedPassages([file], **kwargs))
+
+
+def _load_shard(files, cache_file=None, **kwargs):
+    """Loads and splits all passages from a shard of files in a worker, reading them from cache_file if it exists
+    and writing them to it otherwise"""
+    if cache_file is not None and os.path.exists(cache_file):
+        return list(file2passages(cache_file))
+    passages = list(LazyLoadedPassages(files, **kwargs))
+    if cache_file is not None:
+        temp = "%s.%d.tmp" % (cache_file, os.getpid())
+        with open(temp, "wb") as h:
+            for passage in passages:
+                pickle.dump(passage, h, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, cache_file)
+    return passages
+
+
+class EpochLoader:
+    """
+    Loader of training batches from a corpus, for multiple epochs.
+    The files are divided into shards, each loaded and split to sentences (or paragraphs) once, possibly in parallel
+    workers, and then kept in memory or cached on disk for the following epochs.
+    Each epoch, the shards and the passages are shuffled deterministically given the seed and the epoch number, and
+    passages of similar length (in terminals) are grouped into batches: every bucket_size * batch_size passages are
+    sorted by length and divided into batches, which are then shuffled.
+    """
+    def __init__(self, files, batch_size=DEFAULT_BATCH_SIZE, shards=DEFAULT_SHARDS, seed=0, sentences=True,
+                 paragraphs=False, converters=None, lang=DEFAULT_LANG, workers=0, cache_dir=None,
+                 bucket_size=DEFAULT_BUCKET_SIZE):
+        """
+        :param files: list of passage files (and/or Passage objects) to load
+        :param batch_size: maximum number of passages in each batch
+        :param shards: number of shards to divide the files into (the unit of loading, caching and shuffling)
+        :param seed: random seed, determining the order of each epoch together with the epoch number
+        :param sentences: whether to split to sentences
+        :param paragraphs: whether to split to paragraphs
+        :param converters: dict of input format converters to use based on the file extension
+        :param lang: language to use for tokenization model
+        :param workers: number of worker processes to load shards in (0 to load in the calling thread)
+        :param cache_dir: directory to cache split shards in, so that they are reused by later runs too
+                          (default: keep them in memory)
+        :param bucket_size: number of batches to sort together by length (1 for no grouping by length)
+        """
+        self.files = list(files)
+        self.batch_size = batch_size
+        self.shards = [self.files[i::shards] for i in range(min(shards, len(self.files)))]
+        self.seed = seed
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.bucket_size = bucket_size
+        self.epoch = 0
+        self._kwargs = dict(sentences=sentences, paragraphs=paragraphs, converters=converters, lang=lang, cache=False)
+        self._loaded = {}  # shard index -> list of passages, if not using cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __iter__(self):
+        """Yields the batches of the next epoch"""
+        epoch = self.epoch
+        self.epoch += 1
+        return self.batches(epoch)
+
+    def batches(self, epoch):
+        """
+        :param epoch: epoch number
+        :return: generator of lists of Passage objects, each of at most batch_size, together covering the corpus
+        """
+        rng = random.Random("%s:%d" % (self.seed, epoch))
+        order = list(range(len(self.shards)))
+        rng.shuffle(order)
+        pool = []
+        for passages in self._load(order):
+            pool += passages
+            while len(pool) >= self.bucket_size * self.batch_size:
+                bucket, pool = pool[:self.bucket_size * self.batch_size], pool[self.bucket_size * self.batch_size:]
+                yield from self._batch(bucket, rng)
+        yield from self._batch(pool, rng)
+
+    def _batch(self, passages, rng):
+        rng.shuffle(passages)
+        passages.sort(key=lambda p: len(p.layer(layer0.LAYER_ID).all))  # Stable, so equal lengths stay shuffled
+        batches = [passages[i:i + self.batch_size] for i in range(0, len(passages), self.batch_size)]
+        rng.shuffle(batches)
+        return batches
+
+    def _load(self, order):
+        """:return iterable of passage lists for the given shards, in order"""
+        from concurrent.futures import ProcessPoolExecutor
+        args = [(i, self.shards[i], self._cache_file(i)) for i in order if i not in self._loaded]
+        if self.workers and args:
+            with ProcessPoolExecutor(self.workers) as executor:
+                futures = {i: executor.submit(_load_shard, files, cache_file, **self._kwargs)
+                           for i, files, cache_file in args}
+                for i in order:
+                    yield self._loaded[i] if i in self._loaded else self._keep(i, futures[i].result())
+        else:
+            for i in order:
+                yield self._loaded[i] if i in self._loaded else \
+                    self._keep(i, _load_shard(self.shards[i], self._cache_file(i), **self._kwargs))
+
+    def _keep(self, i, passages):
+        if self.cache_dir is None:
+            self._loaded[i] = passages
+        return passages
+
+    def _cache_file(self, i):
+        import hashlib
+        if self.cache_dir is None:
+            return None
+        key = [VERSION, self._kwargs["sentences"], self._kwargs["paragraphs"], self._kwargs["lang"]]
+        for file in self.shards[i]:
+            if isinstance(file, Passage):
+                key.append(file.ID)
+            else:
+                stat = os.stat(file)
+                key.append((os.path.abspath(file), stat.st_size, stat.st_mtime_ns))
+        return os.path.join(self.cache_dir, "shard%d-%s.pickles" % (i, hashlib.sha1(repr(key).encode()).hexdigest()))
+
+
 def get_passages_with_progress_bar(filename_patterns, desc=None, **kwargs):
+    from tqdm import tqdm
     t = tqdm(get_passages(filename_patterns, **kwargs), desc=desc, unit=" passages")
     for passage in t:
         t.set_postfix(ID=passage.ID)
@@ -133,8 +461,171 @@ def gen_files(files_and_dirs):
             yield file_or_dir
 
 
+class DirectoryWatcher:
+    """
+    Iterable of the files in the given directories: first those present, then new ones as soon as they are complete.
+    A file is complete when it is closed after writing or renamed into the directory (so writers should either write
+    directly or write to a hidden or temporary file, ending with one of TEMP_SUFFIXES, and then rename it), or, if a
+    marker suffix is given, only when a marker file with the same name plus the suffix exists.
+    Uses inotify where available (Linux), and otherwise scans the directories. Files found by scanning (including
+    those present on start, even with inotify) are yielded only once they stop changing, unless inotify and markers
+    are used. Iteration stops when no new file arrives for the idle timeout.
+    """
+    def __init__(self, files_and_dirs, idle_timeout=DEFAULT_IDLE_TIMEOUT, marker=None,
+                 poll_interval=DEFAULT_POLL_INTERVAL, inotify=True):
+        """
+        :param files_and_dirs: iterable of directories to watch, and/or files to yield first
+        :param idle_timeout: number of seconds to wait for a new file before stopping (None to watch forever)
+        :param marker: suffix of completion marker files, e.g. ".done" (default: do not wait for markers)
+        :param poll_interval: number of seconds between scans when not using inotify
+        :param inotify: whether to use inotify if available
+        """
+        files_and_dirs = [files_and_dirs] if isinstance(files_and_dirs, str) else list(files_and_dirs)
+        self.dirs = list(filter(os.path.isdir, files_and_dirs))
+        self.files = list(filterfalse(os.path.isdir, files_and_dirs))
+        self.idle_timeout = idle_timeout
+        self.marker = marker
+        self.poll_interval = poll_interval
+        self.inotify = inotify
+        self._wd_to_dir = {}
+
+    def __iter__(self):
+        return _DirectoryWatch(self)
+
+    def _list(self):
+        return [os.path.join(d, f) for d in self.dirs for f in sorted(os.listdir(d))]
+
+    def _complete(self, path, seen):
+        """:return the path of the file that path indicates, or None if it is not complete or seen before (except for
+                  whether it is still being written to without a marker, which is checked by its modification time)"""
+        if self.marker and path.endswith(self.marker):
+            path = path[:-len(self.marker)]
+        if path in seen or os.path.basename(path).startswith(".") or path.endswith(TEMP_SUFFIXES) or \
+                not os.path.isfile(path) or self.marker and not os.path.exists(path + self.marker):
+            return None
+        return path
+
+    def _inotify_init(self):
+        """:return inotify file descriptor watching all directories, or None if inotify is not available"""
+        import ctypes.util
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init()
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        self._wd_to_dir.clear()
+        for d in self.dirs:
+            wd = libc.inotify_add_watch(fd, os.fsencode(d), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                os.close(fd)
+                return None
+            self._wd_to_dir[wd] = d
+        return fd
+
+    def _read_events(self, fd, timeout=None):
+        """:return paths of files closed after writing or moved into a watched directory, or [] on timeout"""
+        if not select.select([fd], [], [], timeout)[0]:
+            return []
+        data = os.read(fd, 65536)
+        paths = []
+        i = 0
+        while i < len(data):
+            wd, _, _, length = INOTIFY_EVENT.unpack_from(data, i)
+            i += INOTIFY_EVENT.size
+            name = os.fsdecode(data[i:i + length].rstrip(b"\0"))
+            i += length
+            if name and wd in self._wd_to_dir:
+                paths.append(os.path.join(self._wd_to_dir[wd], name))
+        return paths
+
+
+class _DirectoryWatch:
+    """
+    Iterator over the files of a DirectoryWatcher, which can also be polled for files that are complete already,
+    without waiting for new ones
+    """
+    def __init__(self, watcher):
+        self.watcher = watcher
+        self._files = deque(watcher.files)
+        self._fd = watcher._inotify_init() if watcher.inotify else None
+        self._seen = set()
+        self._last = time.time()  # When the last file was found
+        self._scanned = 0  # When the directories were last scanned
+        self._unsettled = []  # Files found complete except that they were modified too recently
+        # Files found on start may still be open for writing even with inotify, so unless there are markers, wait for
+        # them to stop changing. Files found by inotify events are complete when found.
+        self._candidates = deque(self._scan())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._next(block=True)
+
+    def poll(self):
+        """
+        :return: the next complete file if there is one already, or None if there is none yet
+        :raise StopIteration: if no new file arrived for the idle timeout
+        """
+        return self._next(block=False)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        self.close()
+
+    def _next(self, block):
+        if self._files:
+            return self._files.popleft()
+        poll_interval = self.watcher.poll_interval
+        while True:
+            while self._candidates:
+                path, settle = self._candidates.popleft()
+                path = self.watcher._complete(path, self._seen)
+                if path is not None:
+                    if settle and time.time() - os.path.getmtime(path) < settle:  # May still be written to
+                        self._unsettled.append((path, settle))
+                        continue
+                    self._seen.add(path)
+                    self._last = time.time()
+                    return path
+            now = time.time()
+            if self._unsettled:  # A file is still being written, so this is not idle time
+                self._last = now
+            timeout = None if self.watcher.idle_timeout is None else self._last + self.watcher.idle_timeout - now
+            if timeout is not None and timeout <= 0:
+                self.close()
+                raise StopIteration
+            if self._fd is None:  # Scan again after the poll interval (all unsettled files will be found again)
+                wait = self._scanned + poll_interval - now
+                if wait > 0:
+                    if not block:
+                        return None
+                    time.sleep(wait if timeout is None else min(wait, timeout))
+                del self._unsettled[:]
+                self._candidates.extend(self._scan())
+            else:
+                wait = 0 if not block else poll_interval if self._unsettled else timeout
+                self._candidates.extend((path, None) for path in self.watcher._read_events(self._fd, wait))
+                self._candidates.extend(self._unsettled)
+                del self._unsettled[:]
+                if not block and not self._candidates:
+                    return None
+
+    def _scan(self):
+        self._scanned = time.time()
+        settle = None if self._fd is not None and self.watcher.marker else self.watcher.poll_interval
+        return [(path, settle) for path in self.watcher._list()]
+
+
 def read_files_and_dirs(files_and_dirs, sentences=False, paragraphs=False, converters=None, lang=DEFAULT_LANG,
-                        attempts=DEFAULT_ATTEMPTS, delay=DEFAULT_DELAY):
+                        attempts=DEFAULT_ATTEMPTS, delay=DEFAULT_DELAY, workers=0, prefetch=None, threads=False,
+                        cache=None, watch=False, idle_timeout=DEFAULT_IDLE_TIMEOUT, marker=None):
     """
     :param files_and_dirs: iterable of files and/or directories to look in
     :param sentences: whether to split to sentences
@@ -143,14 +634,26 @@ def read_files_and_dirs(files_and_dirs, sentences=False, paragraphs=False, conve
     :param lang: language to use for tokenization model
     :param attempts: number of times to try reading a file before giving up
     :param delay: number of seconds to wait before subsequent attempts to read a file
+    :param workers: number of worker processes to load files in parallel (0 to load in the calling thread)
+    :param prefetch: maximum number of files to load ahead when using workers
+    :param threads: use worker threads rather than processes
+    :param cache: PassageCache or directory to cache parsed passage files in, so that unchanged files are not parsed
+                  again in subsequent runs (default: the directory in the UCCA_PASSAGE_CACHE environment variable)
+    :param watch: keep watching the directories given for new files, yielding passages as they arrive
+                  (see DirectoryWatcher; the returned passages can then not be shuffled or indexed)
+    :param idle_timeout: when watching, number of seconds to wait for a new file before stopping (None for forever)
+    :param marker: when watching, suffix of marker files indicating each file is complete, e.g. ".done"
     :return: lazy-loaded passages from all files given, plus any files directly under any directory given
     """
-    return LazyLoadedPassages(list(gen_files(files_and_dirs)), sentences=sentences, paragraphs=paragraphs,
-                              converters=converters, lang=lang, attempts=attempts, delay=delay)
+    files = DirectoryWatcher(files_and_dirs, idle_timeout=idle_timeout, marker=marker) if watch else \
+        list(gen_files(files_and_dirs))
+    return LazyLoadedPassages(files, sentences=sentences, paragraphs=paragraphs,
+                              converters=converters, lang=lang, attempts=attempts, delay=delay, workers=workers,
+                              prefetch=prefetch, threads=threads, cache=cache)
 
 
 def write_passage(passage, output_format=None, binary=False, outdir=".", prefix="", converter=None, verbose=True,
-                  append=False, basename=None):
+                  append=False, basename=None, compression=None):
     """
     Write a given UCCA passage in any format.
     :param passage: Passage object to write
@@ -163,25 +666,130 @@ def write_passage(passage, output_format=None, binary=False, outdir=".", prefix=
     :param verbose: print "Writing passage" message
     :param append: if using converter, append to output file rather than creating a new file
     :param basename: use this instead of `passage.ID' for the output filename
+    :param compression: compress the output file ("gz", "bz2" or "xz"), adding the corresponding suffix
     :return: path of created output file
     """
     suffix = output_format if output_format and output_format != "ucca" else ("pickle" if binary else "xml")
     outfile = os.path.join(outdir, prefix + (basename or passage.ID) + "." + suffix)
+    if compression:
+        outfile += "." + compression
     if verbose:
         with external_write_mode():
             print("%s '%s'..." % ("Appending to" if append else "Writing passage", outfile))
     if output_format is None or output_format in ("ucca", "pickle", "xml"):
-        passage2file(passage, outfile, binary=binary)
+        passage2file(passage, outfile, binary=binary, compression=compression)
     else:
-        with open(outfile, "a" if append else "w", encoding="utf-8") as f:
+        with open_file(outfile, "a" if append else "w", encoding="utf-8", compression=compression) as f:
             f.writelines(map("{}\n".format, (converter or to_text)(passage)))
     return outfile
 
 
+class PassageWriter:
+    """
+    Context manager writing passages on a background thread, so that the caller can go on processing the next ones.
+    Passages are written either to a file per passage, as in write_passage, or to a fixed number of shard files, each
+    containing multiple passages as JSON lines of standard XML (".jsonl"), or as consecutive pickles (".pickles")
+    if binary=True. Shard files can be read back by read_files_and_dirs/get_passages.
+    Passages must not be modified after they are given to write().
+    Any error in writing is raised by the next call to write(), or on exit.
+    """
+    def __init__(self, outdir=".", shards=0, binary=False, prefix="", compression=None, verbose=False,
+                 queue_size=DEFAULT_QUEUE_SIZE, **kwargs):
+        """
+        :param outdir: output directory, created if it does not exist
+        :param shards: number of shard files to distribute passages between (0 to write a file per passage)
+        :param binary: write pickle format rather than XML
+        :param prefix: string to prepend to output filenames
+        :param compression: compress output files ("gz", "bz2" or "xz"), adding the corresponding suffix
+        :param verbose: print a message for each file written (for each passage, unless writing shards)
+        :param queue_size: maximum number of passages waiting to be written before write() blocks
+        :param kwargs: passed to write_passage when writing a file per passage
+        """
+        self.outdir = outdir
+        self.shards = shards
+        self.binary = binary
+        self.prefix = prefix
+        self.compression = compression
+        self.verbose = verbose
+        self.kwargs = kwargs
+        self.outfiles = []
+        self._queue = Queue(maxsize=queue_size)
+        self._thread = None
+        self._handles = []
+        self._count = 0
+        self._error = None
+
+    def __enter__(self):
+        os.makedirs(self.outdir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def write(self, passage):
+        """Adds a passage to the queue to be written (blocking if the queue is full)"""
+        self._raise_error()
+        self._queue.put((self._count, passage))
+        self._count += 1
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._queue.put(None)
+        self._thread.join()
+        if exc_type is None:
+            self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise IOError("Failed writing passages to '%s'" % self.outdir) from self._error
+
+    def _run(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                if self._error is None:  # After an error, keep consuming so that write() does not block forever
+                    try:
+                        self._write(*item)
+                    except Exception as e:
+                        self._error = e
+        finally:
+            for handle in self._handles:
+                try:
+                    handle.close()
+                except Exception as e:
+                    self._error = self._error or e
+
+    def _write(self, i, passage):
+        if not self.shards:
+            self.outfiles.append(write_passage(passage, binary=self.binary, outdir=self.outdir, prefix=self.prefix,
+                                               verbose=self.verbose, compression=self.compression, **self.kwargs))
+            return
+        if not self._handles:
+            width = len(str(self.shards - 1))
+            for shard in range(self.shards):
+                outfile = os.path.join(self.outdir, "%s%0*d.%s" % (self.prefix, width, shard,
+                                                                   "pickles" if self.binary else "jsonl"))
+                if self.compression:
+                    outfile += "." + self.compression
+                if self.verbose:
+                    with external_write_mode():
+                        print("Writing shard '%s'..." % outfile)
+                self._handles.append(open_file(outfile, "wb" if self.binary else "w",
+                                               encoding=None if self.binary else "utf-8",
+                                               compression=self.compression))
+                self.outfiles.append(outfile)
+        handle = self._handles[i % self.shards]
+        if self.binary:
+            pickle.dump(passage, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            handle.write(passage2jsonl(passage) + "\n")
+
+
 @contextmanager
 def external_write_mode(*args, **kwargs):
+    tqdm = sys.modules.get("tqdm")  # If it was never imported there are no progress bars to write around
     try:
-        with tqdm.external_write_mode(*args, **kwargs):
+        with tqdm.tqdm.external_write_mode(*args, **kwargs):
             yield
     except AttributeError:
         yield
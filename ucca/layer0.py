@@ -48,7 +48,7 @@ class Terminal(core.Node):
 
     @property
     def text(self):
-        return self.attrib['text']
+        return self._attrib['text']  # Not via attrib, which copies the dict
 
     @property
     def position(self):
@@ -57,11 +57,11 @@ class Terminal(core.Node):
 
     @property
     def para_pos(self):
-        return self.attrib['paragraph_position']
+        return self._attrib['paragraph_position']
 
     @property
     def paragraph(self):
-        return self.attrib['paragraph']
+        return self._attrib['paragraph']
 
     @property
     def tok(self):
@@ -48,6 +48,9 @@ class EdgeTags:
     __init__ = None
 
 
+# Edge tags making their parent a scene
+SCENE_EDGE_TAGS = (EdgeTags.Process, EdgeTags.State)
+
 # Attribute entries
 ATTRIB_KEYS = ('remote', 'implicit', 'uncertain', 'suggest')
 
@@ -319,18 +322,22 @@ class FoundationalNode(core.Node):
         return self.state is not None or self.process is not None
 
     def __str__(self):
+        return self._str(get_spans(self))
+
+    def _str(self, spans):
+        """Returns the string representation of self, given spans of the nodes under it (see :func:get_spans)."""
         def start(x):
-            return x.position if x.layer.ID == layer0.LAYER_ID else x.start_position
+            return spans[x.ID][0]
 
         def end(x):
-            return x.position if x.layer.ID == layer0.LAYER_ID else x.end_position
+            return spans[x.ID][1]
 
         sorted_edges = sorted(list(self), key=lambda e: start(e.child))
         output = ''
         for i, edge in enumerate(sorted_edges):
             node = edge.child
             if edge.tag == EdgeTags.Terminal:
-                space = ' ' if not end(node) == self.end_position else ''
+                space = ' ' if not end(node) == end(self) else ''
                 output += '{}{}'.format(str(node), space)
             else:
                 edge_tag = edge.tag
@@ -341,7 +348,8 @@ class FoundationalNode(core.Node):
                 if start(node) == -1:
                     output += "[{} IMPLICIT] ".format(edge_tag)
                 else:
-                    output += "[{} {}] ".format(edge_tag, str(node))
+                    output += "[{} {}] ".format(edge_tag, node._str(spans) if isinstance(node, FoundationalNode)
+                                                else str(node))
             if start(node) != -1 and not edge.attrib.get('remote') and \
                     i + 1 < len(sorted_edges) and \
                     end(node) + 1 < start(sorted_edges[i + 1].child):
@@ -396,6 +404,44 @@ class PunctNode(FoundationalNode):
     def __str__(self):
         return self.to_text()
 
+    def _str(self, spans):
+        return self.to_text()
+
+
+def get_spans(node):
+    """Finds the start and end positions of all Nodes reachable from the given one, in time linear in their number.
+
+    The positions are the same as start_position and end_position of each FoundationalNode (which take time linear
+    in the size of the Node's subtree every time they are called), not counting Terminals under remote Nodes.
+    Nodes reachable through remote Edges are included too, so they can be rendered.
+
+    :param node: Node to start from
+    :return dict of Node ID -> (start position, end position), where both are -1 for Nodes having no Terminals
+
+    """
+    spans = {}
+    visiting = set()
+    stack = [node]
+    while stack:
+        node = stack[-1]
+        if node.ID in spans:
+            stack.pop()
+        elif node.layer.ID == layer0.LAYER_ID:
+            spans[node.ID] = (node.position, node.position)
+            stack.pop()
+        else:
+            pending = [e.child for e in node if e.child.ID not in spans and e.child.ID not in visiting]
+            if pending and node.ID not in visiting:  # Visit children first
+                visiting.add(node.ID)
+                stack += pending
+            else:  # Children are done (except for those in a cycle)
+                visiting.discard(node.ID)
+                positions = [p for e in node if not e.attrib.get('remote')
+                             for p in spans.get(e.child.ID, ()) if p != -1]
+                spans[node.ID] = (min(positions), max(positions)) if positions else (-1, -1)
+                stack.pop()
+    return spans
+
 
 class Layer1(core.Layer):
     """
@@ -413,6 +459,13 @@ class Layer1(core.Layer):
         self._all = [self._head_fnode]
         self._heads = [self._head_fnode]
 
+    def _save_state(self):
+        return super()._save_state(), self._scenes.copy(), self._linkages.copy()
+
+    def _restore_state(self, state):
+        state, self._scenes, self._linkages = state
+        super()._restore_state(state)
+
     @property
     def top_scenes(self):
         return self._scenes[:]
@@ -526,25 +579,33 @@ class Layer1(core.Layer):
         if node in self._scenes and not self._check_top_scene(node):
             self._scenes.remove(node)
         elif node not in self._scenes and self._check_top_scene(node):
-            self._scenes.append(node)
-            # Other scenes may now become not top-level, check it
-            for ts in self._scenes[:-1]:
-                if not self._check_top_scene(ts):
-                    self._scenes.remove(ts)
-            self._scenes.sort(key=self.orderkey)
+            # Other scenes may now become not top-level, but only those under this one, so check them
+            descendants = [node]
+            while descendants:
+                for edge in descendants.pop():
+                    if edge.child.tag == NodeTags.Foundational and not edge.attrib.get('remote'):
+                        if edge.child in self._scenes and not self._check_top_scene(edge.child):
+                            self._scenes.remove(edge.child)
+                        descendants.append(edge.child)
+            core.add_ordered(self._scenes, node, self.orderkey)
 
     def _update_top_linkage(self, linkage):
         """Adds/removes the linkage if it's a top level linkage."""
         if all(fnode in self._scenes for fnode in linkage.arguments):
             if linkage not in self._linkages:
-                self._linkages.append(linkage)
-                self._linkages.sort(key=self.orderkey)
+                core.add_ordered(self._linkages, linkage, self.orderkey)
         elif linkage in self._linkages:
             self._linkages.remove(linkage)
 
-    def _update_edge(self, edge):
-        """Adds the Edge to the Layer, and updates top scenes and linkers."""
-        self._update_top_scene(edge.parent)
+    def _update_edge(self, edge, parent_changed=True):
+        """Adds the Edge to the Layer, and updates top scenes and linkers.
+
+        :param edge: the added/removed/changed Edge
+        :param parent_changed: whether the parent may have become/stopped being a scene, so it has to be checked
+
+        """
+        if parent_changed:
+            self._update_top_scene(edge.parent)
         self._update_top_scene(edge.child)
         for lkg in [x for x in edge.parent.parents
                     if x.tag == NodeTags.Linkage]:
@@ -555,7 +616,8 @@ class Layer1(core.Layer):
 
     def _add_edge(self, edge):
         super()._add_edge(edge)
-        self._update_edge(edge)
+        # Only a new Process or State makes the parent a scene, so otherwise avoid scanning its (possibly many) edges
+        self._update_edge(edge, parent_changed=edge.tag in SCENE_EDGE_TAGS)
 
     def _remove_edge(self, edge):
         super()._remove_edge(edge)
@@ -563,4 +625,4 @@ class Layer1(core.Layer):
 
     def _change_edge_tag(self, edge, old_tag):
         super()._change_edge_tag(edge, old_tag)
-        self._update_edge(edge)
+        self._update_edge(edge, parent_changed=edge.tag in SCENE_EDGE_TAGS or old_tag in SCENE_EDGE_TAGS)
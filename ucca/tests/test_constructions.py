@@ -1,7 +1,8 @@
 import pytest
 
-from ucca import textutil
-from ucca.constructions import extract_edges, CATEGORIES_NAME, DEFAULT, CONSTRUCTIONS
+from ucca import textutil, layer1
+from ucca.constructions import extract_edges, get_yield_masks, yield_positions, CATEGORIES_NAME, DEFAULT, \
+    CONSTRUCTIONS
 from .conftest import PASSAGES, loaded, loaded_valid, multi_sent, crossing, discontiguous, l1_passage, empty
 
 """Tests the constructions module functions and classes."""
@@ -41,3 +42,14 @@ def test_extract_all(create, expected):
 def test_extract(create, constructions, monkeypatch):
     monkeypatch.setattr(textutil, "get_nlp", assert_spacy_not_loaded)
     extract_and_check(create(), constructions=constructions)
+
+
+@pytest.mark.parametrize("create", PASSAGES)
+def test_yield_masks(create):
+    passage = create()
+    masks = get_yield_masks(passage)
+    for node in passage.layer(layer1.LAYER_ID).all:
+        for edge in node:
+            mask, mask_no_punct = masks[edge.child.ID]
+            assert yield_positions(mask) == [t.position for t in edge.child.get_terminals()]
+            assert yield_positions(mask_no_punct) == [t.position for t in edge.child.get_terminals(punct=False)]
@@ -1,7 +1,9 @@
 import xml.etree.ElementTree as ETree
 
-from ucca import layer0, layer1, convert
-from .conftest import loaded, load_xml
+import pytest
+
+from ucca import core, layer0, layer1, convert, textutil
+from .conftest import loaded, load_xml, l1_passage, discontiguous
 
 """Tests convert module correctness and API."""
 
@@ -175,6 +177,30 @@ def test_from_text():
             pos += 1
 
 
+def assert_spacy_not_loaded(*args, **kwargs):
+    del args, kwargs
+    assert False, "Should not load spaCy when text is pre-tokenized"
+
+
+@pytest.mark.parametrize("tokenized", (True, False), ids=("tokenized", "whitespace"))
+def test_from_text_pretokenized(tokenized, monkeypatch):
+    monkeypatch.setattr(textutil, "get_nlp", assert_spacy_not_loaded)
+    tokens = ["Hello", ",", "world", "...", "\u00ab", "3.5", "$", "!?"]
+    text = tokens if tokenized else [" ".join(tokens), ""]
+    passage = next(convert.from_text(text, tokenized=tokenized, whitespace=not tokenized))
+    terms = passage.layer(layer0.LAYER_ID).all
+    assert [t.text for t in terms] == tokens
+    assert [t.punct for t in terms] == [False, True, False, True, True, False, False, True]
+
+
+@pytest.mark.parametrize("batch_size, n_process", ((None, 1), (2, 1), (2, 2), (1, 3)))
+def test_from_text_batched(batch_size, n_process):
+    sample = ["a b .", "c", "", "d e", "", "", "f ! g", "h"]
+    passages = list(convert.from_text(sample, whitespace=True, batch_size=batch_size, n_process=n_process))
+    assert [[[t.text for t in p.layer(layer0.LAYER_ID).all if t.paragraph == i] for i in (1, 2)]
+            for p in passages] == [[["a", "b", "."], ["c"]], [["d", "e"], []], [["f", "!", "g"], ["h"]]]
+
+
 def test_from_text_long():
     sample = """
         After graduation, John moved to New York City.
@@ -194,6 +220,36 @@ def test_to_text():
     assert convert.to_text(passage, True) == ["1 2 3 4 .", "6 7 8 9 10 .", "12 13 14 15"]
 
 
+@pytest.mark.parametrize("create", (loaded, l1_passage, discontiguous))
+def test_to_sequence(create):
+    passage = create()
+    sequence = convert.to_sequence(passage)
+    copy = convert.from_sequence(sequence)
+    assert convert.to_sequence(copy) == sequence
+    if not any(n.discontiguous for n in passage.layer(layer1.LAYER_ID).all if n.tag == layer1.NodeTags.Foundational):
+        assert str(copy.layer(layer1.LAYER_ID).heads[0]) == str(passage.layer(layer1.LAYER_ID).heads[0])
+
+
+@pytest.mark.parametrize("text", ("[1]", "]_A", "IMPLICIT", "\\", "\\[A", "[", "]"))
+def test_to_sequence_escape(text):
+    passage = core.Passage("1")
+    l0 = layer0.Layer0(passage)
+    l1 = layer1.Layer1(passage)
+    for tag in layer1.EdgeTags.Participant, layer1.EdgeTags.Process:
+        l1.add_fnode(None, tag).add(layer1.EdgeTags.Terminal, l0.add_terminal(text=text, punct=False))
+    sequence = convert.to_sequence(passage)
+    copy = convert.from_sequence(sequence)
+    assert [t.text for t in copy.layer(layer0.LAYER_ID).all] == [text, text]
+    assert str(copy.layer(layer1.LAYER_ID).heads[0]) == str(passage.layer(layer1.LAYER_ID).heads[0])
+    assert convert.to_sequence(copy) == sequence
+
+
+@pytest.mark.parametrize("sequence", ("[H [A John ]_A", "[H [A John ]_P ]_H", "[H [A* 1.7 ]_A* ]_H"))
+def test_from_sequence_invalid(sequence):
+    with pytest.raises(ValueError):
+        convert.from_sequence(sequence)
+
+
 def test_to_site():
     passage = loaded()
     root = convert.to_site(passage)
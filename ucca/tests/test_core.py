@@ -163,6 +163,27 @@ def test_copying(create):
     assert (p1.layer(l0id).equals(p2.layer(l0id)))
 
 
+@pytest.mark.parametrize("create", PASSAGES)
+def test_revert_changes(create):
+    p = create()
+    p.frozen = True
+    l1 = p.layer(layer1.LAYER_ID)
+    with p.revert_changes():
+        for node in l1.all[1:]:
+            if node.attrib.get("implicit") is not None:
+                node.attrib["implicit"] = False
+            for edge in node:
+                edge.tag = layer1.EdgeTags.Elaborator
+            node.destroy()
+        l1.add_fnode(None, layer1.EdgeTags.ParallelScene)
+        assert not p.frozen
+    assert p.frozen
+    original = create()
+    assert p.equals(original, ordered=True)
+    for attr in "heads", "top_scenes", "top_linkages":
+        assert [n.ID for n in getattr(l1, attr)] == [n.ID for n in getattr(original.layer(layer1.LAYER_ID), attr)]
+
+
 def test_iteration():
     p = basic()
     l1, l2 = p.layer("1"), p.layer("2")
@@ -1,9 +1,13 @@
+import json
+import pickle
 from itertools import repeat
 
 import pytest
 
 from ucca import core, layer0, layer1
-from ucca.evaluation import evaluate, LABELED, UNLABELED, WEAK_LABELED
+from ucca.ioutil import passage2file, read_files_and_dirs
+from ucca.evaluation import evaluate, evaluate_corpus, Scores, ScoreAccumulator, ScoreArrays, ReferenceIndex, \
+    EVAL_TYPES, LABELED, UNLABELED, WEAK_LABELED, f1_scores, bootstrap, paired_bootstrap, approximate_randomization
 from .conftest import PASSAGES
 
 PRIMARY = "primary"
@@ -171,3 +175,110 @@ def test_evaluate_self(create, units, errors, normalize):
 def test_evaluate(create1, create2, f1, units, errors):
     scores = evaluate(create1(), create2(), units=units, errors=errors)
     check_primary_remote(scores, f1)
+
+
+@pytest.mark.parametrize("workers", (0, 2))
+@pytest.mark.parametrize("constructions", (None, ("categories",)), ids=("default", "categories"))
+def test_evaluate_corpus(workers, constructions):
+    creates = [(passage1, passage2), (passage2, passage1), (passage1, passage1)] + [(c, c) for c in PASSAGES]
+    kwargs = dict(errors=True) if constructions is None else dict(errors=True, constructions=constructions)
+    expected = [evaluate(create1(), create2(), **kwargs) for create1, create2 in creates]
+    actual = list(evaluate_corpus(((create1(), create2()) for create1, create2 in creates), workers=workers,
+                                  **kwargs))
+    assert [s.counts() for s in actual] == [s.counts() for s in expected]
+    assert [s.fields() for s in actual] == [s.fields() for s in expected]
+    assert Scores.from_counts(Scores.aggregate(actual).counts()).fields() == Scores.aggregate(expected).fields()
+
+
+@pytest.mark.parametrize("create1, create2", [(passage1, passage2), (passage2, passage1)] + [(c, c) for c in PASSAGES])
+def test_evaluate_not_inplace(create1, create2):
+    guessed, ref = create1(), create2()
+    scores = evaluate(guessed, ref, errors=True, inplace=False)
+    assert guessed.equals(create1(), ordered=True)
+    assert ref.equals(create2(), ordered=True)
+    expected = evaluate(create1(), create2(), errors=True)
+    assert scores.counts() == expected.counts()
+    assert evaluate(guessed, ref, errors=True, inplace=False).counts() == expected.counts()
+
+
+@pytest.mark.parametrize("constructions", (None, ("categories", "mwe")), ids=("default", "categories"))
+def test_reference_index(tmpdir, constructions):
+    creates = [(passage1, passage2), (passage2, passage1), (passage1, passage1)] + [(c, c) for c in PASSAGES]
+    kwargs = dict(errors=True) if constructions is None else dict(errors=True, constructions=constructions)
+    refs = [create2() for _, create2 in creates]
+    index = ReferenceIndex(refs, ref_yield_tags=[create1() for create1, _ in creates],
+                           **({} if constructions is None else dict(constructions=constructions)))
+    assert all(ref.equals(create2(), ordered=True) for ref, (_, create2) in zip(refs, creates))
+    filename = str(tmpdir.join("index.pickle"))
+    index.save(filename)
+    index = ReferenceIndex.load(filename)
+    assert len(index) == len(creates)
+    for reference, (create1, create2) in zip(index, creates):
+        expected = evaluate(create1(), create2(), ref_yield_tags=create1(), **kwargs)
+        assert evaluate(create1(), reference, **kwargs).counts() == expected.counts()
+    with pytest.raises(ValueError):
+        evaluate(passage1(), index.references[0], constructions=("light_verbs",))
+    with pytest.raises(ValueError):
+        evaluate(passage1(), index.references[0], normalize=False)
+
+
+def test_reference_index_mismatch(tmpdir):
+    refs = tmpdir.mkdir("refs")
+    for i, create in enumerate(PASSAGES):
+        passage2file(create(), str(refs.join("%d.xml" % i)))
+    sources = (str(refs), None)
+    filename = str(tmpdir.join("index.pickle"))
+    ReferenceIndex(read_files_and_dirs(str(refs)), sources=sources).save(filename)
+    index = ReferenceIndex.load(filename)
+    assert len(index) == len(PASSAGES)
+    assert index.mismatch(sources=sources) is None
+    assert index.mismatch() is None, "Sources should only be checked when given"
+    assert "constructions" in index.mismatch(constructions=("categories",), sources=sources)
+    assert "normalize" in index.mismatch(normalize=False, sources=sources)
+    assert "ref_yield_tags" in index.mismatch(ref_yield_tags=True, sources=(str(refs), str(refs)))
+    added = refs.join("new.xml")
+    passage2file(passage1(), str(added))
+    assert str(added) in index.mismatch(sources=sources)
+    added.remove()
+    modified = refs.listdir()[0]
+    modified.write("\n", mode="a")
+    assert str(modified) in index.mismatch(sources=sources)
+
+
+def test_score_accumulator():
+    creates = [(passage1, passage2), (passage2, passage1), (passage1, passage1)] + [(c, c) for c in PASSAGES]
+    scores = [evaluate(create1(), create2(), errors=True, constructions=("categories",))
+              for create1, create2 in creates]
+    shards = [ScoreAccumulator(), ScoreAccumulator()]
+    for i, s in enumerate(scores):
+        shards[i % 2].add(s)
+    shards[1] = ScoreAccumulator.from_counts(json.loads(json.dumps(shards[1].counts())))
+    accumulator = pickle.loads(pickle.dumps(shards[0]))
+    accumulator.merge(shards[1])
+    assert accumulator.num_scores == len(scores)
+    expected, actual = Scores.aggregate(scores), accumulator.scores()
+    for eval_type in EVAL_TYPES:
+        assert actual.titles(eval_type) == expected.titles(eval_type)
+        assert actual.fields(eval_type) == expected.fields(eval_type)
+        assert actual[eval_type][PRIMARY].errors == expected[eval_type][PRIMARY].errors
+
+
+def test_significance():
+    creates = [(passage1, passage2), (passage2, passage1), (passage1, passage1)] + [(c, c) for c in PASSAGES]
+    arrays = [ScoreArrays(), ScoreArrays()]
+    for create1, create2 in creates:
+        arrays[0].add(evaluate(create1(), create2()))
+        arrays[1].add(evaluate(create2(), create2()))  # Perfect
+    counts = [a.array() for a in arrays]
+    assert counts[0].shape == (len(creates), 3)
+    scores = Scores.aggregate(evaluate(create1(), create2()) for create1, create2 in creates)
+    assert f1_scores(counts[0].sum(axis=0)) == pytest.approx(scores.average_f1())
+    assert f1_scores(arrays[0].array(UNLABELED, PRIMARY).sum(axis=0)) == pytest.approx(scores[UNLABELED][PRIMARY].f1)
+    f1, low, high = bootstrap(counts[0], num_samples=200)
+    assert low <= f1 <= high
+    assert bootstrap(counts[1], num_samples=200) == (1.0, 1.0, 1.0)
+    diff, low, high, p_value = paired_bootstrap(counts[0], counts[1], num_samples=200)
+    assert low <= diff < 0 and high <= 0
+    assert 0 <= p_value < 0.5
+    assert 0 < approximate_randomization(counts[0], counts[1], num_samples=200) <= 1
+    assert approximate_randomization(counts[0], counts[0], num_samples=200) == 1
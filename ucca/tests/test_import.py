@@ -0,0 +1,68 @@
+"""Tests that importing the package is fast, by not importing heavy dependencies until they are used."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ("numpy", "tqdm", "spacy", "requests", "matplotlib", "networkx")
+BASELINE_MODULES = ("argparse", "json", "pickle", "xml.etree.ElementTree")  # Standard library modules the package uses
+IMPORT_TIME_FACTOR = 3  # Maximum import time relative to that of BASELINE_MODULES, so it does not depend on the machine
+IMPORT_TIME_RUNS = 3  # Number of times to measure import time, taking the minimum to reduce noise
+
+
+def _run(code, *options):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), os.environ.get("PYTHONPATH")))))
+    env.pop("PYTHONDONTWRITEBYTECODE", None)  # So that modules are not compiled again whenever they are measured
+    return subprocess.run([sys.executable] + list(options) + ["-c", code], env=env, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def _imported_modules(module):
+    """:return names of all modules imported by importing the given module in a new interpreter"""
+    return _run("import sys, %s; print(*sys.modules)" % module).stdout.decode().split()
+
+
+def _import_time(modules, prefixes):
+    """
+    :param modules: names of modules to import in a new interpreter
+    :param prefixes: names of the modules to measure, including any submodules they import directly
+    :return: minimum over IMPORT_TIME_RUNS of the total cumulative import time of the modules, in microseconds,
+             as reported by `python -X importtime'
+    """
+    code = "import " + ", ".join(modules)
+    _run(code)  # Write bytecode, if possible
+    times = []
+    for _ in range(IMPORT_TIME_RUNS):
+        total = 0
+        for line in _run(code, "-X", "importtime").stderr.decode().splitlines():
+            _, cumulative, name = line.split("|")
+            if not cumulative.strip().isdigit() or name.startswith("  "):  # Header, or included in its importer
+                continue
+            name = name.strip()
+            if any(name == prefix or name.startswith(prefix + ".") for prefix in prefixes):
+                total += int(cumulative)
+        times.append(total)
+    return min(times)
+
+
+@pytest.mark.parametrize("module", ("ucca.core", "ucca.convert", "ucca.ioutil"))
+def test_import_lazily(module):
+    heavy = [name for name in _imported_modules(module) if name.split(".")[0] in HEAVY_MODULES]
+    assert not heavy, "Importing %s should not import %s" % (module, ", ".join(heavy))
+
+
+@pytest.mark.parametrize("module", ("ucca.core", "ucca.convert", "ucca.ioutil"))
+def test_import_time(module):
+    baseline = _import_time(BASELINE_MODULES, BASELINE_MODULES)
+    import_time = _import_time([module], ["ucca"])
+    assert import_time <= IMPORT_TIME_FACTOR * baseline, \
+        "Importing %s took %.3fs, more than %d times the %.3fs to import %s" % (
+            module, import_time / 1e6, IMPORT_TIME_FACTOR, baseline / 1e6, ", ".join(BASELINE_MODULES))
+
+
+def test_git_version_lazily():
+    assert "subprocess" not in _imported_modules("ucca.__version__"), "git should only be run on access"
+    from ucca.__version__ import GIT_VERSION, VERSION
+    assert GIT_VERSION and VERSION
@@ -1,6 +1,9 @@
 import os
 import pytest
 import random
+import threading
+import time
+from functools import partial
 from glob import glob
 
 from ucca import layer0, layer1, convert, ioutil, diffutil
@@ -88,3 +91,243 @@ def test_shuffle_passages():
     random.shuffle(passages)
     assert len(files) == len(passages)
     _test_passages(passages)
+
+
+@pytest.mark.parametrize("create", (loaded, multi_sent, discontiguous, l1_passage))
+def test_join_passages_incrementally(create):
+    p = create()
+    split = convert.split2sentences(p, remarks=True)
+    joiner = convert.PassageJoiner(remarks=True)
+    for sentence in split:
+        joiner.add(sentence)
+    diffutil.diff_passages(p, joiner.passage)
+    assert p.equals(joiner.passage)
+    assert p.equals(convert.join_passages(s for s in split))
+
+
+@pytest.mark.parametrize("binary", (False, True))
+def test_detect_format(tmpdir, binary):
+    p = loaded()
+    filename = str(tmpdir.join("passage"))  # No extension, so the format is detected by the file contents
+    convert.passage2file(p, filename, binary=binary)
+    # A pickle might be followed by more, so it is read as consecutive pickles
+    assert convert.detect_format(filename).name == ("pickles" if binary else "xml")
+    assert p.equals(convert.file2passage(filename))
+    text_file = str(tmpdir.join("passage.txt"))
+    with open(text_file, "w") as f:
+        f.write("{1 2 3}\n")
+    assert convert.detect_format(text_file) is None
+    passages = list(ioutil.read_files_and_dirs(str(tmpdir), converters={"txt": partial(convert.from_text,
+                                                                                        whitespace=True)}))
+    assert len(passages) == 2
+    assert ["{1", "2", "3}"] in [[t.text for t in passage.layer(layer0.LAYER_ID).all] for passage in passages]
+
+
+@pytest.mark.parametrize("binary", (False, True), ids=("jsonl", "pickles"))
+def test_detect_multiple_format(tmpdir, binary):
+    passages = [loaded(), multi_sent()]
+    with ioutil.PassageWriter(str(tmpdir.join("out")), shards=1, binary=binary) as writer:
+        for passage in passages:
+            writer.write(passage)
+    shard, = tmpdir.join("out").listdir()
+    filename = str(tmpdir.join("shard"))  # No extension, so the format is detected by the file contents
+    shard.move(tmpdir.join("shard"))
+    assert convert.detect_format(filename).name == ("pickles" if binary else "jsonl")
+    read = list(ioutil.read_files_and_dirs(filename))
+    assert [r.ID for r in read] == [p.ID for p in passages]
+    assert all(p.equals(r) for p, r in zip(passages, read))
+    with pytest.raises(IOError):
+        convert.file2passage(filename)
+
+
+@pytest.mark.parametrize("compression", ("gz", "bz2", "xz"))
+@pytest.mark.parametrize("binary", (False, True))
+def test_compressed_passage(tmpdir, compression, binary):
+    p = loaded()
+    filename = ioutil.write_passage(p, binary=binary, outdir=str(tmpdir), verbose=False, compression=compression)
+    assert filename.endswith(("pickle." if binary else "xml.") + compression)
+    assert convert.detect_compression(filename) == compression
+    assert p.equals(convert.file2passage(filename))
+    os.rename(filename, str(tmpdir.join("passage")))  # Detect both compression and format by the file contents
+    passages = list(ioutil.read_files_and_dirs(str(tmpdir)))
+    assert len(passages) == 1
+    assert p.equals(passages[0])
+
+
+@pytest.mark.parametrize("text", ("BZh", "BZh9 1 2 3"))
+def test_text_like_compression_magic(tmpdir, text):
+    filename = str(tmpdir.join("text.txt"))
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(text + "\n")
+    assert convert.detect_compression(filename) is None
+    with convert.open_file(filename, encoding="utf-8") as f:
+        assert f.read() == text + "\n"
+
+
+@pytest.mark.parametrize("threads", (False, True))
+@pytest.mark.parametrize("workers", (1, 3))
+def test_load_passages_in_workers(workers, threads):
+    files = [multi_sent(), "test_files/standard3.xml", loaded(), "test_files/standard3.xml"]
+    expected = list(ioutil.LazyLoadedPassages(files, paragraphs=True))
+    passages = ioutil.LazyLoadedPassages(files, paragraphs=True, workers=workers, prefetch=2, threads=threads)
+    for _ in range(2):  # Can be iterated more than once
+        actual = list(passages)
+        assert [p.ID for p in actual] == [p.ID for p in expected]
+        assert all(p.equals(q) for p, q in zip(actual, expected))
+
+
+def test_load_passages_in_workers_close():
+    passages = ioutil.LazyLoadedPassages(["test_files/standard3.xml"] * 3, workers=2)
+    iterator = iter(passages)
+    assert passages._executor is None, "Workers should only be started when there is something to load"
+    assert next(iterator).ID
+    assert passages._executor is not None
+    passages.close()  # Abandon iteration
+    assert passages._executor is None
+    assert len(list(passages)) == 3
+    assert passages._executor is None
+    assert not list(ioutil.LazyLoadedPassages([], workers=2))
+
+
+def test_load_passages_in_workers_error(tmpdir):
+    bad_file = str(tmpdir.join("bad.xml"))
+    with open(bad_file, "w") as f:
+        f.write("<root>")
+    passages = iter(ioutil.read_files_and_dirs(["test_files/standard3.xml", bad_file, "test_files/standard3.xml"],
+                                               workers=2))
+    assert next(passages).ID
+    with pytest.raises(IOError, match="bad.xml"):
+        next(passages)
+    assert next(passages).ID  # Errors are per file
+
+
+def test_passage_cache(tmpdir, monkeypatch):
+    filename = ioutil.write_passage(loaded(), outdir=str(tmpdir), verbose=False)
+    cache_dir = str(tmpdir.join("cache"))
+    monkeypatch.setenv(ioutil.CACHE_ENV_VAR, cache_dir)
+    expected = list(ioutil.read_files_and_dirs(filename))
+    assert len(os.listdir(cache_dir)) == 1
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("Cached file should not be parsed again")
+    monkeypatch.setattr(ioutil, "file2passage", _fail)
+    actual = list(ioutil.read_files_and_dirs(filename))
+    assert all(p.equals(q) for p, q in zip(actual, expected))
+    monkeypatch.undo()
+    os.utime(filename, ns=(0, 0))  # Modified, so the entry is stale
+    list(ioutil.read_files_and_dirs(filename, cache=cache_dir))
+    assert len(os.listdir(cache_dir)) == 2
+    cache = ioutil.PassageCache(cache_dir, max_size=os.path.getsize(os.path.join(cache_dir, os.listdir(cache_dir)[0])))
+    cache.evict()
+    assert len(os.listdir(cache_dir)) < 2, "Should have evicted entries exceeding the maximum size"
+
+
+@pytest.mark.parametrize("inotify", (True, False))
+@pytest.mark.parametrize("marker", (None, ".done"))
+def test_watch_directory(tmpdir, inotify, marker):
+    passage = loaded()
+    ioutil.write_passage(passage, outdir=str(tmpdir), basename="0", verbose=False)
+    if marker:
+        open(str(tmpdir.join("0.xml" + marker)), "w").close()
+
+    def _write():
+        for i in range(1, 3):
+            time.sleep(.2)
+            filename = str(tmpdir.join("%d.xml" % i))
+            convert.passage2file(passage, filename + ".tmp")
+            os.rename(filename + ".tmp", filename)  # Atomic rename convention
+            if marker:
+                open(filename + marker, "w").close()
+    thread = threading.Thread(target=_write)
+    thread.start()
+    watcher = ioutil.DirectoryWatcher(str(tmpdir), idle_timeout=1.5, marker=marker, poll_interval=.1, inotify=inotify)
+    files = list(watcher)
+    thread.join()
+    assert [os.path.basename(f) for f in files] == ["0.xml", "1.xml", "2.xml"]
+    assert len(list(ioutil.read_files_and_dirs(str(tmpdir), watch=True, idle_timeout=.1, marker=marker))) == 3
+
+
+@pytest.mark.parametrize("inotify", (True, False))
+def test_watch_directory_file_being_written(tmpdir, inotify):
+    filename = str(tmpdir.join("0.txt"))
+    closed = []
+
+    def _write():
+        with open(filename, "w") as f:
+            for i in range(5):
+                print(i, file=f, flush=True)
+                time.sleep(.1)
+        closed.append(time.time())
+    with open(filename, "w"):  # Exists on start, but is still being written
+        pass
+    thread = threading.Thread(target=_write)
+    thread.start()
+    files = []
+    for file in ioutil.DirectoryWatcher(str(tmpdir), idle_timeout=.5, poll_interval=.2, inotify=inotify):
+        files.append((file, time.time()))
+    thread.join()
+    assert [f for f, _ in files] == [filename]
+    assert files[0][1] >= closed[0]
+
+
+def test_watch_directory_in_workers(tmpdir):
+    ioutil.write_passage(loaded(), outdir=str(tmpdir), basename="0", verbose=False)
+    os.utime(str(tmpdir.join("0.xml")), (0, 0))  # Not being written anymore
+    written = []
+
+    def _write():
+        for i, delay in ((1, .2), (2, 1.5)):
+            time.sleep(delay)
+            filename = str(tmpdir.join("%d.xml" % i))
+            convert.passage2file(loaded(), filename + ".tmp")
+            os.rename(filename + ".tmp", filename)
+            written.append(time.time())
+    thread = threading.Thread(target=_write)
+    thread.start()
+    times = [time.time() for _ in ioutil.read_files_and_dirs(str(tmpdir), watch=True, idle_timeout=2, workers=2,
+                                                              threads=True)]
+    thread.join()
+    assert len(times) == 3
+    assert times[1] < written[1], "Complete files should be returned without waiting for more files to arrive"
+
+
+@pytest.mark.parametrize("compression", (None, "gz"))
+@pytest.mark.parametrize("binary", (False, True))
+@pytest.mark.parametrize("shards", (0, 1, 3))
+def test_passage_writer(tmpdir, shards, binary, compression):
+    passages = convert.split2sentences(multi_sent()) + [loaded(), l1_passage()]
+    for i, passage in enumerate(passages):
+        passage._ID = str(i)
+    with ioutil.PassageWriter(outdir=str(tmpdir), shards=shards, binary=binary, compression=compression,
+                              queue_size=2) as writer:
+        for passage in passages:
+            writer.write(passage)
+    assert len(writer.outfiles) == (shards or len(passages))
+    assert sorted(writer.outfiles) == sorted(map(str, tmpdir.listdir()))
+    copies = sorted(ioutil.read_files_and_dirs(str(tmpdir)), key=lambda p: int(p.ID))
+    assert [p.ID for p in copies] == [p.ID for p in passages]
+    assert all(p.equals(q) for p, q in zip(passages, copies))
+
+
+def test_passage_writer_error(tmpdir):
+    with pytest.raises(IOError):
+        with ioutil.PassageWriter(outdir=str(tmpdir), output_format="txt", converter=None) as writer:
+            for passage in 3 * [loaded()]:
+                writer.write(passage)
+            writer.write("not a passage")
+
+
+@pytest.mark.parametrize("workers", (0, 2))
+def test_epoch_loader(tmpdir, workers):
+    files = [multi_sent(), loaded(), l1_passage(), discontiguous(), "test_files/standard3.xml"]
+    expected = sorted(p.ID for p in ioutil.LazyLoadedPassages(files, sentences=True))
+    loader = ioutil.EpochLoader(files, batch_size=3, shards=3, seed=1, workers=workers, cache_dir=str(tmpdir),
+                                bucket_size=2)
+    epochs = [[[p.ID for p in batch] for batch in loader] for _ in range(3)]
+    for batches in epochs:
+        assert all(0 < len(batch) <= 3 for batch in batches)
+        assert sorted(i for batch in batches for i in batch) == expected
+    assert epochs[0] != epochs[1] or epochs[1] != epochs[2], "Should shuffle differently in each epoch"
+    assert len(tmpdir.listdir()) == 3
+    loader = ioutil.EpochLoader(files, batch_size=3, shards=3, seed=1, bucket_size=2)  # Same order without cache
+    assert [[p.ID for p in batch] for batch in loader.batches(1)] == epochs[1]
@@ -1,3 +1,6 @@
+from itertools import count, islice
+
+import numpy as np
 import pytest
 
 from ucca import layer0, convert, textutil
@@ -18,12 +21,41 @@ def test_break2sentences(create, breaks):
     assert textutil.break2sentences(create()) == breaks
 
 
+def test_break2sentences_all():
+    passages = [create() for create in (multi_sent, crossing, discontiguous, l1_passage, empty)]
+    assert list(textutil.break2sentences_all(passages, batch_size=2)) == \
+        [textutil.break2sentences(p) for p in passages]
+    split = list(convert.split2segments_all(passages, is_sentences=True, batch_size=2))
+    assert [p.ID for p in split] == [s.ID for p in passages for s in convert.split2sentences(p)]
+
+
 def test_word_vectors():
     vectors, dim = textutil.get_word_vectors()
     for word, vector in vectors.items():
         assert len(vector) == dim, "Vector dimension for %s is %d != %d" % (word, len(vector), dim)
 
 
+@pytest.mark.parametrize("header", (True, False))
+def test_binary_word_vectors(tmpdir, header):
+    filename = str(tmpdir.join("vectors.txt"))
+    words = ["1", "2", "3", ".", "2"]  # Repeated word keeps its first vector
+    with open(filename, "w", encoding="utf-8") as f:
+        if header:
+            f.write("%d 3\n" % len(words))
+        for i, word in enumerate(words):
+            f.write(" ".join([word] + [str(i + j) for j in range(3)]) + "\n")
+    vectors = textutil.WordVectors.load(filename, dim=2)
+    assert len(vectors) == len(words) and vectors.dim == 2
+    assert list(vectors.words()) == words
+    assert "3" in vectors and "4" not in vectors
+    assert vectors["2"].tolist() == [2, 3]
+    matrix = vectors.lookup_passage(multi_sent())
+    assert matrix.shape == (len(multi_sent().layer(layer0.LAYER_ID).all), 2)
+    assert matrix[:4].tolist() == [[1, 2], [2, 3], [3, 4], [4, 5]]
+    assert not matrix[4].any(), "Unknown word should get a zero vector"
+    assert textutil.WordVectors.load(filename, dim=2).prefix == vectors.prefix
+
+
 @pytest.mark.parametrize("create", PASSAGES)
 @pytest.mark.parametrize("as_array", (True, False), ids=("array", "extra"))
 def test_annotate_passage(create, as_array):
@@ -93,3 +125,126 @@ def test_preannotate_passage(create, as_array, convert_and_back, partial, monkey
             if value:
                 assert (terminal.tok[i] if as_array else terminal.extra.get(attr.key)) == value, \
                     "Terminal %s has wrong %s" % (terminal, attr.name)
+
+
+@pytest.mark.parametrize("as_array", (True, False), ids=("array", "extra"))
+def test_annotate_all_multiprocess(as_array):
+    passages = [create() for create in PASSAGES]
+    expected = [create() for create in PASSAGES]
+    list(textutil.annotate_all(expected, as_array=as_array))
+    annotated = list(textutil.annotate_all(passages, as_array=as_array, n_process=2, batch_size=2))
+    assert [p.ID for p in annotated] == [p.ID for p in expected]
+    for passage, compare in zip(annotated, expected):
+        assert textutil.is_annotated(passage, as_array=as_array), "Passage %s is not annotated" % passage.ID
+        for terminal, other in zip(passage.layer(layer0.LAYER_ID).all, compare.layer(layer0.LAYER_ID).all):
+            assert (terminal.tok == other.tok) if as_array else (terminal.extra == other.extra)
+
+
+def test_annotation_cache(tmpdir):
+    cache = textutil.AnnotationCache(str(tmpdir), memory_size=1)
+    arrays = [np.arange(i * len(textutil.Attr), dtype="uint64").reshape(i, len(textutil.Attr)) for i in range(1, 4)]
+    for i, arr in enumerate(arrays):
+        cache.put(str(i), arr, ["word%d" % i])
+    assert len(cache.memory) == 1
+    for i, arr in enumerate(arrays):
+        cached_arr, strings = cache.get(str(i))
+        assert (cached_arr == arr).all()
+        assert strings == ["word%d" % i]
+    assert cache.get("missing") is None
+    cache.evict(target_size=0)
+    assert not tmpdir.listdir()
+
+
+@pytest.mark.parametrize("as_array", (True, False), ids=("array", "extra"))
+def test_annotate_cached(tmpdir, as_array, monkeypatch):
+    passages = [create() for create in PASSAGES]
+    list(textutil.annotate_all(passages, as_array=as_array, cache=str(tmpdir)))
+    assert tmpdir.listdir()
+    monkeypatch.setattr(textutil, "get_nlp", assert_spacy_not_loaded)
+    for passage in textutil.annotate_all([create() for create in PASSAGES], as_array=as_array, cache=str(tmpdir)):
+        assert textutil.is_annotated(passage, as_array=as_array), "Passage %s is not annotated" % passage.ID
+
+
+def test_annotate_cached_streaming(monkeypatch):
+    class Cache:
+        def __init__(self):
+            self.read = []
+
+        def key(self, tokens, *args):
+            del args
+            self.read.append(tokens)
+            return tokens
+
+        @staticmethod
+        def get(key):
+            return key, []
+
+    monkeypatch.setattr(textutil, "get_nlp", assert_spacy_not_loaded)
+    cache = Cache()
+    stream = ((str(i), i) for i in count())  # Endless
+    annotated = textutil._annotate_with_cache(stream, "en", batch_size=3, n_process=1, cache=cache)
+    assert next(annotated) == (("0", []), 0)
+    assert next(annotated) == (("1", []), 1)
+    assert cache.read == ["0", "1"], "Cached annotations should be returned without reading ahead"
+    monkeypatch.setattr(cache, "get", lambda key: None if int(key) % 2 else (key, []))
+    monkeypatch.setattr(cache, "put", lambda *args: None, raising=False)
+    monkeypatch.setattr(textutil, "annotate_batch", lambda token_lists, *args: [(t, ["new"]) for t in token_lists])
+    assert list(islice(annotated, 5)) == [(("2", []), 2), (("3", ["new"]), 3), (("4", []), 4), (("5", ["new"]), 5),
+                                          (("6", []), 6)]
+
+
+def test_attr_components():
+    assert textutil.get_components(()) == set()
+    assert textutil.get_components([textutil.Attr.ORTH, textutil.Attr.SHAPE]) == set()
+    assert textutil.get_components([textutil.Attr.POS, textutil.Attr.LEMMA]) == {"tagger"}
+    assert textutil.get_components(textutil.SENTENCE_ATTRS) == {"parser"}
+    assert textutil.get_components() == set(textutil.COMPONENTS)
+
+
+@pytest.mark.parametrize("as_array", (True, False), ids=("array", "extra"))
+def test_annotate_attrs(as_array):
+    attrs = (textutil.Attr.ORTH, textutil.Attr.POS)
+    for passage in textutil.annotate_all([create() for create in PASSAGES], as_array=as_array, attrs=attrs):
+        assert textutil.is_annotated(passage, as_array=as_array, attrs=attrs), \
+            "Passage %s is not annotated" % passage.ID
+        assert not textutil.is_annotated(passage, as_array=as_array, attrs=[textutil.Attr.DEP])
+
+
+def test_add_components(monkeypatch):
+    import spacy
+    monkeypatch.setattr(textutil, "nlp", textutil.OrderedDict())
+    monkeypatch.setattr(textutil, "tokenizer", {})
+    monkeypatch.setattr(textutil, "loaded_components", {})
+    loaded = []
+    load = spacy.load
+    monkeypatch.setattr(spacy, "load", lambda *args, **kwargs: loaded.append(args) or load(*args, **kwargs))
+    textutil.get_tokenizer()
+    assert not textutil.nlp["en"].pipe_names
+    instance = textutil.get_nlp(attrs=textutil.SENTENCE_ATTRS)
+    assert instance.pipe_names == ["parser"]
+    assert textutil.get_nlp() is instance
+    assert set(instance.pipe_names) == set(textutil.COMPONENTS)
+    assert len(loaded) == 1, "Model should only be loaded once"
+
+
+def test_evict_models(monkeypatch):
+    monkeypatch.setattr(textutil, "nlp", textutil.OrderedDict())
+    monkeypatch.setattr(textutil, "tokenizer", {})
+    for lang in "en", "fr", "de":
+        textutil.nlp[lang] = textutil.tokenizer[lang] = lang
+    textutil.nlp.move_to_end("en")
+    textutil.evict_models(2)
+    assert list(textutil.nlp) == ["de", "en"]
+    assert sorted(textutil.tokenizer) == ["de", "en"]
+
+
+def test_reorder_by():
+    items = ["en1", "fr1", "en2", "de1", "fr2", "en3", "de2"]
+    processed = []
+
+    def _process(group):
+        for item in group:
+            processed.append(item)
+            yield item.upper()
+    assert list(textutil.reorder_by(items, lambda x: x[:2], _process, window=5)) == [x.upper() for x in items]
+    assert processed == ["de1", "en1", "en2", "fr1", "fr2", "de2", "en3"]
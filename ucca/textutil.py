@@ -1,24 +1,30 @@
 """Utility functions for UCCA package."""
+import gc
+import json
 import sys
 import time
-from collections import OrderedDict
+import unicodedata
+from collections import OrderedDict, namedtuple
 from collections import deque
-from itertools import groupby, islice
+from itertools import groupby, islice, tee
 
-import numpy as np
 import os
-from contextlib import contextmanager
+from contextlib import contextmanager, ExitStack
 from enum import Enum
 from operator import attrgetter, itemgetter
-from tqdm import tqdm
 
 from ucca import layer0, layer1
 
 MODEL_ENV_VAR = "SPACY_MODEL"  # Determines the default spaCy model to load
+MAX_MODELS_ENV_VAR = "UCCA_MAX_SPACY_MODELS"  # Determines the maximum number of spaCy models kept loaded
+DEFAULT_MAX_MODELS = 3
 DEFAULT_MODEL = {"en": "en_core_web_md", "fr": "fr_core_news_md", "de": "de_core_news_sm"}
 
 N_THREADS = 4
 BATCH_SIZE = 50
+ANNOTATION_CACHE_ENV_VAR = "UCCA_ANNOTATION_CACHE"  # Directory to cache annotations in, if not given explicitly
+DEFAULT_ANNOTATION_CACHE_SIZE = 2 ** 30  # Maximum total size of annotation cache files, in bytes
+DEFAULT_MEMORY_CACHE_SIZE = 10000  # Maximum number of paragraph annotations to keep in memory
 
 
 class Attr(Enum):
@@ -40,6 +46,7 @@ class Attr(Enum):
         if value is None:
             return None
         if self in (Attr.ENT_IOB, Attr.HEAD):
+            import numpy as np
             return int(np.int64(value))
         if as_array:
             is_str = isinstance(value, str)
@@ -62,47 +69,240 @@ class Attr(Enum):
         return self.name.lower()
 
 
-def get_nlp(lang="en"):
-    """Load spaCy model for a given language, determined by `models' dict or by MODEL_ENV_VAR"""
+ATTR_COMPONENTS = {  # spaCy pipeline component required for each Attr (the rest just need the tokenizer)
+    Attr.LEMMA: "tagger",
+    Attr.TAG: "tagger",
+    Attr.POS: "tagger",
+    Attr.ENT_TYPE: "ner",
+    Attr.ENT_IOB: "ner",
+    Attr.DEP: "parser",
+    Attr.HEAD: "parser",
+}
+COMPONENTS = ("tagger", "parser", "ner")
+SENTENCE_ATTRS = (Attr.HEAD,)  # Sentence boundaries are determined by the dependency parser
+
+
+def get_attrs(attrs=None):
+    """List of given Attrs (default: all) in the order they are saved in"""
+    return list(Attr) if attrs is None else [a for a in Attr if a in attrs]
+
+
+def get_components(attrs=None):
+    """Set of spaCy pipeline component names required for the given Attrs (default: all)"""
+    return {ATTR_COMPONENTS[a] for a in get_attrs(attrs) if a in ATTR_COMPONENTS}
+
+
+def get_disabled(instance, attrs=None):
+    """List of pipeline component names of the loaded spaCy model that are not required for the given Attrs"""
+    components = get_components(attrs)
+    return [name for name in instance.pipe_names if name in COMPONENTS and name not in components]
+
+
+def get_nlp(lang="en", attrs=None):
+    """
+    Load spaCy model for a given language, determined by `models' dict or by MODEL_ENV_VAR
+    :param lang: two-letter language code
+    :param attrs: Attrs that will be needed, so that only the pipeline components they require are loaded (default:
+                  all). If the model has already been loaded without some required component, the component is
+                  added to it (see add_components).
+                  Any loaded component that is not required should be disabled when running the pipeline, see
+                  get_disabled.
+    At most `max_models' models are kept loaded: loading another one first unloads the least recently used.
+    """
     instance = nlp.get(lang)
+    components = get_components(attrs)
+    if instance is not None:
+        nlp.move_to_end(lang)  # Most recently used
+        missing = components - loaded_components.get(lang, set(COMPONENTS))
+        if missing and not add_components(instance, lang, missing):
+            components |= loaded_components[lang]
+            instance = None
     if instance is None:
         import spacy
-        model = models.get(lang)
-        if not model:
-            models[lang] = model = os.environ.get("_".join((MODEL_ENV_VAR, lang.upper()))) or \
-                                   os.environ.get(MODEL_ENV_VAR) or DEFAULT_MODEL.get(lang, "xx")
+        if lang not in nlp and max_models > 0:
+            evict_models(max_models - 1)
+        model = get_model_name(lang)
+        disable = [c for c in COMPONENTS if c not in components]
         started = time.time()
         with external_write_mode():
-            print("Loading spaCy model '%s'... " % model, end="", flush=True)
+            print("Loading spaCy model '%s'%s... " % (model, " without %s" % ", ".join(disable) if disable else ""),
+                  end="", flush=True)
             try:
-                nlp[lang] = instance = spacy.load(model)
+                nlp[lang] = instance = spacy.load(model, disable=disable)
             except OSError:
                 spacy.cli.download(model)
                 try:
-                    nlp[lang] = instance = spacy.load(model)
+                    nlp[lang] = instance = spacy.load(model, disable=disable)
                 except OSError as e:
                     raise OSError("Failed to get spaCy model. Download it manually using "
                                   "`python -m spacy download %s`." % model) from e
+            loaded_components[lang] = components
             tokenizer[lang] = instance.tokenizer
             instance.tokenizer = lambda words: spacy.tokens.Doc(instance.vocab, words=words)
             print("Done (%.3fs)." % (time.time() - started))
     return instance
 
 
+def get_model_name(lang="en"):
+    """Name of spaCy model for a given language, determined by `models' dict or by MODEL_ENV_VAR"""
+    model = models.get(lang)
+    if not model:
+        models[lang] = model = os.environ.get("_".join((MODEL_ENV_VAR, lang.upper()))) or \
+                               os.environ.get(MODEL_ENV_VAR) or DEFAULT_MODEL.get(lang, "xx")
+    return model
+
+
+def get_model_version(lang="en"):
+    """Version of spaCy model for a given language, from its package if installed (without loading the model)"""
+    model = get_model_name(lang)
+    version = model_versions.get(model)
+    if version is None:
+        try:
+            try:
+                from importlib.metadata import version as package_version
+            except ImportError:  # Python < 3.8
+                from pkg_resources import get_distribution
+                version = get_distribution(model).version
+            else:
+                version = package_version(model)
+        except Exception:  # Not installed as a package, e.g. loaded from a directory
+            try:
+                with open(os.path.join(model, "meta.json"), encoding="utf-8") as f:
+                    version = json.load(f).get("version", "")
+            except (IOError, ValueError):
+                version = get_nlp(lang, attrs=()).meta.get("version", "")
+        model_versions[model] = version
+    return version
+
+
+def add_components(instance, lang, components):
+    """
+    Add pipeline components to a spaCy model that was loaded without them, loading them from the model directory
+    rather than loading the whole model again
+    :param instance: spaCy model for the given language, as returned by get_nlp
+    :param lang: two-letter language code
+    :param components: names of pipeline components to add
+    :return whether the components were added (False if the model was not loaded from a directory)
+    """
+    path = getattr(instance, "path", None)
+    if path is None:
+        return False
+    pipeline = instance.meta.get("pipeline", COMPONENTS)
+    started = time.time()
+    with external_write_mode():
+        print("Loading %s for spaCy model '%s'... " % (", ".join(sorted(components)), get_model_name(lang)),
+              end="", flush=True)
+        for name in pipeline:
+            if name in components and name not in instance.pipe_names:
+                component = instance.create_pipe(name, config=instance.meta.get("pipeline_args", {}).get(name, {}))
+                component.from_disk(path / name, vocab=False)
+                following = [n for n in instance.pipe_names
+                             if n in pipeline and pipeline.index(n) > pipeline.index(name)]
+                if following:
+                    instance.add_pipe(component, name=name, before=following[0])
+                else:
+                    instance.add_pipe(component, name=name)
+        print("Done (%.3fs)." % (time.time() - started))
+    loaded_components[lang] |= components
+    return True
+
+
+def evict_models(size=0):
+    """Unload least recently used spaCy models until at most `size' remain loaded"""
+    evicted = False
+    while nlp and len(nlp) > max(size, 0):
+        lang, _ = nlp.popitem(last=False)
+        tokenizer.pop(lang, None)
+        loaded_components.pop(lang, None)
+        evicted = True
+    if evicted:
+        gc.collect()
+
+
 models = {}  # maps language two-letter code to name of spaCy model
-nlp = {}  # maps language two-letter code to actual loaded spaCy model
+model_versions = {}  # maps name of spaCy model to its version
+nlp = OrderedDict()  # maps language two-letter code to actual loaded spaCy model, from least to most recently used
 tokenizer = {}  # maps language two-letter code to tokenizer of spaCy model
+loaded_components = {}  # maps language two-letter code to set of pipeline components loaded in the spaCy model
+max_models = int(os.environ.get(MAX_MODELS_ENV_VAR) or DEFAULT_MAX_MODELS)  # maximum models kept loaded, 0 for any
+
 
+def get_tokenizer(tokenized=False, lang="en", whitespace=False):
+    """
+    Get a function from text to a sequence of tokens, each having `orth_' and `is_punct' attributes
+    :param tokenized: input is already a list of tokens, so just wrap them (spaCy model is not loaded)
+    :param lang: two-letter language code of spaCy model to tokenize by
+    :param whitespace: input is a string of tokens separated by whitespace (spaCy model is not loaded)
+    """
+    if tokenized:
+        return pretokenized
+    if whitespace:
+        return lambda text: pretokenized(text.split())
+    get_nlp(lang, attrs=())
+    return tokenizer[lang]
+
+
+def tokenize_all(lines, tokenized=False, lang="en", whitespace=False, batch_size=None, n_process=1):
+    """
+    Tokenize lines of text, keeping their order
+    :param lines: iterable of strings (or of lists of tokens, if tokenized=True)
+    :param tokenized: whether each line is already a list of tokens
+    :param lang: two-letter language code of spaCy model to tokenize by
+    :param whitespace: whether each line is a string of tokens separated by whitespace
+    :param batch_size: if given, feed lines to the spaCy tokenizer in batches of this size
+    :param n_process: number of processes to tokenize in, each loading its own tokenizer (default: 1, no pool)
+    :return generator of (line, tokens) pairs, where each token has `orth_' and `is_punct' attributes
+    """
+    if n_process > 1 and not tokenized:
+        yield from _tokenize_in_pool(iter(lines), lang, whitespace, batch_size or BATCH_SIZE, n_process)
+        return
+    instance = get_tokenizer(tokenized, lang=lang, whitespace=whitespace)
+    if batch_size and hasattr(instance, "pipe"):
+        lines, to_tokenize = tee(lines)
+        yield from zip(lines, instance.pipe(to_tokenize, batch_size=batch_size))
+    else:
+        for line in lines:
+            yield line, instance(line)
+
+
+def _tokenize_in_pool(lines, lang, whitespace, batch_size, n_process):
+    """Tokenize batches of lines in a process pool, keeping at most 2 * n_process batches in flight"""
+    from multiprocessing import Pool
+    pending = deque()
+    with Pool(n_process) as pool:
+        for batch in iter(lambda: list(islice(lines, batch_size)), []):
+            pending.append((batch, pool.apply_async(tokenize_batch, (batch, lang, whitespace))))
+            if len(pending) > 2 * n_process:
+                batch, result = pending.popleft()
+                yield from zip(batch, result.get())
+        while pending:
+            batch, result = pending.popleft()
+            yield from zip(batch, result.get())
+
+
+def tokenize_batch(lines, lang="en", whitespace=False):
+    """Tokenize a list of lines, returning lists of picklable tokens (used as worker function by tokenize_all)"""
+    return [[Token(t.orth_, t.is_punct) for t in tokens]
+            for _, tokens in tokenize_all(lines, lang=lang, whitespace=whitespace, batch_size=len(lines))]
+
+
+Token = namedtuple("Token", ("orth_", "is_punct"))
 
-def get_tokenizer(tokenized=False, lang="en"):
-    instance = get_nlp(lang)
-    return instance.tokenizer if tokenized else tokenizer[lang]
+
+def pretokenized(words):
+    """Wrap given token strings as tokens, classifying punctuation like spaCy does, without loading a model"""
+    return [Token(word, is_punct_text(word)) for word in words]
+
+
+def is_punct_text(text):
+    """Whether all characters in the string are in a Unicode punctuation category (same as spaCy's is_punct)"""
+    return all(unicodedata.category(c).startswith("P") for c in text)
 
 
 def get_vocab(vocab=None, lang=None):
     if vocab is not None:
         return vocab
-    return (get_nlp(lang) if lang else get_nlp()).vocab
+    return get_nlp(lang or "en", attrs=()).vocab
 
 
 def get_word_vectors(dim=None, size=None, filename=None, vocab=None):
@@ -114,9 +314,10 @@ def get_word_vectors(dim=None, size=None, filename=None, vocab=None):
     :param vocab: instead of strings, look up keys of returned dict in vocab (use lang str, e.g. "en", for spaCy vocab)
     :return: tuple of (dict of word [string or integer] -> vector [NumPy array], dimension)
     """
+    from tqdm import tqdm
     orig_keys = vocab is None
     if isinstance(vocab, str) or not filename:
-        vocab = get_nlp(vocab if isinstance(vocab, str) else "en").vocab
+        vocab = get_nlp(vocab if isinstance(vocab, str) else "en", attrs=()).vocab
 
     def _lookup(word):
         try:
@@ -151,6 +352,7 @@ def read_word_vectors(dim, size, filename):
     :param filename: text file to load vectors from
     :return: generator: first element is (#vectors, #dims); and all the rest are (word [string], vector [NumPy array])
     """
+    import numpy as np
     try:
         first_line = True
         nr_row = nr_dim = None
@@ -177,6 +379,136 @@ def read_word_vectors(dim, size, filename):
         raise IOError("Failed loading word vectors from '%s'" % filename) from e
 
 
+def word_key(word):
+    """Stable 64-bit hash of a word, used to index WordVectors"""
+    import hashlib
+    return int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class WordVectors:
+    """
+    Word vectors saved in binary files: the vectors as a NumPy matrix (".npy"), and a vocabulary index of sorted word
+    hashes (".keys.npy") with their rows in the matrix (".rows.npy"), plus the words in row order (".words.txt").
+    All arrays are memory-mapped, so opening is immediate regardless of size, and pages are shared between processes.
+    """
+    def __init__(self, prefix):
+        """
+        :param prefix: path prefix of the binary files, as created by WordVectors.convert
+        """
+        import numpy as np
+        self.prefix = prefix
+        self.vectors = np.load(prefix + ".npy", mmap_mode="r")
+        self.keys = np.load(prefix + ".keys.npy", mmap_mode="r")
+        self.rows = np.load(prefix + ".rows.npy", mmap_mode="r")
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def index(self, words):
+        """:return array of row indices in the vectors matrix for the given words, with -1 for unknown words"""
+        import numpy as np
+        keys = np.fromiter(map(word_key, words), dtype=np.uint64)
+        positions = np.searchsorted(self.keys, keys).clip(max=max(len(self.keys) - 1, 0))
+        found = self.keys[positions] == keys if len(self.keys) else np.zeros(len(keys), dtype=bool)
+        return np.where(found, self.rows[positions], -1)
+
+    def lookup(self, words, default=0):
+        """:return matrix of vectors for the given words (one gather), with rows filled by `default' if unknown"""
+        import numpy as np
+        rows = self.index(words)
+        found = rows >= 0
+        matrix = np.full((len(rows), self.dim), default, dtype=self.vectors.dtype)
+        matrix[found] = self.vectors[rows[found]]
+        return matrix
+
+    def lookup_passage(self, passage, default=0):
+        """:return matrix of vectors for all Terminals of the passage, in order"""
+        return self.lookup([t.text for t in extract_terminals(passage)], default=default)
+
+    def __contains__(self, word):
+        return self.index([word])[0] >= 0
+
+    def __getitem__(self, word):
+        row = self.index([word])[0]
+        if row < 0:
+            raise KeyError(word)
+        return self.vectors[row]
+
+    def words(self):
+        """:return generator of words in the order of the rows"""
+        with open(self.prefix + ".words.txt", encoding="utf-8") as f:
+            for line in f:
+                yield line.rstrip("\n")
+
+    @staticmethod
+    def get_prefix(filename, dim=None, size=None):
+        return filename + ("" if dim is None and size is None else ".%sx%s" % (size or "", dim or ""))
+
+    @classmethod
+    def convert(cls, filename, dim=None, size=None, prefix=None):
+        """
+        Convert word vectors text file (as read by read_word_vectors) to binary files
+        :param filename: text file to load vectors from
+        :param dim: dimension to trim vectors to
+        :param size: maximum number of vectors to load
+        :param prefix: path prefix of binary files to create (default: by file name, dimension and size)
+        :return: WordVectors opened from the created files
+        """
+        import numpy as np
+        if prefix is None:
+            prefix = cls.get_prefix(filename, dim, size)
+        it = read_word_vectors(dim, size, filename)
+        nr_row, nr_dim = next(it)
+        words = []
+        if nr_row:  # Number of rows is known in advance, so write directly to file
+            vectors = np.lib.format.open_memmap(prefix + ".tmp.npy", mode="w+", dtype="f", shape=(nr_row, nr_dim))
+            for word, vector in islice(it, nr_row):
+                vectors[len(words)] = vector
+                words.append(word)
+            vectors.flush()
+            if len(words) < nr_row:  # Some lines were skipped
+                np.save(prefix + ".npy", vectors[:len(words)])
+                del vectors
+                os.remove(prefix + ".tmp.npy")
+            else:
+                del vectors
+                os.replace(prefix + ".tmp.npy", prefix + ".npy")
+        else:
+            rows = []
+            for word, vector in it:
+                rows.append(vector)
+                words.append(word)
+            np.save(prefix + ".npy", np.array(rows, dtype="f").reshape(len(rows), nr_dim))
+        keys = np.fromiter(map(word_key, words), dtype=np.uint64, count=len(words))
+        keys, rows = np.unique(keys, return_index=True)  # Sorted, keeping the first row of any repeated word
+        np.save(prefix + ".keys.npy", keys)
+        np.save(prefix + ".rows.npy", rows.astype(np.int64))
+        with open(prefix + ".words.txt", "w", encoding="utf-8") as f:
+            f.writelines(word + "\n" for word in words)
+        return cls(prefix)
+
+    @classmethod
+    def load(cls, filename, dim=None, size=None):
+        """
+        Open binary word vectors for a text file, converting it first if not done yet or if the text file is newer
+        :param filename: text file to load vectors from
+        :param dim: dimension to trim vectors to
+        :param size: maximum number of vectors to load
+        :return: WordVectors
+        """
+        prefix = cls.get_prefix(filename, dim, size)
+        try:
+            if os.path.getmtime(prefix + ".words.txt") >= os.path.getmtime(filename):
+                return cls(prefix)
+        except OSError:  # Not converted yet
+            pass
+        return cls.convert(filename, dim=dim, size=size, prefix=prefix)
+
+
 def annotate(passage, *args, **kwargs):
     """
     Run spaCy pipeline on the given passage, unless already annotated
@@ -185,17 +517,29 @@ def annotate(passage, *args, **kwargs):
     list(annotate_all([passage], *args, **kwargs))
 
 
-def annotate_as_tuples(passages, replace=False, as_array=False, lang="en", vocab=None, verbose=False):
+def annotate_as_tuples(passages, replace=False, as_array=False, lang="en", vocab=None, verbose=False, n_process=1,
+                       batch_size=BATCH_SIZE, cache=None, attrs=None):
+    cache = get_annotation_cache(cache)
     for passage_lang, passages_by_lang in groupby(passages, get_lang):
-        for need_annotation, stream in groupby(to_annotate(passages_by_lang, replace, as_array), lambda x: bool(x[0])):
-            annotated = get_nlp(passage_lang or lang).pipe(
-                stream, as_tuples=True, n_threads=N_THREADS, batch_size=BATCH_SIZE) if need_annotation else stream
-            annotated = set_docs(annotated, as_array, passage_lang or lang, vocab, replace, verbose)
+        for need_annotation, stream in groupby(to_annotate(passages_by_lang, replace, as_array, attrs),
+                                               lambda x: bool(x[0])):
+            if not need_annotation:
+                annotated = stream
+            elif cache is not None:
+                annotated = _annotate_with_cache(stream, passage_lang or lang, batch_size, n_process, cache, attrs)
+            elif n_process > 1:
+                annotated = _annotate_in_pool(stream, passage_lang or lang, batch_size, n_process, attrs)
+            else:
+                instance = get_nlp(passage_lang or lang, attrs)
+                annotated = instance.pipe(stream, as_tuples=True, n_threads=N_THREADS, batch_size=batch_size,
+                                          disable=get_disabled(instance, attrs))
+            annotated = set_docs(annotated, as_array, passage_lang or lang, vocab, replace, verbose, attrs)
             for passage, passages in groupby(annotated, itemgetter(0)):
                 yield deque(passages, maxlen=1).pop()  # Wait until all paragraphs have been annotated
 
 
-def annotate_all(passages, replace=False, as_array=False, as_tuples=False, lang="en", vocab=None, verbose=False):
+def annotate_all(passages, replace=False, as_array=False, as_tuples=False, lang="en", vocab=None, verbose=False,
+                 n_process=1, batch_size=BATCH_SIZE, cache=None, attrs=None, lang_window=None):
     """
     Run spaCy pipeline on the given passages, unless already annotated
     :param passages: iterable of Passage objects, whose layer 0 nodes will be added entries in the `extra' dict
@@ -205,59 +549,310 @@ def annotate_all(passages, replace=False, as_array=False, as_tuples=False, lang=
     :param lang: optional two-letter language code, will be overridden if passage has "lang" attrib
     :param vocab: optional dictionary of vocabulary IDs to string values, to avoid loading spaCy model
     :param verbose: whether to print annotated text
+    :param n_process: number of processes to run the spaCy pipeline in, each loading its own model (default: 1, no pool)
+    :param batch_size: number of paragraphs to annotate together (and to send to each process at a time)
+    :param cache: AnnotationCache or directory to cache annotations in, so that paragraphs with the same tokens are
+                  not annotated again (default: the directory in the UCCA_ANNOTATION_CACHE environment variable)
+    :param attrs: Attrs to annotate (default: all), so that only the pipeline components they require are run
+                  (other values are left as they are, or None if as_array=True)
+    :param lang_window: number of passages to read ahead and annotate grouped by language, so that each spaCy model is
+                        used once per window rather than switched whenever the language changes (default: no grouping).
+                        Passages are still returned in the input order.
     :return generator of annotated passages, which are actually modified in-place (same objects as input)
     """
     if not as_tuples:
         passages = ((p,) for p in passages)
-    for t in annotate_as_tuples(passages, replace=replace, as_array=as_array, lang=lang, vocab=vocab, verbose=verbose):
+
+    def _annotate(contexts):
+        return annotate_as_tuples(contexts, replace=replace, as_array=as_array, lang=lang, vocab=vocab,
+                                  verbose=verbose, n_process=n_process, batch_size=batch_size, cache=cache,
+                                  attrs=attrs)
+
+    for t in reorder_by(passages, lambda c: get_lang(c) or lang, _annotate, lang_window) if lang_window else \
+            _annotate(passages):
         yield t if as_tuples else t[0]
 
 
+def reorder_by(items, key, process, window):
+    """
+    Process items grouped by a key within each window of consecutive items, but yield the outputs in the input order
+    :param items: iterable of items
+    :param key: function from item to a sortable value to group by
+    :param process: function from iterable of items to iterable of outputs, one per item and in the same order
+    :param window: number of items to group together
+    :return generator of outputs of process, in the order of the corresponding input items
+    """
+    items = iter(items)
+    for chunk in iter(lambda: list(islice(items, window)), []):
+        order = sorted(range(len(chunk)), key=lambda i: key(chunk[i]))  # Stable, so order within groups is kept
+        outputs = len(chunk) * [None]
+        for i, output in zip(order, process(chunk[i] for i in order)):
+            outputs[i] = output
+        yield from outputs
+
+
+def _annotate_in_pool(stream, lang, batch_size, n_process, attrs=None):
+    """Annotate batches of paragraphs in a process pool, keeping at most 2 * n_process batches in flight
+    :return generator of ((attribute array, strings), context) pairs, in the same order as the input
+            (list of tokens, context) pairs
+    """
+    from multiprocessing import Pool
+    pending = deque()
+    with Pool(n_process) as pool:
+        for batch in iter(lambda: list(islice(stream, batch_size)), []):
+            tokens, contexts = zip(*batch)
+            pending.append((contexts, pool.apply_async(annotate_batch, (tokens, lang, attrs))))
+            if len(pending) > 2 * n_process:
+                contexts, result = pending.popleft()
+                yield from zip(result.get(), contexts)
+        while pending:
+            contexts, result = pending.popleft()
+            yield from zip(result.get(), contexts)
+
+
+def _annotate_with_cache(stream, lang, batch_size, n_process, cache, attrs=None):
+    """Annotate paragraphs, taking the annotation from the cache when available and adding it otherwise.
+    Cached annotations are yielded as soon as all preceding paragraphs are annotated, and the spaCy model (or the
+    process pool) is only loaded when some paragraph is not found in the cache.
+    :return generator of ((attribute array, strings), context) pairs, in the same order as the input
+            (list of tokens, context) pairs
+    """
+    def _batches():
+        # Each batch has up to batch_size paragraphs missing from the cache, or just one paragraph found in the cache
+        entries, misses = [], []  # [key, annotation (None until annotated), context] for each paragraph, in order
+        for tokens, context in stream:
+            key = cache.key(tokens, lang, attrs)
+            entry = [key, cache.get(key), context]
+            entries.append(entry)
+            if entry[1] is None:
+                misses.append((tokens, entry))
+            if not misses or len(misses) == batch_size:
+                yield entries, misses
+                entries, misses = [], []
+        if entries:
+            yield entries, misses
+
+    def _collect(entries, misses, annotations):
+        for (_, entry), annotation in zip(misses, annotations.get() if hasattr(annotations, "get") else annotations):
+            entry[1] = annotation
+            cache.put(entry[0], *annotation)
+        for _, annotation, context in entries:
+            yield annotation, context
+
+    pending = deque()  # (entries, misses, annotations or async result of annotating the misses) for each batch
+    with ExitStack() as stack:
+        pool = None
+        for entries, misses in _batches():
+            annotations = ()
+            if misses:
+                token_lists = [tokens for tokens, _ in misses]
+                if n_process > 1:
+                    if pool is None:
+                        from multiprocessing import Pool
+                        pool = stack.enter_context(Pool(n_process))
+                    annotations = pool.apply_async(annotate_batch, (token_lists, lang, attrs))
+                else:
+                    annotations = annotate_batch(token_lists, lang, attrs)
+            pending.append((entries, misses, annotations))
+            while pending and (len(pending) > 2 * n_process or not hasattr(pending[0][2], "ready") or
+                               pending[0][2].ready()):
+                yield from _collect(*pending.popleft())
+        while pending:
+            yield from _collect(*pending.popleft())
+
+
+def annotate_batch(token_lists, lang="en", attrs=None):
+    """
+    Run spaCy pipeline on lists of tokens (used as worker function by annotate_all)
+    :return list of (attribute array, strings) pairs as returned by doc_to_array, one per list of tokens
+    """
+    instance = get_nlp(lang, attrs)
+    return [doc_to_array(doc, attrs) for doc in instance.pipe(token_lists, batch_size=len(token_lists),
+                                                             disable=get_disabled(instance, attrs))]
+
+
+def doc_to_array(doc, attrs=None):
+    """
+    Convert spaCy Doc to compact form that can be pickled or saved, and used to annotate passages by set_docs
+    :param doc: spaCy Doc
+    :param attrs: Attrs to include (default: all)
+    :return tuple of (array of attribute values as returned by Doc.to_array, one column per Attr in get_attrs(attrs);
+                      list of strings whose IDs appear in the array, to resolve them in any vocab)
+    """
+    from spacy import attrs as spacy_attrs
+    attrs = get_attrs(attrs)
+    arr = doc.to_array([getattr(spacy_attrs, a.name) for a in attrs])
+    strings = []
+    for i in {int(i) for j, a in enumerate(attrs) if a not in (Attr.ENT_IOB, Attr.HEAD) for i in arr[:, j]}:
+        try:
+            strings.append(doc.vocab.strings[i])
+        except KeyError:
+            pass
+    return arr, strings
+
+
+class AnnotationCache:
+    """
+    Cache of paragraph annotations, keyed by the tokens and by the spaCy model name and version.
+    Recently used annotations are kept in memory, and if a directory is given, all are saved there too (as .npz files)
+    so that they are available to subsequent runs. When the total size of the directory exceeds the maximum, the least
+    recently used files are removed.
+    """
+    def __init__(self, directory=None, max_size=DEFAULT_ANNOTATION_CACHE_SIZE, memory_size=DEFAULT_MEMORY_CACHE_SIZE):
+        """
+        :param directory: directory to save annotations in, created if it does not exist (default: memory only)
+        :param max_size: maximum total size of saved annotations in bytes
+        :param memory_size: maximum number of annotations to keep in memory
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.memory_size = memory_size
+        self.memory = OrderedDict()
+        self._size = None  # Total size of files, calculated when first needed
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(tokens, lang="en", attrs=None):
+        import hashlib
+        return hashlib.sha1(json.dumps([get_model_name(lang), get_model_version(lang),
+                                        [a.name for a in get_attrs(attrs)], list(tokens)]).encode()).hexdigest()
+
+    def get(self, key):
+        """:return (attribute array, strings) pair as returned by doc_to_array, or None if not cached"""
+        import numpy as np
+        annotation = self.memory.get(key)
+        if annotation is not None:
+            self.memory.move_to_end(key)
+        elif self.directory is not None:
+            path = self._path(key)
+            try:
+                with np.load(path) as f:
+                    annotation = f["arr"], list(f["strings"])
+                os.utime(path)  # Mark as recently used
+            except (IOError, ValueError, KeyError):  # Not cached yet, or removed or corrupted meanwhile
+                return None
+            self._remember(key, annotation)
+        return annotation
+
+    def put(self, key, arr, strings):
+        import numpy as np
+        self._remember(key, (arr, strings))
+        if self.directory is not None:
+            path = self._path(key)
+            temp = "%s.%d.tmp.npz" % (path, os.getpid())
+            np.savez(temp, arr=arr, strings=np.array(strings, dtype=str))
+            os.replace(temp, path)  # Atomic, so that concurrent readers never see a partial file
+            if self._size is None:
+                self.evict(self.max_size)  # Calculates the size too
+            else:
+                self._size += os.path.getsize(path)
+                if self._size > self.max_size:
+                    self.evict()
+
+    def evict(self, target_size=None):
+        """
+        Removes least recently used files until their total size is at most target_size
+        :param target_size: size in bytes to reduce to (default: 90% of the maximum)
+        """
+        if target_size is None:
+            target_size = int(.9 * self.max_size)
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz") and ".tmp" not in name:
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:  # Removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if self._size <= target_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:  # Removed by another process
+                pass
+            self._size -= size
+
+    def _remember(self, key, annotation):
+        self.memory[key] = annotation
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+
+def get_annotation_cache(cache=None):
+    """
+    :param cache: AnnotationCache, directory name, or None to use the directory in ANNOTATION_CACHE_ENV_VAR if set
+    :return: AnnotationCache, or None if caching is not enabled
+    """
+    if cache is None:
+        cache = os.environ.get(ANNOTATION_CACHE_ENV_VAR)
+    return AnnotationCache(cache) if cache and isinstance(cache, str) else cache or None
+
+
 def get_lang(passage_context):
     return passage_context[0].attrib.get("lang")
 
 
-def to_annotate(passage_contexts, replace, as_array):
+def to_annotate(passage_contexts, replace, as_array, attrs=None):
     """Filter passages to get only those that require annotation; split to paragraphs and return generator of
     (list of tokens, (paragraph index, list of Terminals, Passage) + original context appended) tuples"""
-    return (([t.text for t in terminals] if replace or not is_annotated(passage, as_array) else (),
+    return (([t.text for t in terminals] if replace or not is_annotated(passage, as_array, attrs) else (),
              (i, terminals, passage) + tuple(context)) for passage, *context in passage_contexts
             for i, terminals in enumerate(break2paragraphs(passage, return_terminals=True)))
 
 
-def is_annotated(passage, as_array):
-    """Whether the passage is already annotated or only partially annotated"""
+def is_annotated(passage, as_array, attrs=None):
+    """Whether the passage is already annotated or only partially annotated
+    :param attrs: Attrs to check (default: all, and if as_array=True just check that there is a value array)"""
     l0 = passage.layer(layer0.LAYER_ID)
     if as_array:
         docs = l0.extra.get("doc")
         return not l0.all or docs is not None and len(docs) == max(t.paragraph for t in l0.all) and \
             sum(map(len, docs)) == len(l0.all) and \
-            all(i is None or isinstance(i, int) for l in docs for t in l for i in t)
-    return all(a.key in t.extra for t in l0.all for a in Attr)
+            all(i is None or isinstance(i, int) for l in docs for t in l for i in t) and \
+            (attrs is None or all(t[a.value] is not None for l in docs for t in l for a in attrs))
+    return all(a.key in t.extra for t in l0.all for a in get_attrs(attrs))
 
 
-def set_docs(annotated, as_array, lang, vocab, replace, verbose):
-    """Given spaCy annotations, set values in layer0.extra per paragraph if as_array=True, or else in Terminal.extra"""
+def set_docs(annotated, as_array, lang, vocab, replace, verbose, attrs=None):
+    """Given spaCy annotations (Doc objects or pairs returned by doc_to_array), set values in layer0.extra per
+    paragraph if as_array=True, or else in Terminal.extra
+    :param attrs: Attrs that have been annotated, in the annotation arrays (default: all)"""
+    attrs = get_attrs(attrs)
     for doc, (i, terminals, passage, *context) in annotated:
-        if doc:  # Not empty, so copy values
-            from spacy import attrs
-            arr = doc.to_array([getattr(attrs, a.name) for a in Attr])
+        if len(doc):  # Not empty, so copy values
+            if isinstance(doc, tuple):  # Already converted to array by doc_to_array
+                arr, strings = doc
+                string_store = getattr(get_vocab(vocab, lang), "strings", None)
+                for string in strings if string_store is not None else ():
+                    string_store.add(string)  # Make sure IDs of new strings (e.g. OOV words) are resolvable here too
+            else:
+                from spacy import attrs as spacy_attrs
+                arr = doc.to_array([getattr(spacy_attrs, a.name) for a in attrs])
             if as_array:
                 docs = passage.layer(layer0.LAYER_ID).docs(i + 1)
                 existing = docs[i] + (len(arr) - len(docs[i])) * [len(Attr) * [None]]
-                docs[i] = [[a(v if e is None or replace else e, get_vocab(vocab, lang), as_array=True)
-                            for a, v, e in zip(Attr, values, es)] for values, es in zip(arr, existing)]
+                docs[i] = [[a(v if v is not None and (e is None or replace) else e, get_vocab(vocab, lang),
+                              as_array=True) for a, v, e in zip(Attr, _all_columns(values, attrs), es)]
+                           for values, es in zip(arr, existing)]
             else:
                 for terminal, values in zip(terminals, arr):
-                    for attr, value in zip(Attr, values):
+                    for attr, value in zip(attrs, values):
                         if replace or not terminal.extra.get(attr.key):
                             terminal.extra[attr.key] = attr(value, get_vocab(vocab, lang))
         if verbose:
-            data = [[a.key for a in Attr]] + \
+            data = [[a.key for a in attrs]] + \
                    [[str(a(t.tok[a.value], get_vocab(vocab, lang)) if as_array else t.extra[a.key])
-                     for a in Attr] for j, t in enumerate(terminals)]
+                     for a in attrs] for j, t in enumerate(terminals)]
             width = [max(len(f) for f in t) for t in data]
-            for j in range(len(Attr)):
+            for j in range(len(attrs)):
                 try:
                     print(" ".join("%-*s" % (w, f[j]) for f, w in zip(data, width)))
                 except UnicodeEncodeError:
@@ -266,6 +861,14 @@ def set_docs(annotated, as_array, lang, vocab, replace, verbose):
         yield (passage,) + tuple(context)
 
 
+def _all_columns(values, attrs):
+    """Values for all Attrs, given values for some of them (None for the rest)"""
+    if len(attrs) == len(Attr):
+        return values
+    columns = dict(zip(attrs, values))
+    return [columns.get(a) for a in Attr]
+
+
 SENTENCE_END_MARKS = ('.', '?', '!')
 
 
@@ -280,28 +883,61 @@ def break2sentences(passage, lang="en", *args, **kwargs):
     :return a list of positions in the Passage, each denotes a closing Terminal of a sentence.
     """
     del args, kwargs
-    l1 = passage.layer(layer1.LAYER_ID)
-    terminals = extract_terminals(passage)
-    if not terminals:
-        return []
-    if any(n.outgoing for n in l1.all):  # Passage is labeled
-        ps_ends = [ps.end_position for ps in l1.top_scenes]
-        ps_starts = [ps.start_position for ps in l1.top_scenes]
-        marks = [t.position for t in terminals if t.text in SENTENCE_END_MARKS]
-        # Annotations doesn't always include the ending period (or other mark)
-        # with the parallel scene it closes. Hence, if the terminal before the
-        # mark closed the parallel scene, and this mark doesn't open a scene
-        # in any way (hence it probably just "hangs" there), it's a sentence end
-        marks = [x for x in marks if x in ps_ends or ((x - 1) in ps_ends and x not in ps_starts)]
-    else:  # Not labeled, split using spaCy
-        annotated = get_nlp(lang=lang)([t.text for t in terminals])
-        marks = [span.end for span in annotated.sents]
-    marks = sorted(set(marks + break2paragraphs(passage)))
-    # Avoid punctuation-only sentences
-    if len(marks) > 1:
-        marks = [x for x, y in zip(marks[:-1], marks[1:]) if not all(layer0.is_punct(t) for t in terminals[x:y])] + \
-                [marks[-1]]
-    return marks
+    return next(break2sentences_all([passage], lang=lang))
+
+
+def break2sentences_all(passages, lang="en", batch_size=BATCH_SIZE):
+    """
+    Breaks many passages into sentences, like break2sentences, but running spaCy on unlabeled passages in batches
+    :param passages: iterable of Passage objects
+    :param lang: optional two-letter language code
+    :param batch_size: number of passages to process together
+    :return generator of lists of positions, one list per Passage, each denotes a closing Terminal of a sentence.
+    """
+    passages = iter(passages)
+    while True:
+        batch = list(islice(passages, batch_size))
+        if not batch:
+            return
+        terminals = [extract_terminals(passage) for passage in batch]
+        labeled = [any(n.outgoing for n in passage.layer(layer1.LAYER_ID).all) for passage in batch]
+        unlabeled = [[t.text for t in ts] for ts, is_labeled in zip(terminals, labeled) if ts and not is_labeled]
+        docs = iter(())
+        if unlabeled:  # Split using spaCy
+            instance = get_nlp(lang=lang, attrs=SENTENCE_ATTRS)
+            docs = instance.pipe(unlabeled, batch_size=batch_size, disable=get_disabled(instance, SENTENCE_ATTRS))
+        for passage, ts, is_labeled in zip(batch, terminals, labeled):
+            if not ts:
+                yield []
+                continue
+            marks = _labeled_sentence_marks(passage, [t.text for t in ts]) if is_labeled else \
+                [span.end for span in next(docs).sents]
+            yield _sentence_ends(ts, marks)
+
+
+def _labeled_sentence_marks(passage, texts):
+    scenes = [ps.get_terminals() for ps in passage.layer(layer1.LAYER_ID).top_scenes]  # Once per scene
+    ps_starts = {ts[0].position for ts in scenes if ts}
+    ps_ends = {ts[-1].position for ts in scenes if ts}
+    # Annotations doesn't always include the ending period (or other mark)
+    # with the parallel scene it closes. Hence, if the terminal before the
+    # mark closed the parallel scene, and this mark doesn't open a scene
+    # in any way (hence it probably just "hangs" there), it's a sentence end
+    return [x for x, text in enumerate(texts, start=1) if text in SENTENCE_END_MARKS and (
+        x in ps_ends or (x - 1 in ps_ends and x not in ps_starts))]
+
+
+def _sentence_ends(terminals, marks):
+    # Terminal positions are their indices + 1, so paragraph ends are the indices of paragraph starts
+    import numpy as np
+    paragraph_starts = np.flatnonzero(np.fromiter((t.para_pos == 1 for t in terminals), dtype=bool))
+    ends = np.union1d(np.asarray(marks, dtype=int), np.append(paragraph_starts[paragraph_starts > 0], len(terminals)))
+    # Avoid punctuation-only sentences: count non-punctuation terminals up to each position
+    if len(ends) > 1:
+        words = np.cumsum(np.fromiter((not layer0.is_punct(t) for t in terminals), dtype=int))
+        words = np.insert(words, 0, 0)
+        ends = np.append(ends[:-1][words[ends[1:]] > words[ends[:-1]]], ends[-1])
+    return ends.tolist()
 
 
 def extract_terminals(p):
@@ -349,8 +985,9 @@ def indent_xml(xml_as_string):
 
 @contextmanager
 def external_write_mode(*args, **kwargs):
+    tqdm = sys.modules.get("tqdm")  # If it was never imported there are no progress bars to write around
     try:
-        with tqdm.external_write_mode(*args, **kwargs):
+        with tqdm.tqdm.external_write_mode(*args, **kwargs):
             yield
     except AttributeError:
         yield
@@ -3,7 +3,6 @@ from time import sleep
 import json
 import logging
 import os
-import requests
 
 """
 API code for accessing v1.0 of the UCCAApp server
@@ -56,6 +55,7 @@ class ServerAccessor:
         argparser.add_argument("--user-id", type=int, help="user id, otherwise set by " + USER_ID_ENV_VAR)
 
     def request(self, method, url_suffix, **kwargs):
+        import requests
         response = None
         for _ in range(MAX_RETRIES):
             response = requests.request(method, self.prefix + str(url_suffix), headers=self.headers, **kwargs)